@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""
+benchmark_default_reviewers.py [rules] [files]
+
+Times matching the files in a diff against a set of generated default
+reviewer rules, using the compiled DefaultReviewerMatcher and the old
+approach of compiling and trying each rule in turn.
+"""
+
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'reviewboard.settings')
+
+from reviewboard.reviews.defaultreviewers import DefaultReviewerMatcher
+
+
+def make_rules(num_rules):
+    """
+    Generates rules in the forms commonly used: directory prefixes,
+    file extensions and alternations of directories.
+    """
+    rules = []
+
+    for i in xrange(num_rules):
+        if i % 10 == 0:
+            pattern = r'.*\.ext%d$' % i
+        elif i % 10 == 1:
+            pattern = r'/trunk/(module%d|module%d)/.*' % (i, i + 1)
+        else:
+            pattern = '/trunk/module%d/.*' % i
+
+        rules.append((pattern, [i], [i % 50]))
+
+    return rules
+
+
+def make_paths(num_files, num_rules):
+    rand = random.Random(0)
+
+    return ['/trunk/module%d/src/file%d.%s' %
+            (rand.randint(0, num_rules * 2), i,
+             rand.choice(['c', 'h', 'py', 'ext%d' % (i % num_rules)]))
+            for i in xrange(num_files)]
+
+
+def match_each_rule(rules, paths):
+    """Matches the rules the way add_default_reviewers used to."""
+    people = set()
+    groups = set()
+
+    for pattern, rule_people, rule_groups in rules:
+        regex = re.compile(pattern)
+
+        for path in paths:
+            if regex.match(path):
+                people.update(rule_people)
+                groups.update(rule_groups)
+                break
+
+    return people, groups
+
+
+if __name__ == '__main__':
+    num_rules = 1000
+    num_files = 5000
+
+    if len(sys.argv) > 1:
+        num_rules = int(sys.argv[1])
+
+    if len(sys.argv) > 2:
+        num_files = int(sys.argv[2])
+
+    rules = make_rules(num_rules)
+    paths = make_paths(num_files, num_rules)
+    print "%d rules, %d files" % (num_rules, num_files)
+
+    start = time.time()
+    expected = match_each_rule(rules, paths)
+    print "%-30s %.3f s" % ("Compiling each rule", time.time() - start)
+
+    start = time.time()
+    matcher = DefaultReviewerMatcher(rules)
+    print "%-30s %.3f s" % ("Building the matcher", time.time() - start)
+
+    start = time.time()
+    result = matcher.match(paths)
+    print "%-30s %.3f s" % ("Matching with the matcher", time.time() - start)
+
+    assert result == expected
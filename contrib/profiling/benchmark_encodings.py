@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+benchmark_encodings.py [iterations]
+
+Times the encoding detectors on a corpus of generated files in a mix of
+encodings, decoded with a typical repository encoding list.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'reviewboard.settings')
+
+from reviewboard.diffviewer.encodingdetection import \
+    FullDecodeEncodingDetector, SampledEncodingDetector
+
+
+ENCODINGS = ['utf-8', 'shift-jis', 'iso-8859-15']
+
+TEXT = {
+    'ascii': u'int main(int argc, char **argv) { return 0; }\n',
+    'utf-8': u'/* Grüße, 日本語 */\n',
+    'shift-jis': u'/* 日本語のコメント */\n',
+    'iso-8859-15': u'/* Grüße € */\n',
+}
+
+
+def make_corpus():
+    corpus = []
+
+    for size in (1, 100, 1000, 10000):
+        for encoding, text in TEXT.iteritems():
+            file_encoding = encoding
+
+            if encoding == 'ascii':
+                file_encoding = 'utf-8'
+
+            # Non-ASCII text at the start of the file.
+            corpus.append((text + TEXT['ascii'] * size).encode(file_encoding))
+
+            # Non-ASCII text only at the end of the file.
+            corpus.append((TEXT['ascii'] * size + text).encode(file_encoding))
+
+    return corpus
+
+
+def benchmark(detector, corpus, iterations):
+    start = time.time()
+
+    for i in xrange(iterations):
+        for data in corpus:
+            assert detector.decode(data, ENCODINGS) is not None
+
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2:
+        iterations = int(sys.argv[1])
+    else:
+        iterations = 10
+
+    corpus = make_corpus()
+    print "%d files, %d bytes, %d iterations" % \
+        (len(corpus), sum([len(data) for data in corpus]), iterations)
+
+    for detector in (FullDecodeEncodingDetector(), SampledEncodingDetector()):
+        print "%-30s %.3f s" % (detector.__class__.__name__,
+                                benchmark(detector, corpus, iterations))
@@ -0,0 +1,5 @@
+SEQUENCE = [
+    'unread_review_count',
+    'dashboard_counts',
+    'dashboard_counts_version',
+]
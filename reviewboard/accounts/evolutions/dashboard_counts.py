@@ -0,0 +1,17 @@
+from django.db import models
+
+from django_evolution.mutations import AddField
+
+
+MUTATIONS = [
+    AddField('Profile', 'starred_request_count', models.IntegerField,
+             null=True),
+    AddField('Profile', 'outgoing_request_count', models.IntegerField,
+             null=True),
+    AddField('Profile', 'total_outgoing_request_count', models.IntegerField,
+             null=True),
+    AddField('Profile', 'incoming_request_count', models.IntegerField,
+             null=True),
+    AddField('Profile', 'direct_incoming_request_count', models.IntegerField,
+             null=True),
+]
@@ -0,0 +1,9 @@
+from django.db import models
+
+from django_evolution.mutations import AddField
+
+
+MUTATIONS = [
+    AddField('Profile', 'dashboard_counts_version', models.IntegerField,
+             initial=0),
+]
@@ -0,0 +1,22 @@
+from django.db import models
+
+from django_evolution.mutations import AddField, SQLMutation
+
+
+MUTATIONS = [
+    AddField('ReviewRequestVisit', 'unread_review_count', models.IntegerField,
+             initial=0),
+    SQLMutation('populate_unread_review_count', ["""
+        UPDATE accounts_reviewrequestvisit
+           SET unread_review_count = (
+               SELECT COUNT(*)
+                 FROM reviews_review
+                WHERE reviews_review.review_request_id =
+                      accounts_reviewrequestvisit.review_request_id
+                  AND reviews_review.public
+                  AND reviews_review.timestamp >
+                      accounts_reviewrequestvisit.timestamp
+                  AND reviews_review.user_id !=
+                      accounts_reviewrequestvisit.user_id)
+"""])
+]
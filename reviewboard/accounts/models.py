@@ -9,6 +9,17 @@ from djblets.util.db import ConcurrencyManager
 from reviewboard.reviews.models import Group, ReviewRequest
 
 
+# The fields on Profile that hold the number of review requests in each
+# view of the dashboard sidebar.
+DASHBOARD_COUNT_FIELDS = {
+    'starred': 'starred_request_count',
+    'outgoing': 'outgoing_request_count',
+    'mine': 'total_outgoing_request_count',
+    'incoming': 'incoming_request_count',
+    'to-me': 'direct_incoming_request_count',
+}
+
+
 class ReviewRequestVisit(models.Model):
     """
     A recording of the last time a review request was visited by a user.
@@ -17,10 +28,16 @@ class ReviewRequestVisit(models.Model):
     request they've visited. This is used to keep track of any updates
     to review requests they've already seen, so that we can intelligently
     inform them that new discussions have taken place.
+
+    The number of reviews published by other users since the last visit is
+    kept up to date as reviews are published, so that it doesn't have to be
+    counted when listing review requests.
     """
     user = models.ForeignKey(User, related_name="review_request_visits")
     review_request = models.ForeignKey(ReviewRequest, related_name="visits")
     timestamp = models.DateTimeField(_('last visited'), default=datetime.now)
+    unread_review_count = models.IntegerField(_('unread review count'),
+                                              default=0)
 
     # Set this up with a ConcurrencyManager to help prevent race conditions.
     objects = ConcurrencyManager()
@@ -81,5 +98,53 @@ class Profile(models.Model):
     starred_groups = models.ManyToManyField(Group, blank=True,
                                             related_name="starred_by")
 
+    # Counts of the review requests in the dashboard sidebar. These are
+    # None when they need to be recomputed. See DASHBOARD_COUNT_FIELDS.
+    starred_request_count = models.IntegerField(null=True, default=None,
+                                                blank=True)
+    outgoing_request_count = models.IntegerField(null=True, default=None,
+                                                 blank=True)
+    total_outgoing_request_count = models.IntegerField(null=True,
+                                                       default=None,
+                                                       blank=True)
+    incoming_request_count = models.IntegerField(null=True, default=None,
+                                                 blank=True)
+    direct_incoming_request_count = models.IntegerField(null=True,
+                                                        default=None,
+                                                        blank=True)
+
+    # Incremented whenever the counts are cleared, so that a count that was
+    # started before then isn't stored.
+    dashboard_counts_version = models.IntegerField(default=0)
+
     def __unicode__(self):
         return self.user.username
+
+    def save(self, **kwargs):
+        if self.id:
+            # The dashboard counts are kept up to date with direct updates,
+            # so this copy may be stale. Keep what's stored instead of
+            # writing it back.
+            fields = DASHBOARD_COUNT_FIELDS.values() + \
+                     ['dashboard_counts_version']
+
+            values = Profile.objects.filter(pk=self.id).values(*fields)[0]
+
+            for field, value in values.items():
+                setattr(self, field, value)
+
+        super(Profile, self).save(**kwargs)
+
+    def clear_dashboard_counts(self):
+        """
+        Marks the dashboard sidebar counts as needing to be recomputed.
+
+        This is written to the database right away, and must be called
+        after the changes that affect the counts and the profile have been
+        saved.
+        """
+        from reviewboard.reviews.sidebar import clear_profile_dashboard_counts
+        clear_profile_dashboard_counts([self.user_id])
+
+        for field in DASHBOARD_COUNT_FIELDS.values():
+            setattr(self, field, None)
@@ -66,6 +66,9 @@ def user_preferences(request, template_name='accounts/prefs.html'):
                 form.cleaned_data['syntax_highlighting']
             profile.save()
 
+            # The user's incoming review requests depend on their groups.
+            profile.clear_dashboard_counts()
+
             return HttpResponseRedirect(redirect_to)
     else:
         form = PreferencesForm({
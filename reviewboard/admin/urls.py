@@ -9,6 +9,8 @@ NEWS_FEED = "http://www.reviewboard.org/news/feed/"
 urlpatterns = patterns('reviewboard.admin.views',
     (r'^$', 'dashboard'),
     (r'^cache/$', 'cache_stats'),
+    (r'^scm/$', 'scm_stats'),
+    (r'^scm/metrics/$', 'scm_metrics'),
 
     # Settings
     (r'^settings/general/$', 'site_settings',
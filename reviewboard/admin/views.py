@@ -1,6 +1,7 @@
 from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.models import User
+from django.http import HttpResponse
 from django.core.cache import cache
 from django.shortcuts import render_to_response
 from django.template.context import RequestContext
@@ -12,6 +13,8 @@ from reviewboard.admin.checks import check_updates_required
 from reviewboard.admin.cache_stats import get_cache_stats, get_has_cache_stats
 from reviewboard.reviews.models import Group, DefaultReviewer
 from reviewboard.scmtools.models import Repository
+from reviewboard.scmtools.negativecache import get_negative_cache_stats
+from reviewboard.scmtools.stats import LATENCY_BUCKETS, get_scm_stats
 
 
 @staff_member_required
@@ -42,11 +45,64 @@ def cache_stats(request, template_name="admin/cache_stats.html"):
     return render_to_response(template_name, RequestContext(request, {
         'cache_hosts': cache_stats,
         'cache_backend': cache.__module__,
+        'negative_cache_stats': get_negative_cache_stats(),
         'title': _("Server Cache"),
         'root_path': settings.SITE_ROOT + "admin/db/"
     }))
 
 
+@staff_member_required
+def scm_stats(request, template_name="admin/scm_stats.html"):
+    """
+    Displays statistics on repository operations. This includes the
+    number of calls, failures, latencies and amount of data fetched for
+    each repository.
+    """
+    return render_to_response(template_name, RequestContext(request, {
+        'scm_stats': get_scm_stats(Repository.objects.all()),
+        'max_latency_bucket': LATENCY_BUCKETS[-1],
+        'title': _("Repository Statistics"),
+        'root_path': settings.SITE_ROOT + "admin/db/"
+    }))
+
+
+@staff_member_required
+def scm_metrics(request):
+    """
+    Exports statistics on repository operations in a plain text format
+    that's easy for monitoring systems to scrape.
+
+    Each line is of the form::
+
+        name{repository="...",operation="..."} value
+    """
+    lines = []
+
+    for repository, operations in get_scm_stats(Repository.objects.all()):
+        repository_name = repository.name.replace('\\', '\\\\') \
+                                         .replace('"', '\\"')
+
+        for stats in operations:
+            labels = 'repository="%s",operation="%s"' % \
+                     (repository_name, stats['operation'])
+
+            for counter in ('calls', 'errors', 'not_found', 'bytes',
+                            'time_ms'):
+                lines.append('reviewboard_scm_%s{%s} %s' %
+                             (counter, labels, stats[counter]))
+
+            # Histogram buckets are cumulative in this format.
+            total = 0
+
+            for bound, count in stats['histogram']:
+                total += count
+                lines.append('reviewboard_scm_latency_ms_bucket{%s,le="%s"} %s'
+                             % (labels, bound or '+Inf', total))
+
+    return HttpResponse('\n'.join(lines) + '\n',
+                        mimetype='text/plain; charset=utf-8')
+
+
 @staff_member_required
 def site_settings(request, form_class,
                   template_name="siteconfig/settings.html"):
@@ -0,0 +1,175 @@
+import logging
+import sys
+import threading
+import time
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from django.core.cache import cache
+from django.utils.encoding import smart_str
+from djblets.util.misc import cache_memoize, make_cache_key
+
+
+# The number of seconds a process may hold the lease on a key. If the
+# process dies while holding it, other processes will wait at most this
+# long before computing the result themselves.
+LEASE_EXPIRATION = 30
+
+# The number of seconds to wait for another thread or process to finish
+# computing a result before giving up and computing it ourselves.
+WAIT_TIMEOUT = 30
+
+# The number of seconds between cache checks while waiting on another
+# process.
+POLL_INTERVAL = 0.1
+
+
+class _CacheMiss(Exception):
+    pass
+
+
+class _InFlight(object):
+    """A computation in progress in this process."""
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def _raise_cache_miss():
+    raise _CacheMiss
+
+
+def _get_lease_key(key):
+    return 'coalesce-lease:%s' % md5(smart_str(key)).hexdigest()
+
+
+def coalesced_cache_memoize(key, lookup_callable, large_data=False,
+                            timeout=WAIT_TIMEOUT):
+    """
+    Behaves like cache_memoize, but makes sure only one caller computes
+    the result for a given key at a time.
+
+    When several threads in this process ask for the same key, the first
+    computes the result and the rest wait for it. If it raises an
+    exception, the waiters raise the same exception.
+
+    Across processes, a lease is taken out in the cache before calling
+    lookup_callable. Processes that find the lease already held poll the
+    cache for the result instead of computing it.
+
+    If a result doesn't show up within the timeout, the waiter computes it
+    itself, so a stuck or dead worker never blocks anyone for long.
+    """
+    _in_flight_lock.acquire()
+
+    try:
+        flight = _in_flight.get(key)
+        owner = flight is None
+
+        if owner:
+            flight = _InFlight()
+            _in_flight[key] = flight
+    finally:
+        _in_flight_lock.release()
+
+    if not owner:
+        flight.event.wait(timeout)
+
+        if flight.event.isSet():
+            if flight.exc_info:
+                exc_info = flight.exc_info
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+            return flight.result
+
+        logging.warning("Timed out waiting on another thread to compute "
+                        "%s" % key)
+        return cache_memoize(key, lookup_callable, large_data=large_data)
+
+    try:
+        try:
+            flight.result = _cache_memoize_with_lease(key, lookup_callable,
+                                                      large_data, timeout)
+        except:
+            flight.exc_info = sys.exc_info()
+            raise
+
+        return flight.result
+    finally:
+        _in_flight_lock.acquire()
+
+        try:
+            del _in_flight[key]
+        finally:
+            _in_flight_lock.release()
+
+        flight.event.set()
+
+
+def get_uncached_keys(keys):
+    """
+    Returns the keys from a list that aren't in the cache and aren't being
+    computed by this process or another one.
+
+    The cache is checked with one lookup for all the keys. Large data is
+    stored by cache_memoize in several cache entries, but the entry for the
+    key itself is enough to tell that the data is there.
+    """
+    cache_keys = {}
+
+    for key in keys:
+        cache_keys[make_cache_key(key)] = key
+        cache_keys[_get_lease_key(key)] = key
+
+    found = set([cache_keys[cache_key]
+                 for cache_key in cache.get_many(cache_keys.keys())])
+
+    _in_flight_lock.acquire()
+
+    try:
+        found.update([key for key in keys if key in _in_flight])
+    finally:
+        _in_flight_lock.release()
+
+    return [key for key in keys if key not in found]
+
+
+def _cache_memoize_with_lease(key, lookup_callable, large_data, timeout):
+    try:
+        return cache_memoize(key, _raise_cache_miss, large_data=large_data)
+    except _CacheMiss:
+        pass
+
+    lease_key = _get_lease_key(key)
+
+    if cache.add(lease_key, True, LEASE_EXPIRATION):
+        try:
+            return cache_memoize(key, lookup_callable, large_data=large_data)
+        finally:
+            cache.delete(lease_key)
+
+    # Another process is computing this. Wait for it to show up in the
+    # cache, or for the lease to go away.
+    deadline = time.time() + timeout
+
+    while time.time() < deadline:
+        time.sleep(POLL_INTERVAL)
+
+        try:
+            return cache_memoize(key, _raise_cache_miss,
+                                 large_data=large_data)
+        except _CacheMiss:
+            if cache.get(lease_key) is None:
+                # The other process gave up, most likely due to an error.
+                # Let the caller see the error for itself.
+                break
+
+    return cache_memoize(key, lookup_callable, large_data=large_data)
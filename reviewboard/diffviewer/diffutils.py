@@ -6,6 +6,11 @@ import subprocess
 import tempfile
 from difflib import SequenceMatcher
 
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
 try:
     import pygments
     from pygments.lexers import get_lexer_for_filename
@@ -14,6 +19,7 @@ try:
 except ImportError:
     pass
 
+from django.utils.encoding import smart_str
 from django.utils.html import escape
 from django.utils.http import urlquote
 from django.utils.safestring import mark_safe
@@ -21,13 +27,19 @@ from django.utils.translation import ugettext as _
 
 from djblets.log import log_timed
 from djblets.siteconfig.models import SiteConfiguration
-from djblets.util.misc import cache_memoize
 
 from reviewboard.accounts.models import Profile
 from reviewboard.admin.checks import get_can_enable_syntax_highlighting
+from reviewboard.diffviewer.coalesce import coalesced_cache_memoize, \
+                                           get_uncached_keys
+from reviewboard.diffviewer.encodingdetection import decode_file
 from reviewboard.diffviewer.myersdiff import MyersDiffer
 from reviewboard.diffviewer.smdiff import SMDiffer
+from reviewboard.scmtools.blobstore import get_blob_store
 from reviewboard.scmtools.core import PRE_CREATION, HEAD
+from reviewboard.scmtools.fetchservice import fetch_repository_file, \
+                                              prefetch_repository_files
+from reviewboard.scmtools.negativecache import exclude_missing_files
 
 
 DEFAULT_DIFF_COMPAT_VERSION = 1
@@ -186,29 +198,33 @@ def get_line_changed_regions(oldline, newline):
     return (oldchanges, newchanges)
 
 
-def convert_to_utf8(s, enc):
+def convert_to_utf8(s, enc, repository=None, path=None):
     """
     Returns the passed string as a unicode string. If conversion to UTF-8
     fails, we try the user-specified encoding, which defaults to ISO 8859-15.
     This can be overridden by users inside the repository configuration, which
     gives users repository-level control over file encodings (file-level control
     is really, really hard).
+
+    If a repository and path are given, the encoding that worked for the
+    file is remembered and tried first next time.
     """
     if isinstance(s, unicode):
         return s
     elif isinstance(s, basestring):
-        try:
-            u = unicode(s, 'utf-8')
-            return u
-        except UnicodeError:
-            for e in enc.split(','):
-                try:
-                    u = unicode(s, e)
-                    return u.encode('utf-8')
-                except UnicodeError:
-                    pass
+        encodings = ['utf-8'] + [e.strip() for e in enc.split(',')]
+        result = decode_file(s, encodings, repository, path)
+
+        if result is None:
             raise Exception(_("Diff content couldn't be converted to UTF-8 "
                               "using the following encodings: %s") % enc)
+
+        u, encoding = result
+
+        if encoding == 'utf-8':
+            return u
+        else:
+            return u.encode('utf-8')
     else:
         raise TypeError("Value to convert is unexpected type %s", type(s))
 
@@ -220,24 +236,39 @@ def get_original_file(filediff):
 
     SCM exceptions are passed back to the caller.
     """
-    data = ""
+    repository = filediff.diffset.repository
+    tool = repository.get_scmtool()
+    file = filediff.source_file
+    revision = filediff.source_revision
+
+    key, parent_key = _get_original_file_keys(filediff)
 
-    if filediff.source_revision != PRE_CREATION:
-        def fetch_file(file, revision):
+    def fetch_file(file, revision):
+        # Look in the blob store before going to the repository. It
+        # holds onto files that have fallen out of the cache.
+        data = None
+
+        if blob_store:
+            data = blob_store.get(repository, file, revision)
+
+        if data is None:
             log_timer = log_timed("Fetching file '%s' r%s from %s" %
                                   (file, revision, repository))
-            data = tool.get_file(file, revision)
-            data = convert_line_endings(data)
+            data = fetch_repository_file(repository, file, revision)
             log_timer.done()
-            return data
 
-        repository = filediff.diffset.repository
-        tool = repository.get_scmtool()
-        file = filediff.source_file
-        revision = filediff.source_revision
+            if blob_store:
+                blob_store.put(repository, file, revision, data)
+
+        return convert_line_endings(data)
+
+    def get_base_file():
+        if revision == PRE_CREATION:
+            return ""
 
-        key = "%s:%s:%s" % (filediff.diffset.repository.path, urlquote(file),
-                            revision)
+        if tool.uses_local_storage:
+            # Reading the file is as cheap as reading it from the cache.
+            return convert_line_endings(tool.get_file(file, revision))
 
         # We wrap the result of get_file in a list and then return the first
         # element after getting the result from the cache. This prevents the
@@ -247,14 +278,127 @@ def get_original_file(filediff):
         #
         # Basically, this fixes the massive regressions introduced by the
         # Django unicode changes.
-        data = cache_memoize(key, lambda: [fetch_file(file, revision)],
-                             large_data=True)[0]
+        #
+        # The fetch is coalesced, so that when many people view a new diff
+        # at once, only one of them goes to the repository for each file.
+        return coalesced_cache_memoize(
+            key, lambda: [fetch_file(file, revision)], large_data=True)[0]
+
+    blob_store = get_blob_store()
+
+    if not filediff.parent_diff:
+        return get_base_file()
+
+    # If there's a parent diff set, apply it to the buffer. Patching is
+    # slow, so the result is cached too, keyed on the contents of the
+    # parent diff.
+    if tool.uses_local_storage:
+        return patch(filediff.parent_diff, get_base_file(), file)
+
+    return coalesced_cache_memoize(
+        parent_key,
+        lambda: [patch(filediff.parent_diff, get_base_file(), file)],
+        large_data=True)[0]
+
+
+def _get_original_file_keys(filediff):
+    """
+    Returns the cache keys for the original file of a filediff, and for the
+    file with the parent diff applied. The second is None if there's no
+    parent diff.
+    """
+    key = "%s:%s:%s" % (filediff.diffset.repository.path,
+                        urlquote(filediff.source_file),
+                        filediff.source_revision)
 
-    # If there's a parent diff set, apply it to the buffer.
     if filediff.parent_diff:
-        data = patch(filediff.parent_diff, data, filediff.source_file)
+        parent_key = "%s:parent-%s" % (
+            key, md5(smart_str(filediff.parent_diff)).hexdigest())
+    else:
+        parent_key = None
 
-    return data
+    return key, parent_key
+
+
+def prefetch_original_files(filediff_parts):
+    """
+    Tells the SCMTool for each repository which original files are about
+    to be fetched for the list of (filediff, interfilediff, force_interdiff)
+    tuples, so that it can fetch them up front.
+
+    Files that are in the cache or the blob store, that are being fetched
+    already, or that are known to be missing are left out.
+
+    Failures are logged and otherwise ignored. The files will be fetched
+    normally later on.
+    """
+    filediffs = []
+    keys = []
+
+    for parts in filediff_parts:
+        for filediff in parts[:2]:
+            if (filediff and not filediff.binary and
+                filediff.source_revision != PRE_CREATION):
+                filediffs.append(filediff)
+                keys += [key for key in _get_original_file_keys(filediff)
+                         if key]
+
+    if not filediffs:
+        return
+
+    uncached_keys = set(get_uncached_keys(keys))
+    blob_store = get_blob_store()
+    files_by_repository = {}
+
+    for filediff in filediffs:
+        # If either the original file or the file with the parent diff
+        # applied is cached, the original file doesn't need to be fetched.
+        for key in _get_original_file_keys(filediff):
+            if key and key not in uncached_keys:
+                break
+        else:
+            repository = filediff.diffset.repository
+            file = (filediff.source_file, filediff.source_revision)
+
+            if not blob_store or not blob_store.exists(repository, *file):
+                files = files_by_repository.setdefault(repository, [])
+
+                if file not in files:
+                    files.append(file)
+
+    for repository, files in files_by_repository.iteritems():
+        try:
+            if not repository.get_scmtool().uses_local_storage:
+                files = exclude_missing_files(repository, files)
+
+                if files:
+                    prefetch_repository_files(repository, files)
+        except Exception, e:
+            logging.warning("Unable to prefetch files from %s: %s" %
+                            (repository, e))
+
+
+def cache_original_files(filediffs):
+    """
+    Fetches the original files for a list of filediffs with parent diffs,
+    applying the parent diffs and caching the results, so that the first
+    person to view the diff doesn't have to wait on it.
+
+    Failures are logged and otherwise ignored. The files will be fetched
+    normally when the diff is viewed.
+    """
+    filediffs = [filediff for filediff in filediffs
+                 if filediff.parent_diff and not filediff.binary]
+
+    prefetch_original_files([(filediff, None, False)
+                             for filediff in filediffs])
+
+    for filediff in filediffs:
+        try:
+            get_original_file(filediff)
+        except Exception, e:
+            logging.warning("Unable to apply the parent diff to %s: %s" %
+                            (filediff.source_file, e))
 
 
 def get_patched_file(buffer, filediff):
@@ -355,8 +499,10 @@ def get_chunks(diffset, filediff, interfilediff, force_interdiff,
         new = temp
 
     encoding = diffset.repository.encoding or 'iso-8859-15'
-    old = convert_to_utf8(old, encoding)
-    new = convert_to_utf8(new, encoding)
+    old = convert_to_utf8(old, encoding, diffset.repository,
+                          filediff.source_file)
+    new = convert_to_utf8(new, encoding, diffset.repository,
+                          filediff.dest_file)
 
     # Normalize the input so that if there isn't a trailing newline, we add
     # it.
@@ -549,7 +695,43 @@ def get_diff_files(diffset, filediff=None, interdiffset=None,
     files = []
     index = 0
 
-    for parts in filediff_parts:
+    # The first time chunks have to be generated, let the SCMTool know
+    # which files are coming up so it can fetch them all at once.
+    prefetched = []
+
+    def get_chunks_key(filediff, interfilediff, force_interdiff):
+        key = key_prefix
+
+        if not force_interdiff:
+            key += str(filediff.id)
+        elif interfilediff:
+            key += "interdiff-%s-%s" % (filediff.id, interfilediff.id)
+        else:
+            key += "interdiff-%s-none" % filediff.id
+
+        return key
+
+    def generate_chunks(i, filediff, interfilediff, force_interdiff):
+        if not prefetched:
+            prefetched.append(True)
+
+            # Only the files whose chunks still have to be generated need
+            # to be fetched. The chunks for this file are being generated
+            # now, so they count as in progress.
+            remaining = [parts for parts in filediff_parts[i + 1:]
+                         if not parts[0].binary]
+            uncached_keys = set(get_uncached_keys(
+                [get_chunks_key(*parts) for parts in remaining]))
+
+            prefetch_original_files(
+                [filediff_parts[i]] +
+                [parts for parts in remaining
+                 if get_chunks_key(*parts) in uncached_keys])
+
+        return get_chunks(filediff.diffset, filediff, interfilediff,
+                          force_interdiff, enable_syntax_highlighting)
+
+    for i, parts in enumerate(filediff_parts):
         filediff, interfilediff, force_interdiff = parts
 
         filediff_revision_str = get_revision_str(filediff.source_revision)
@@ -605,21 +787,11 @@ def get_diff_files(diffset, filediff=None, interdiffset=None,
             chunks = []
 
             if not filediff.binary:
-                key = key_prefix
-
-                if not force_interdiff:
-                    key += str(filediff.id)
-                elif interfilediff:
-                    key += "interdiff-%s-%s" % (filediff.id, interfilediff.id)
-                else:
-                    key += "interdiff-%s-none" % filediff.id
-
-                chunks = cache_memoize(
-                    key,
-                    lambda: get_chunks(filediff.diffset,
-                                       filediff, interfilediff,
-                                       force_interdiff,
-                                       enable_syntax_highlighting),
+                chunks = coalesced_cache_memoize(
+                    get_chunks_key(filediff, interfilediff,
+                                   force_interdiff),
+                    lambda: generate_chunks(i, filediff, interfilediff,
+                                            force_interdiff),
                     large_data=True)
 
             file['chunks'] = chunks
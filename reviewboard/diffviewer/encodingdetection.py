@@ -0,0 +1,154 @@
+import codecs
+import threading
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.encoding import smart_str
+
+
+class EncodingDetector(object):
+    """
+    Works out which of a list of encodings a file is in.
+
+    Subclasses implement decode(). The detector used is specified by the
+    DIFF_ENCODING_DETECTOR setting.
+    """
+    def decode(self, data, encodings):
+        """
+        Decodes data using the first encoding in the list that works.
+
+        Returns a (unicode string, encoding) tuple, or None if none of the
+        encodings work.
+        """
+        raise NotImplementedError
+
+
+class FullDecodeEncodingDetector(EncodingDetector):
+    """
+    Tries decoding the whole file with each encoding in turn.
+    """
+    def decode(self, data, encodings):
+        for encoding in encodings:
+            try:
+                return unicode(data, encoding), encoding
+            except UnicodeError:
+                pass
+
+        return None
+
+
+class SampledEncodingDetector(EncodingDetector):
+    """
+    Tries each encoding on the start of the file before decoding the
+    whole file.
+
+    An encoding that can't decode the start of the file can't decode the
+    whole file, so most wrong encodings are ruled out without going
+    through the whole buffer. The sample is decoded incrementally, so a
+    multi-byte character cut off at the end of the sample isn't counted as
+    an error.
+    """
+    SAMPLE_SIZE = 8192
+
+    def decode(self, data, encodings):
+        sample = data[:self.SAMPLE_SIZE]
+        is_sampled = len(sample) < len(data)
+
+        for encoding in encodings:
+            decoder = codecs.getincrementaldecoder(encoding)()
+
+            try:
+                result = decoder.decode(sample, not is_sampled)
+
+                if is_sampled:
+                    result = unicode(data, encoding)
+
+                return result, encoding
+            except UnicodeError:
+                pass
+
+        return None
+
+
+_detector = None
+_detector_lock = threading.Lock()
+
+
+def get_encoding_detector():
+    """
+    Returns the encoding detector configured for this site.
+
+    The class used is specified by the DIFF_ENCODING_DETECTOR setting,
+    which is the full path to an EncodingDetector subclass.
+    """
+    global _detector
+
+    if _detector is None:
+        _detector_lock.acquire()
+
+        try:
+            if _detector is None:
+                class_path = settings.DIFF_ENCODING_DETECTOR
+                i = class_path.rfind('.')
+                module, attr = class_path[:i], class_path[i+1:]
+
+                try:
+                    mod = __import__(module, {}, {}, [attr])
+                except ImportError, e:
+                    raise ImproperlyConfigured, \
+                        'Error importing encoding detector %s: "%s"' % \
+                        (module, e)
+
+                try:
+                    cls = getattr(mod, attr)
+                except AttributeError:
+                    raise ImproperlyConfigured, \
+                        'Module "%s" does not define a "%s" encoding ' \
+                        'detector' % (module, attr)
+
+                _detector = cls()
+        finally:
+            _detector_lock.release()
+
+    return _detector
+
+
+def decode_file(data, encodings, repository=None, path=None):
+    """
+    Decodes the contents of a file using the first encoding in the list
+    that works, returning a (unicode string, encoding) tuple, or None.
+
+    If a repository and path are given, a fallback encoding that worked is
+    remembered and tried next the time a revision of that file is decoded,
+    right after the first encoding in the list. The first encoding, which
+    is UTF-8 for convert_to_utf8, is always tried first. Fallbacks such as
+    ISO 8859-15 can decode any data, so trying a remembered fallback first
+    would garble later revisions of the file that are in UTF-8.
+    """
+    key = None
+    remembered = None
+
+    if repository is not None and path:
+        key = 'diff-encoding:%s:%s' % (repository.id,
+                                       md5(smart_str(path)).hexdigest())
+        remembered = cache.get(key)
+
+        if remembered in encodings[1:]:
+            encodings = [encodings[0], remembered] + \
+                        [e for e in encodings[1:] if e != remembered]
+
+    result = get_encoding_detector().decode(data, encodings)
+
+    # The first encoding is always tried first, so there's no need to
+    # remember it.
+    if (key and result and result[1] != encodings[0] and
+        result[1] != remembered):
+        cache.set(key, result[1], settings.CACHE_EXPIRATION_TIME)
+
+    return result
@@ -4,9 +4,11 @@ from django import forms
 from django.utils.encoding import smart_unicode
 from django.utils.translation import ugettext as _
 
-from reviewboard.diffviewer.diffutils import DEFAULT_DIFF_COMPAT_VERSION
+from reviewboard.diffviewer.diffutils import DEFAULT_DIFF_COMPAT_VERSION, \
+                                            cache_original_files
 from reviewboard.diffviewer.models import DiffSet, FileDiff
 from reviewboard.scmtools.core import PRE_CREATION, UNKNOWN, FileNotFoundError
+from reviewboard.scmtools.negativecache import cached_file_exists
 
 
 class EmptyDiffError(ValueError):
@@ -94,6 +96,8 @@ class UploadDiffForm(forms.Form):
         diffset.repository = self.repository
         diffset.save()
 
+        filediffs = []
+
         for f in files:
             if f.origFile in parent_files:
                 parent_file = parent_files[f.origFile]
@@ -120,6 +124,11 @@ class UploadDiffForm(forms.Form):
                                 parent_diff=parent_content,
                                 binary=f.binary)
             filediff.save()
+            filediffs.append(filediff)
+
+        # Applying parent diffs is slow, so do it now while the parent diff
+        # is at hand, rather than when the diff is first viewed.
+        cache_original_files(filediffs)
 
         return diffset
 
@@ -138,7 +147,8 @@ class UploadDiffForm(forms.Form):
                 revision != UNKNOWN and
                 not f.binary and
                 (check_existance and
-                 not tool.file_exists(filename, revision))):
+                 not cached_file_exists(self.repository, tool, filename,
+                                        revision))):
                 raise FileNotFoundError(filename, revision)
 
             f.origFile = filename
@@ -1,9 +1,16 @@
 import os
+import threading
+import time
 import unittest
 
+from django.core.cache import cache
 from django.test import TestCase
 from djblets.siteconfig.models import SiteConfiguration
 
+from reviewboard.diffviewer.coalesce import coalesced_cache_memoize, \
+                                           get_uncached_keys
+from reviewboard.diffviewer.encodingdetection import SampledEncodingDetector, \
+                                                    decode_file
 from reviewboard.diffviewer.models import DiffSet, FileDiff
 from reviewboard.diffviewer.templatetags.difftags import highlightregion
 import reviewboard.diffviewer.diffutils as diffutils
@@ -302,3 +309,129 @@ class DbTests(TestCase):
 
         filediff = FileDiff.objects.get(pk=filediff.id)
         self.assertEquals(filediff.source_file, long_filename)
+
+
+class CoalesceTests(TestCase):
+    """Unit tests for coalesced cache lookups."""
+
+    def testSingleFlight(self):
+        """Testing that concurrent lookups of a key are coalesced"""
+        calls = []
+        results = []
+
+        def lookup():
+            calls.append(1)
+            time.sleep(0.2)
+            return ['data']
+
+        def worker():
+            results.append(coalesced_cache_memoize('coalesce-test', lookup,
+                                                   large_data=True))
+
+        threads = [threading.Thread(target=worker) for i in range(5)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [['data']] * 5)
+
+    def testErrorsPropagate(self):
+        """Testing that errors in coalesced lookups reach every caller"""
+        def lookup():
+            raise ValueError('lookup failed')
+
+        self.assertRaises(ValueError, coalesced_cache_memoize,
+                          'coalesce-error-test', lookup)
+
+    def testUncachedKeys(self):
+        """Testing finding the keys that aren't cached or in progress"""
+        coalesced_cache_memoize('coalesce-cached', lambda: ['data'],
+                                large_data=True)
+        keys = []
+
+        def lookup():
+            keys.extend(get_uncached_keys(['coalesce-cached',
+                                           'coalesce-in-progress',
+                                           'coalesce-uncached']))
+            return 'data'
+
+        coalesced_cache_memoize('coalesce-in-progress', lookup)
+        self.assertEqual(keys, ['coalesce-uncached'])
+
+
+class EncodingDetectionTests(unittest.TestCase):
+    """Unit tests for encoding detection."""
+    encodings = ['utf-8', 'iso-8859-15']
+
+    def testSampledDetection(self):
+        """Testing SampledEncodingDetector with the encoding in the sample"""
+        detector = SampledEncodingDetector()
+        data = u'\u20ac' + u'x' * detector.SAMPLE_SIZE
+
+        self.assertEqual(detector.decode(data.encode('utf-8'),
+                                         self.encodings),
+                         (data, 'utf-8'))
+        self.assertEqual(detector.decode(data.encode('iso-8859-15'),
+                                         self.encodings),
+                         (data, 'iso-8859-15'))
+
+    def testSampledDetectionPastSample(self):
+        """Testing SampledEncodingDetector with the encoding past the sample"""
+        detector = SampledEncodingDetector()
+        data = u'x' * detector.SAMPLE_SIZE + u'\u20ac'
+
+        self.assertEqual(detector.decode(data.encode('iso-8859-15'),
+                                         self.encodings),
+                         (data, 'iso-8859-15'))
+
+    def testSampledDetectionSplitCharacter(self):
+        """Testing SampledEncodingDetector with a character split at the end"""
+        detector = SampledEncodingDetector()
+        data = u'x' * (detector.SAMPLE_SIZE - 1) + u'\u20ac'
+
+        self.assertEqual(detector.decode(data.encode('utf-8'),
+                                         self.encodings),
+                         (data, 'utf-8'))
+
+    def testNoEncoding(self):
+        """Testing SampledEncodingDetector with no working encoding"""
+        detector = SampledEncodingDetector()
+
+        self.assertEqual(detector.decode('\xff', ['utf-8']), None)
+
+    def testRememberedEncoding(self):
+        """Testing that a remembered encoding doesn't take over from UTF-8"""
+        class FakeRepository(object):
+            id = 'encoding-test'
+
+        repository = FakeRepository()
+        data = u'\u20ac'
+        encodings = ['utf-8', 'iso-8859-15']
+
+        self.assertEqual(decode_file(data.encode('iso-8859-15'), encodings,
+                                     repository, '/readme'),
+                         (data, 'iso-8859-15'))
+        self.assertEqual(decode_file(data.encode('utf-8'), encodings,
+                                     repository, '/readme'),
+                         (data, 'utf-8'))
+
+    def testFirstEncodingNotRemembered(self):
+        """Testing that decode_file doesn't remember the first encoding"""
+        class FakeRepository(object):
+            id = 'encoding-test-first'
+
+        old_set = cache.set
+        cache_sets = []
+        cache.set = lambda *args: cache_sets.append(args)
+
+        try:
+            decode_file('readme', ['utf-8', 'iso-8859-15'],
+                        FakeRepository(), '/readme')
+        finally:
+            cache.set = old_set
+
+        self.assertEqual(cache_sets, [])
@@ -1,9 +1,12 @@
 from django.contrib import admin
 
+from reviewboard.reviews.defaultreviewers import \
+    invalidate_default_reviewers
 from reviewboard.reviews.models import Comment, DefaultReviewer, Group, \
                                        Review, ReviewRequest, \
                                        ReviewRequestDraft, Screenshot, \
                                        ScreenshotComment
+from reviewboard.reviews.sidebar import clear_profile_dashboard_counts
 
 
 class CommentAdmin(admin.ModelAdmin):
@@ -16,10 +19,47 @@ class CommentAdmin(admin.ModelAdmin):
 class DefaultReviewerAdmin(admin.ModelAdmin):
     filter_horizontal = ('people',)
 
+    # The people and groups are saved after save_model, so the matchers
+    # are marked as out of date again once they've been saved.
+    def response_add(self, request, obj, *args, **kwargs):
+        invalidate_default_reviewers()
+        return super(DefaultReviewerAdmin, self).response_add(request, obj,
+                                                              *args, **kwargs)
+
+    def response_change(self, request, obj):
+        invalidate_default_reviewers()
+        return super(DefaultReviewerAdmin, self).response_change(request, obj)
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = ('name', 'display_name', 'mailing_list')
     filter_horizontal = ('users',)
+    exclude = ('incoming_request_count', 'incoming_request_count_version')
+
+    def save_model(self, request, obj, form, change):
+        # The incoming review requests of both the old and the new members
+        # change. The new members aren't saved until after this, so the
+        # counts are cleared in response_add and response_change.
+        if change:
+            obj._old_user_ids = list(obj.users.values_list('pk', flat=True))
+        else:
+            obj._old_user_ids = []
+
+        super(GroupAdmin, self).save_model(request, obj, form, change)
+
+    def response_add(self, request, obj, *args, **kwargs):
+        self._clear_dashboard_counts(obj)
+        return super(GroupAdmin, self).response_add(request, obj,
+                                                    *args, **kwargs)
+
+    def response_change(self, request, obj):
+        self._clear_dashboard_counts(obj)
+        return super(GroupAdmin, self).response_change(request, obj)
+
+    def _clear_dashboard_counts(self, obj):
+        user_ids = set(obj._old_user_ids)
+        user_ids.update(obj.users.values_list('pk', flat=True))
+        clear_profile_dashboard_counts(user_ids)
 
 
 class ReviewAdmin(admin.ModelAdmin):
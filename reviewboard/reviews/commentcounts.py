@@ -0,0 +1,213 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from djblets.util.misc import cache_memoize
+
+from reviewboard.reviews.models import Comment, Review, ScreenshotComment
+
+
+FILEDIFF_GENERATION_KEY = 'commentcounts-generation:filediff:%s'
+SCREENSHOT_GENERATION_KEY = 'commentcounts-generation:screenshot:%s'
+
+
+def get_comment_counts(filediff, interfilediff, user):
+    """
+    Returns a list of the comments on a filediff, or an interdiff between
+    two filediffs, that the user can see, grouped by line.
+
+    This is used for the commentcounts template tag. The list is cached
+    for each user until a comment on the filediff changes.
+    """
+    if interfilediff:
+        interfilediff_id = interfilediff.pk
+    else:
+        interfilediff_id = None
+
+    key = 'commentcounts:%s:%s:%s:%s' % (
+        filediff.pk, interfilediff_id, _get_user_id(user),
+        _get_generation(FILEDIFF_GENERATION_KEY % filediff.pk))
+
+    return cache_memoize(key,
+        lambda: _build_comment_counts(filediff, interfilediff, user))
+
+
+def get_screenshot_comment_counts(screenshot, user):
+    """
+    Returns a dictionary of the comments on a screenshot that the user can
+    see, grouped by region.
+
+    This is used for the screenshotcommentcounts template tag. The
+    dictionary is cached for each user until a comment on the screenshot
+    changes.
+    """
+    key = 'screenshotcommentcounts:%s:%s:%s' % (
+        screenshot.pk, _get_user_id(user),
+        _get_generation(SCREENSHOT_GENERATION_KEY % screenshot.pk))
+
+    return cache_memoize(key,
+        lambda: _build_screenshot_comment_counts(screenshot, user))
+
+
+def invalidate_comment_counts(filediff_ids):
+    """
+    Marks the cached comment lists for the filediffs with the specified IDs
+    as out of date.
+    """
+    for filediff_id in set(filediff_ids):
+        _bump_generation(FILEDIFF_GENERATION_KEY % filediff_id)
+
+
+def invalidate_screenshot_comment_counts(screenshot_ids):
+    """
+    Marks the cached comment lists for the screenshots with the specified
+    IDs as out of date.
+    """
+    for screenshot_id in set(screenshot_ids):
+        _bump_generation(SCREENSHOT_GENERATION_KEY % screenshot_id)
+
+
+def _build_comment_counts(filediff, interfilediff, user):
+    comment_dict = {}
+
+    if interfilediff:
+        query = Comment.objects.filter(filediff=filediff,
+                                       interfilediff=interfilediff)
+    else:
+        query = Comment.objects.filter(filediff=filediff,
+                                       interfilediff__isnull=True)
+
+    for comment in _get_visible_comments(query, 'comments', user):
+        key = (comment.first_line, comment.num_lines)
+
+        comment_dict.setdefault(key, []).append({
+            'comment_id': comment.id,
+            'text': comment.text,
+            'line': comment.first_line,
+            'num_lines': comment.num_lines,
+            'user': _get_user_info(comment),
+            #'timestamp': comment.timestamp,
+            'url': _get_review_url(comment, 'comment'),
+            'localdraft': comment.is_local_draft,
+        })
+
+    comments_array = []
+
+    for key, value in comment_dict.iteritems():
+        comments_array.append({
+            'linenum': key[0],
+            'num_lines': key[1],
+            'comments': value,
+        })
+
+    comments_array.sort(cmp=lambda x, y: cmp(x['linenum'], y['linenum'] or
+                                         cmp(x['num_lines'], y['num_lines'])))
+
+    return comments_array
+
+
+def _build_screenshot_comment_counts(screenshot, user):
+    comments = {}
+    query = ScreenshotComment.objects.filter(screenshot=screenshot)
+
+    for comment in _get_visible_comments(query, 'screenshot_comments', user):
+        position = '%dx%d+%d+%d' % (comment.w, comment.h,
+                                    comment.x, comment.y)
+
+        comments.setdefault(position, []).append({
+            'id': comment.id,
+            'text': comment.text,
+            'user': _get_user_info(comment),
+            'url': _get_review_url(comment, 'scomment'),
+            'localdraft' : comment.is_local_draft,
+            'x' : comment.x,
+            'y' : comment.y,
+            'w' : comment.w,
+            'h' : comment.h,
+        })
+
+    return comments
+
+
+def _get_visible_comments(queryset, field_name, user):
+    """
+    Returns the comments in a queryset that are public or in one of the
+    user's drafts.
+
+    The comments are loaded in one query, along with what's needed from
+    their reviews and the reviews' users, which is set as attributes on
+    each comment.
+    """
+    field = Review._meta.get_field(field_name)
+    m2m_table = field.m2m_db_table()
+    review_table = Review._meta.db_table
+    user_table = User._meta.db_table
+    user_id = _get_user_id(user)
+
+    comments = queryset.extra(
+        select={
+            'review_public': '%s.public' % review_table,
+            'review_user_id': '%s.user_id' % review_table,
+            'review_request_id': '%s.review_request_id' % review_table,
+            'username': '%s.username' % user_table,
+            'first_name': '%s.first_name' % user_table,
+            'last_name': '%s.last_name' % user_table,
+        },
+        tables=[m2m_table, review_table, user_table],
+        where=[
+            '%s.%s = %s.id' % (m2m_table, field.m2m_reverse_name(),
+                               queryset.model._meta.db_table),
+            '%s.id = %s.%s' % (review_table, m2m_table,
+                               field.m2m_column_name()),
+            '%s.id = %s.user_id' % (user_table, review_table),
+            '(%s.public = %%s OR %s.user_id = %%s)' % (review_table,
+                                                      review_table),
+        ],
+        params=[True, user_id])
+
+    for comment in comments:
+        comment.is_local_draft = (not comment.review_public and
+                                  comment.review_user_id == user_id)
+        yield comment
+
+
+def _get_user_info(comment):
+    full_name = (u'%s %s' % (comment.first_name, comment.last_name)).strip()
+
+    return {
+        'username': comment.username,
+        'name': full_name or comment.username,
+    }
+
+
+def _get_review_url(comment, anchor_prefix):
+    return '%s#%s%d' % (
+        reverse('review-request-detail', kwargs={
+            'review_request_id': comment.review_request_id,
+        }),
+        anchor_prefix, comment.id)
+
+
+def _get_user_id(user):
+    if user and user.is_authenticated():
+        return user.pk
+
+    return None
+
+
+def _get_generation(key):
+    generation = cache.get(key)
+
+    if generation is None:
+        generation = _bump_generation(key)
+
+    return generation
+
+
+def _bump_generation(key):
+    generation = '%f' % time.time()
+    cache.set(key, generation, settings.CACHE_EXPIRATION_TIME)
+
+    return generation
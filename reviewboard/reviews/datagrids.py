@@ -7,10 +7,31 @@ from djblets.datagrid.grids import Column, DateTimeColumn, \
                                    DateTimeSinceColumn, DataGrid
 from djblets.util.templatetags.djblets_utils import ageid
 
-from reviewboard.reviews.models import Group, ReviewRequest, ReviewRequestDraft
+from reviewboard.accounts.models import Profile
+from reviewboard.reviews.models import Group, Review, ReviewRequest, \
+                                       ReviewRequestDraft
 from reviewboard.reviews.templatetags.reviewtags import render_star
 
 
+def bulk_load_columns(datagrid, queryset):
+    """
+    Loads the objects for a page of a datagrid and gives each visible
+    column with a bulk_load method a chance to load what it needs for all
+    the rows at once, rather than querying for each row as it's rendered.
+
+    Columns store what they load on the objects themselves, since column
+    instances are shared between datagrids. Returns the list of objects.
+    """
+    objects = list(queryset)
+
+    if objects:
+        for column in datagrid.columns:
+            if hasattr(column, 'bulk_load'):
+                column.bulk_load(objects)
+
+    return objects
+
+
 class StarColumn(Column):
     """
     A column used to indicate whether the object is "starred" or watched.
@@ -25,8 +46,31 @@ class StarColumn(Column):
         self.detailed_label = "Starred"
         self.shrink = True
 
+    def bulk_load(self, objects):
+        user = self.datagrid.request.user
+
+        if user.is_anonymous():
+            return
+
+        try:
+            profile = user.get_profile()
+        except Profile.DoesNotExist:
+            return
+
+        if isinstance(objects[0], Group):
+            starred = profile.starred_groups
+        else:
+            starred = profile.starred_review_requests
+
+        starred_ids = set(starred.filter(pk__in=[obj.id for obj in objects])
+                                 .values_list('pk', flat=True))
+
+        for obj in objects:
+            obj._starred = obj.id in starred_ids
+
     def render_data(self, obj):
-        return render_star(self.datagrid.request.user, obj)
+        return render_star(self.datagrid.request.user, obj,
+                           getattr(obj, '_starred', None))
 
 
 class ShipItColumn(Column):
@@ -74,13 +118,37 @@ class MyCommentsColumn(Column):
         # XXX It'd be nice to be able to sort on this, but datagrids currently
         # can only sort based on stored (in the DB) values, not computed values.
 
+    def bulk_load(self, review_requests):
+        user = self.datagrid.request.user
+
+        if user.is_anonymous():
+            return
+
+        my_reviews = dict([(review_request.id, [])
+                           for review_request in review_requests])
+
+        reviews = Review.objects.filter(
+            user=user,
+            review_request__in=my_reviews.keys()).values_list(
+                'review_request', 'public', 'ship_it')
+
+        for review_request_id, public, ship_it in reviews:
+            my_reviews[review_request_id].append((public, ship_it))
+
+        for review_request in review_requests:
+            review_request._my_reviews = my_reviews[review_request.id]
+
     def render_data(self, review_request):
         user = self.datagrid.request.user
 
         if user.is_anonymous():
             return ""
 
-        reviews = review_request.reviews.filter(user=user)
+        reviews = getattr(review_request, '_my_reviews', None)
+
+        if reviews is None:
+            reviews = review_request.reviews.filter(user=user).values_list(
+                'public', 'ship_it')
 
         if len(reviews) == 0:
             return ""
@@ -94,13 +162,13 @@ class MyCommentsColumn(Column):
         # 1) Non-public (draft) reviews
         # 2) Public reviews marked "Ship It"
         # 3) Public reviews not marked "Ship It"
-        for review in reviews:
-            if not review.public:
+        for public, ship_it in reviews:
+            if not public:
                 image_url = self.image_url
                 image_alt = _("Comments drafted")
                 break
 
-            if review.ship_it:
+            if ship_it:
                 found_ship_it = True
 
         if not image_url:
@@ -150,19 +218,48 @@ class SummaryColumn(Column):
         Column.__init__(self, label=label, *args, **kwargs)
         self.sortable = True
 
+    def bulk_load(self, review_requests):
+        user = self.datagrid.request.user
+
+        if user.is_anonymous():
+            return
+
+        review_requests = [review_request
+                           for review_request in review_requests
+                           if (review_request.has_draft and
+                               review_request.submitter_id == user.id)]
+
+        if not review_requests:
+            return
+
+        draft_summaries = dict(ReviewRequestDraft.objects.filter(
+            review_request__in=[review_request.id
+                                for review_request in review_requests])
+            .values_list('review_request', 'summary'))
+
+        for review_request in review_requests:
+            review_request._draft_summary = \
+                draft_summaries.get(review_request.id)
+
     def render_data(self, review_request):
         summary = conditional_escape(review_request.summary)
         if not summary:
             summary = '&nbsp;<i>No Summary</i>'
 
-        if review_request.submitter == self.datagrid.request.user:
-            try:
-                draft = review_request.draft.get()
-                summary = conditional_escape(draft.summary)
+        if review_request.submitter_id == self.datagrid.request.user.id:
+            if not review_request.has_draft:
+                draft_summary = None
+            elif hasattr(review_request, '_draft_summary'):
+                draft_summary = review_request._draft_summary
+            else:
+                try:
+                    draft_summary = review_request.draft.get().summary
+                except ReviewRequestDraft.DoesNotExist:
+                    draft_summary = None
+
+            if draft_summary is not None:
                 return "<span class=\"draftlabel\">[Draft]</span> " + \
-                       summary
-            except ReviewRequestDraft.DoesNotExist:
-                pass
+                       conditional_escape(draft_summary)
 
             if not review_request.public:
                 # XXX Do we want to say "Draft?"
@@ -217,9 +314,11 @@ class ReviewCountColumn(Column):
         self.shrink = True
         self.link = True
         self.link_func = self.link_to_object
+        self.db_field = "public_review_count"
+        self.sortable = True
 
     def render_data(self, review_request):
-        return str(review_request.get_public_reviews().count())
+        return str(review_request.public_review_count)
 
     def link_to_object(self, review_request, value):
         return "%s#last-review" % review_request.get_absolute_url()
@@ -249,6 +348,11 @@ class ReviewRequestDataGrid(DataGrid):
         db_field="last_updated",
         field_name="last_updated",
         css_class=lambda r: ageid(r.last_updated))
+    last_activity = DateTimeColumn(_("Last Activity"),
+        format="F jS, Y, P", shrink=True,
+        db_field="last_activity",
+        field_name="last_activity",
+        css_class=lambda r: ageid(r.last_activity))
     diff_updated = DateTimeColumn(_("Diff Updated"),
         format="F jS, Y, P", shrink=True,
         field_name="last_updated",
@@ -263,6 +367,11 @@ class ReviewRequestDataGrid(DataGrid):
         db_field="last_updated",
         field_name="last_updated",
         css_class=lambda r: ageid(r.last_updated))
+    last_activity_since = DateTimeSinceColumn(_("Last Activity"),
+        detailed_label=_("Last Activity (Relative)"), shrink=True,
+        db_field="last_activity",
+        field_name="last_activity",
+        css_class=lambda r: ageid(r.last_activity))
     diff_updated_since = DateTimeSinceColumn(_("Diff Updated"),
         detailed_label=_("Diff Updated (Relative)"),
         field_name="last_updated", shrink=True,
@@ -308,7 +417,7 @@ class ReviewRequestDataGrid(DataGrid):
         return False
 
     def post_process_queryset(self, queryset):
-        return queryset.with_counts(self.request.user)
+        return bulk_load_columns(self, queryset.with_counts(self.request.user))
 
     def link_to_object(self, obj, value):
         if value and isinstance(value, User):
@@ -447,6 +556,9 @@ class GroupDataGrid(DataGrid):
             "star", "name", "displayname", "pending_count"
         ]
 
+    def post_process_queryset(self, queryset):
+        return bulk_load_columns(self, queryset)
+
     @staticmethod
     def link_to_object(obj, value):
         return reverse("group", args=[obj.name])
@@ -0,0 +1,289 @@
+import logging
+import re
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from reviewboard.reviews.models import DefaultReviewer, Group
+
+
+GENERATION_CACHE_KEY = 'default-reviewers-generation'
+
+# Characters with a special meaning in regular expressions.
+REGEX_SPECIAL_CHARS = '.^$*+?{}[]|()'
+
+# Patterns that can't be safely combined with others into one regular
+# expression: backreferences and inline flags, which apply to the whole
+# expression.
+UNCOMBINABLE_RE = re.compile(r'\\\d|\(\?P=|\(\?[iLmsux]+\)')
+
+
+class DefaultReviewerMatcher(object):
+    """
+    Works out which default reviewers apply to a list of file paths.
+
+    This is built once from the DefaultReviewer entries and reused for
+    every diff until the entries change.
+
+    Patterns that are a literal path prefix, optionally followed by
+    ``.*``, are stored in a character trie, so they can be matched
+    against a path in a single walk along it. Patterns for a literal
+    suffix, such as a file extension, are stored in a trie of reversed
+    suffixes. The other patterns are compiled, and are also combined into
+    one expression that's used to skip the paths none of them can match.
+    Patterns that match a path aren't tried against the rest.
+    """
+    def __init__(self, rules, generation=None):
+        """
+        Builds the matcher from a list of (file_regex, person IDs, group
+        IDs) tuples.
+        """
+        self.generation = generation
+        self.trie = {}
+        self.suffix_trie = {}
+        self.regex_rules = []
+        self.uncombinable_rules = []
+
+        for pattern, people, groups in rules:
+            rule = (frozenset(people), frozenset(groups))
+            prefix = get_literal_prefix(pattern)
+
+            if prefix is not None:
+                self._add_to_trie(self.trie, prefix, rule)
+                continue
+
+            suffix = get_literal_suffix(pattern)
+
+            if suffix is not None:
+                self._add_to_trie(self.suffix_trie, reversed(suffix), rule)
+                continue
+
+            try:
+                regex = re.compile(pattern)
+            except re.error, e:
+                logging.warning("Invalid default reviewer regex '%s': %s" %
+                                (pattern, e))
+                continue
+
+            if UNCOMBINABLE_RE.search(pattern):
+                self.uncombinable_rules.append((regex, rule))
+            else:
+                self.regex_rules.append((regex, rule))
+
+        self.combined_regex = None
+
+        if self.regex_rules:
+            try:
+                self.combined_regex = re.compile('|'.join([
+                    '(?:%s)' % regex.pattern
+                    for regex, rule in self.regex_rules
+                ]))
+            except (re.error, AssertionError):
+                # Python limits the number of named groups in one
+                # expression. Every path will be checked against each
+                # pattern instead.
+                self.uncombinable_rules += self.regex_rules
+                self.regex_rules = []
+
+    def match(self, paths):
+        """
+        Returns a (person IDs, group IDs) tuple of sets, for the default
+        reviewers with a pattern matching any of the paths.
+        """
+        rules = set()
+        regex_rules = self.regex_rules
+        uncombinable_rules = self.uncombinable_rules
+
+        for path in set(paths):
+            self._match_trie(self.trie, path, rules)
+            self._match_trie(self.suffix_trie, reversed(path), rules)
+
+            if regex_rules and self.combined_regex.match(path):
+                regex_rules = self._match_rules(regex_rules, path, rules)
+
+            if uncombinable_rules:
+                uncombinable_rules = self._match_rules(uncombinable_rules,
+                                                       path, rules)
+
+        people = set()
+        groups = set()
+
+        for rule_people, rule_groups in rules:
+            people.update(rule_people)
+            groups.update(rule_groups)
+
+        return people, groups
+
+    def _add_to_trie(self, trie, s, rule):
+        node = trie
+
+        for c in s:
+            node = node.setdefault(c, {})
+
+        node.setdefault(None, []).append(rule)
+
+    def _match_trie(self, trie, s, rules):
+        """
+        Adds the rules in a trie for each prefix of a string to a set.
+        """
+        node = trie
+
+        for c in s:
+            rules.update(node.get(None, []))
+            node = node.get(c)
+
+            if node is None:
+                return
+
+        rules.update(node.get(None, []))
+
+    def _match_rules(self, regex_rules, path, rules):
+        """
+        Adds the rules with a pattern matching the path to a set, and
+        returns the ones that didn't match.
+        """
+        remaining = []
+
+        for regex, rule in regex_rules:
+            if regex.match(path):
+                rules.add(rule)
+            else:
+                remaining.append((regex, rule))
+
+        return remaining
+
+
+def get_literal_prefix(pattern):
+    """
+    Returns the path prefix matched by a pattern, if it only matches paths
+    starting with a literal prefix. Otherwise, None is returned.
+
+    Since patterns are matched against the start of paths, a literal
+    pattern, or one followed by ``.*``, matches paths starting with it.
+    """
+    if pattern.endswith('.*') and not pattern.endswith('\\.*'):
+        pattern = pattern[:-2]
+
+    return _parse_literal(pattern)
+
+
+def get_literal_suffix(pattern):
+    """
+    Returns the path suffix matched by a pattern of the form ``.*suffix$``,
+    such as a pattern for a file extension. Otherwise, None is returned.
+    """
+    if (pattern.startswith('.*') and pattern.endswith('$') and
+        not pattern.endswith('\\$')):
+        return _parse_literal(pattern[2:-1])
+
+    return None
+
+
+def _parse_literal(pattern):
+    """
+    Returns the string matched by a pattern without any special
+    characters, other than escaped ones. Otherwise, None is returned.
+    """
+    literal = []
+    escaped = False
+
+    for c in pattern:
+        if escaped:
+            if c.isalnum():
+                # Character classes, such as \d, aren't literal.
+                return None
+
+            literal.append(c)
+            escaped = False
+        elif c == '\\':
+            escaped = True
+        elif c in REGEX_SPECIAL_CHARS:
+            return None
+        else:
+            literal.append(c)
+
+    if escaped:
+        return None
+
+    return ''.join(literal)
+
+
+_matcher = None
+
+
+def get_default_reviewer_matcher():
+    """
+    Returns a DefaultReviewerMatcher for the current DefaultReviewer
+    entries.
+
+    The matcher is kept between requests. It's built again when the
+    generation stored in the cache by invalidate_default_reviewers changes.
+
+    The generation is only seen by other processes if they share the
+    cache, such as with memcached. With a per-process cache like
+    ``locmem:///``, the other processes keep using their matchers until
+    their generation expires, after CACHE_EXPIRATION_TIME.
+    """
+    global _matcher
+
+    generation = cache.get(GENERATION_CACHE_KEY)
+
+    if generation is None:
+        generation = invalidate_default_reviewers()
+
+    if _matcher is None or _matcher.generation != generation:
+        rules = {}
+
+        for default in DefaultReviewer.objects.all():
+            rules[default.pk] = (default.file_regex, [], [])
+
+        for pk, person_id in DefaultReviewer.objects.values_list('pk',
+                                                                  'people'):
+            if person_id is not None:
+                rules[pk][1].append(person_id)
+
+        for pk, group_id in DefaultReviewer.objects.values_list('pk',
+                                                                'groups'):
+            if group_id is not None:
+                rules[pk][2].append(group_id)
+
+        _matcher = DefaultReviewerMatcher(rules.values(), generation)
+
+    return _matcher
+
+
+def invalidate_default_reviewers():
+    """
+    Marks the DefaultReviewerMatchers in every process as out of date,
+    returning the new generation.
+
+    This is called when a DefaultReviewer is saved or deleted. Code that
+    changes the people or groups of one directly must call it afterwards.
+    """
+    generation = '%f' % time.time()
+    cache.set(GENERATION_CACHE_KEY, generation,
+              settings.CACHE_EXPIRATION_TIME)
+
+    return generation
+
+
+def add_default_reviewers(obj, diffset):
+    """
+    Adds the default reviewers for the files in a diffset to the target
+    people and groups of a review request or draft.
+    """
+    paths = [source_file or dest_file
+             for source_file, dest_file in
+                 diffset.files.values_list('source_file', 'dest_file')]
+
+    people, groups = get_default_reviewer_matcher().match(paths)
+
+    # Entries that have been deleted since the matcher was built are left
+    # out by these queries. The managers only add the missing entries.
+    if people:
+        obj.target_people.add(*User.objects.filter(pk__in=people))
+
+    if groups:
+        obj.target_groups.add(*Group.objects.filter(pk__in=groups))
@@ -2,4 +2,8 @@ SEQUENCE = [
     'change_descriptions',
     'last_review_timestamp',
     'shipit_count',
+    'review_request_counters',
+    'group_incoming_request_count',
+    'composite_indexes',
+    'group_incoming_request_count_version',
 ]
@@ -0,0 +1,20 @@
+from django_evolution.mutations import SQLMutation
+
+
+# These match the indexes in the sql/ directory, which are created for new
+# installs.
+MUTATIONS = [
+    SQLMutation('add_composite_indexes', ["""
+        CREATE INDEX review__review_request_public_reply
+            ON reviews_review (review_request_id, public, base_reply_to_id)
+""", """
+        CREATE INDEX review__user_review_request_public
+            ON reviews_review (user_id, review_request_id, public)
+""", """
+        CREATE INDEX comment__filediff_interfilediff_line
+            ON reviews_comment (filediff_id, interfilediff_id, first_line)
+""", """
+        CREATE INDEX reviewrequest__status_public_submitter
+            ON reviews_reviewrequest (status, public, submitter_id)
+"""])
+]
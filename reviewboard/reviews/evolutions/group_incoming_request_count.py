@@ -0,0 +1,9 @@
+from django.db import models
+
+from django_evolution.mutations import AddField
+
+
+MUTATIONS = [
+    AddField('Group', 'incoming_request_count', models.IntegerField,
+             null=True),
+]
@@ -0,0 +1,39 @@
+from django.db import models
+
+from django_evolution.mutations import AddField, SQLMutation
+
+
+MUTATIONS = [
+    AddField('ReviewRequest', 'public_review_count', models.IntegerField,
+             initial=0, null=True),
+    AddField('ReviewRequest', 'has_draft', models.BooleanField,
+             initial=False),
+    AddField('ReviewRequest', 'last_activity', models.DateTimeField,
+             null=True),
+    SQLMutation('populate_review_request_counters', ["""
+        UPDATE reviews_reviewrequest
+           SET public_review_count = (
+               SELECT COUNT(*)
+                 FROM reviews_review
+                WHERE reviews_review.review_request_id =
+                      reviews_reviewrequest.id
+                  AND reviews_review.public
+                  AND reviews_review.base_reply_to_id is NULL)
+""", """
+        UPDATE reviews_reviewrequest
+           SET has_draft = (
+               reviews_reviewrequest.id IN (
+                   SELECT reviews_reviewrequestdraft.review_request_id
+                     FROM reviews_reviewrequestdraft))
+""", """
+        UPDATE reviews_reviewrequest
+           SET last_activity = COALESCE((
+               SELECT reviews_reviewrequestdraft.last_updated
+                 FROM reviews_reviewrequestdraft
+                WHERE reviews_reviewrequestdraft.review_request_id =
+                      reviews_reviewrequest.id
+                  AND reviews_reviewrequestdraft.last_updated >
+                      reviews_reviewrequest.last_updated),
+               reviews_reviewrequest.last_updated)
+"""])
+]
@@ -0,0 +1,65 @@
+import optparse
+
+from django.core.management.base import NoArgsCommand
+
+from reviewboard.accounts.models import DASHBOARD_COUNT_FIELDS, Profile
+from reviewboard.reviews.models import Group
+from reviewboard.reviews.sidebar import clear_group_dashboard_counts, \
+                                        clear_profile_dashboard_counts, \
+                                        count_review_requests
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option('--fix', action='store_true', dest='fix',
+                             default=False,
+                             help='Clear the wrong counts, so that they are '
+                                  'recomputed'),
+        )
+    help = "Checks the review request counts stored for the dashboard " \
+           "sidebar against the review requests"
+
+    def handle_noargs(self, **options):
+        fix = options.get('fix', False)
+        num_wrong = 0
+
+        for profile in Profile.objects.select_related('user'):
+            wrong = False
+
+            for view, field in DASHBOARD_COUNT_FIELDS.iteritems():
+                stored = getattr(profile, field)
+
+                if stored is None:
+                    continue
+
+                actual = count_review_requests(profile.user, view)
+
+                if stored != actual:
+                    print "%s: '%s' count is %s, but should be %s" % \
+                        (profile.user.username, view, stored, actual)
+                    wrong = True
+
+            if wrong:
+                num_wrong += 1
+
+                if fix:
+                    clear_profile_dashboard_counts([profile.user_id])
+
+        for group in Group.objects.filter(incoming_request_count__isnull=False):
+            actual = count_review_requests(None, 'to-group', group)
+
+            if group.incoming_request_count != actual:
+                print "Group %s: count is %s, but should be %s" % \
+                    (group.name, group.incoming_request_count, actual)
+                num_wrong += 1
+
+                if fix:
+                    clear_group_dashboard_counts([group.pk])
+
+        if num_wrong == 0:
+            print "All stored counts are correct."
+        elif fix:
+            print "Cleared the counts for %s users and groups." % num_wrong
+        else:
+            print "%s users and groups have wrong counts. Run with --fix " \
+                  "to clear them." % num_wrong
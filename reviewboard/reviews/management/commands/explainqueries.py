@@ -0,0 +1,88 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import CommandError, NoArgsCommand
+from django.db import connection
+
+from reviewboard.accounts.models import ReviewRequestVisit
+from reviewboard.diffviewer.models import FileDiff
+from reviewboard.reviews.models import Comment, Review, ReviewRequest
+
+
+# The statement used to show a query plan on each database backend.
+EXPLAIN_STATEMENTS = {
+    'sqlite3': 'EXPLAIN QUERY PLAN',
+    'mysql': 'EXPLAIN',
+    'postgresql': 'EXPLAIN',
+    'postgresql_psycopg2': 'EXPLAIN',
+}
+
+
+class Command(NoArgsCommand):
+    help = "Shows the database's query plans for the most frequent " \
+           "queries, to check that the indexes are used"
+
+    def handle_noargs(self, **options):
+        engine = settings.DATABASE_ENGINE
+
+        if engine not in EXPLAIN_STATEMENTS:
+            raise CommandError("Query plans aren't supported for the '%s' "
+                               "database backend" % engine)
+
+        cursor = connection.cursor()
+
+        for name, queryset in self.get_queries():
+            sql, params = queryset.query.as_sql()
+            cursor.execute('%s %s' % (EXPLAIN_STATEMENTS[engine], sql),
+                           params)
+
+            print name
+            print "    %s" % (sql % tuple([repr(param)
+                                          for param in params]))
+            print
+
+            for row in cursor.fetchall():
+                print "    %s" % " | ".join([unicode(value)
+                                             for value in row])
+
+            print
+
+    def get_queries(self):
+        """
+        Returns (name, queryset) tuples for the queries to explain, using
+        objects from the database for the values they filter on.
+        """
+        review_request = self.get_latest(ReviewRequest)
+        user = self.get_latest(User)
+        filediff = self.get_latest(FileDiff)
+
+        return [
+            ('Public reviews of a review request',
+             Review.objects.filter(review_request=review_request,
+                                   public=True,
+                                   base_reply_to__isnull=True)),
+            ("A user's draft review of a review request",
+             Review.objects.filter(user=user,
+                                   review_request=review_request,
+                                   public=False)),
+            ('Comments on a line of a diff',
+             Comment.objects.filter(filediff=filediff,
+                                    interfilediff__isnull=True,
+                                    first_line=1)),
+            ("A user's visit to a review request",
+             ReviewRequestVisit.objects.filter(user=user,
+                                               review_request=review_request)),
+            ("A user's pending public review requests",
+             ReviewRequest.objects.filter(status='P',
+                                          public=True,
+                                          submitter=user)),
+        ]
+
+    def get_latest(self, model):
+        """
+        Returns the last object of a model in the database, or an unsaved
+        one with an ID of 0 if there are none.
+        """
+        try:
+            return model.objects.order_by('-pk')[0]
+        except IndexError:
+            return model(pk=0)
@@ -0,0 +1,69 @@
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+
+
+# Each statement recomputes one of the values stored on review requests
+# from the reviews and drafts they're based on.
+COUNTER_QUERIES = [
+    """
+    UPDATE reviews_reviewrequest
+       SET public_review_count = (
+           SELECT COUNT(*)
+             FROM reviews_review
+            WHERE reviews_review.review_request_id =
+                  reviews_reviewrequest.id
+              AND reviews_review.public
+              AND reviews_review.base_reply_to_id is NULL)
+    """,
+    """
+    UPDATE reviews_reviewrequest
+       SET shipit_count = (
+           SELECT COUNT(*)
+             FROM reviews_review
+            WHERE reviews_review.review_request_id =
+                  reviews_reviewrequest.id
+              AND reviews_review.public
+              AND reviews_review.ship_it
+              AND reviews_review.base_reply_to_id is NULL)
+    """,
+    """
+    UPDATE reviews_reviewrequest
+       SET last_review_timestamp = (
+           SELECT MAX(reviews_review.timestamp)
+             FROM reviews_review
+            WHERE reviews_review.review_request_id =
+                  reviews_reviewrequest.id
+              AND reviews_review.public)
+    """,
+    """
+    UPDATE reviews_reviewrequest
+       SET has_draft = (
+           reviews_reviewrequest.id IN (
+               SELECT reviews_reviewrequestdraft.review_request_id
+                 FROM reviews_reviewrequestdraft))
+    """,
+    """
+    UPDATE reviews_reviewrequest
+       SET last_activity = COALESCE((
+           SELECT reviews_reviewrequestdraft.last_updated
+             FROM reviews_reviewrequestdraft
+            WHERE reviews_reviewrequestdraft.review_request_id =
+                  reviews_reviewrequest.id
+              AND reviews_reviewrequestdraft.last_updated >
+                  reviews_reviewrequest.last_updated),
+           reviews_reviewrequest.last_updated)
+    """,
+]
+
+
+class Command(NoArgsCommand):
+    help = 'Recomputes the review counts, draft flags and activity ' \
+           'timestamps stored on review requests.'
+
+    def handle_noargs(self, **options):
+        cursor = connection.cursor()
+
+        for query in COUNTER_QUERIES:
+            cursor.execute(query)
+
+        transaction.commit_unless_managed()
@@ -19,17 +19,14 @@ class ReviewRequestQuerySet(QuerySet):
             select_dict = {}
 
             select_dict['new_review_count'] = """
-                SELECT COUNT(*)
-                  FROM reviews_review, accounts_reviewrequestvisit
-                  WHERE reviews_review.public
-                    AND reviews_review.review_request_id =
-                        reviews_reviewrequest.id
-                    AND accounts_reviewrequestvisit.review_request_id =
-                        reviews_reviewrequest.id
-                    AND accounts_reviewrequestvisit.user_id = %(user_id)s
-                    AND reviews_review.timestamp >
-                        accounts_reviewrequestvisit.timestamp
-                    AND reviews_review.user_id != %(user_id)s
+                SELECT COALESCE(
+                    (SELECT accounts_reviewrequestvisit.unread_review_count
+                       FROM accounts_reviewrequestvisit
+                      WHERE accounts_reviewrequestvisit.review_request_id =
+                            reviews_reviewrequest.id
+                        AND accounts_reviewrequestvisit.user_id =
+                            %(user_id)s),
+                    0)
             """ % {
                 'user_id': str(user.id)
             }
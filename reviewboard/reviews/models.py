@@ -1,11 +1,10 @@
 import os
-import re
 from datetime import datetime
 
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
 from django.db import connection, models, transaction
-from django.db.models import Q, permalink
+from django.db.models import F, Q, permalink
 from django.utils.html import escape
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
@@ -27,6 +26,39 @@ from reviewboard.scmtools.models import Repository
 #the model for the summery only allows it to be 300 chars in length
 MAX_SUMMARY_LENGTH = 300
 
+# The number of comments deleted in each query by delete_comments. This is
+# kept under SQLite's limit of 999 parameters in a query.
+DELETE_BATCH_SIZE = 500
+
+
+def delete_comments(model, comment_ids):
+    """
+    Deletes the comments of a type with the specified IDs, along with any
+    replies to them.
+
+    The comments are deleted with a DELETE statement for each batch,
+    rather than through QuerySet.delete(), which looks up the objects
+    related to each comment one at a time. This is only safe because
+    nothing else refers to the comments once they've been removed from
+    their reviews, which must be done first, and their replies have been
+    deleted.
+    """
+    cursor = connection.cursor()
+    qn = connection.ops.quote_name
+
+    for i in xrange(0, len(comment_ids), DELETE_BATCH_SIZE):
+        batch = comment_ids[i:i + DELETE_BATCH_SIZE]
+
+        # There are few replies, so these are deleted normally.
+        model.objects.filter(reply_to__in=batch).delete()
+
+        cursor.execute("DELETE FROM %s WHERE %s IN (%s)" %
+                       (qn(model._meta.db_table), qn(model._meta.pk.column),
+                        ', '.join(['%s'] * len(batch))),
+                       batch)
+
+    transaction.commit_unless_managed()
+
 
 def update_obj_with_changenum(obj, repository, changenum):
     """
@@ -79,9 +111,30 @@ class Group(models.Model):
                                    related_name="review_groups",
                                    verbose_name=_("users"))
 
+    # The number of public review requests in the group's entry in the
+    # dashboard sidebar, or None if it needs to be recomputed.
+    incoming_request_count = models.IntegerField(null=True, default=None,
+                                                 blank=True)
+
+    # Incremented whenever the count is cleared, so that a count that was
+    # started before then isn't stored.
+    incoming_request_count_version = models.IntegerField(default=0)
+
     def __unicode__(self):
         return self.name
 
+    def save(self, **kwargs):
+        if self.id:
+            # As with Profile, keep the stored count rather than writing
+            # back a stale copy.
+            values = Group.objects.filter(pk=self.id).values(
+                'incoming_request_count', 'incoming_request_count_version')[0]
+            self.incoming_request_count = values['incoming_request_count']
+            self.incoming_request_count_version = \
+                values['incoming_request_count_version']
+
+        super(Group, self).save(**kwargs)
+
     @permalink
     def get_absolute_url(self):
         return ('reviewboard.reviews.views.group', None, {'name': self.name})
@@ -117,6 +170,20 @@ class DefaultReviewer(models.Model):
     def __unicode__(self):
         return self.name
 
+    def save(self, **kwargs):
+        super(DefaultReviewer, self).save(**kwargs)
+
+        from reviewboard.reviews.defaultreviewers import \
+            invalidate_default_reviewers
+        invalidate_default_reviewers()
+
+    def delete(self):
+        super(DefaultReviewer, self).delete()
+
+        from reviewboard.reviews.defaultreviewers import \
+            invalidate_default_reviewers
+        invalidate_default_reviewers()
+
 
 class Screenshot(models.Model):
     """
@@ -237,11 +304,24 @@ class ReviewRequest(models.Model):
                                                  blank=True)
     shipit_count = models.IntegerField(_("ship-it count"), default=0,
                                        null=True)
+    public_review_count = models.IntegerField(_("public review count"),
+                                              default=0, null=True)
+    has_draft = models.BooleanField(_("has draft"), default=False)
+
+    # The latest of last_updated and the draft's last_updated.
+    last_activity = models.DateTimeField(_("last activity"), null=True,
+                                         default=None, blank=True)
 
 
     # Set this up with the ReviewRequestManager
     objects = ReviewRequestManager()
 
+    def __init__(self, *args, **kwargs):
+        super(ReviewRequest, self).__init__(*args, **kwargs)
+
+        # Changes to these fields change which dashboard views list the
+        # review request.
+        self._dashboard_state = (self.public, self.status)
 
     def get_bug_list(self):
         """
@@ -269,21 +349,22 @@ class ReviewRequest(models.Model):
         if user.is_authenticated():
             # If this ReviewRequest was queried using with_counts=True,
             # then we should know the new review count and can use this to
-            # decide whether we have anything at all to show.
-            if hasattr(self, "new_review_count") and self.new_review_count > 0:
+            # decide whether we have anything at all to show. Otherwise,
+            # the visit keeps track of the count.
+            if getattr(self, "new_review_count", 1) > 0:
                 query = self.visits.filter(user=user)
 
                 try:
                     visit = query[0]
 
-                    return self.reviews.filter(
-                        public=True,
-                        timestamp__gt=visit.timestamp).exclude(user=user)
+                    if visit.unread_review_count > 0:
+                        return self.reviews.filter(
+                            public=True,
+                            timestamp__gt=visit.timestamp).exclude(user=user)
                 except IndexError:
                     # This visit doesn't exist, so bail.
                     pass
 
-
         return self.reviews.get_empty_query_set()
 
     def add_default_reviewers(self):
@@ -294,39 +375,13 @@ class ReviewRequest(models.Model):
         adds any missing reviewers based on regular expression comparisons with
         the set of files in the diff.
         """
+        from reviewboard.reviews.defaultreviewers import add_default_reviewers
 
         if self.diffset_history.diffsets.count() != 1:
             return
 
         diffset = self.diffset_history.diffsets.get()
-
-        people = set()
-        groups = set()
-
-        # TODO: This is kind of inefficient, and could maybe be optimized in
-        # some fancy way.  Certainly the most superficial optimization that
-        # could be made would be to cache the compiled regexes somewhere.
-        files = diffset.files.all()
-        for default in DefaultReviewer.objects.all():
-            regex = re.compile(default.file_regex)
-
-            for filediff in files:
-                if regex.match(filediff.source_file or filediff.dest_file):
-                    for person in default.people.all():
-                        people.add(person)
-                    for group in default.groups.all():
-                        groups.add(group)
-                    break
-
-        existing_people = self.target_people.all()
-        for person in people:
-            if person not in existing_people:
-                self.target_people.add(person)
-
-        existing_groups = self.target_groups.all()
-        for group in groups:
-            if group not in existing_groups:
-                self.target_groups.add(group)
+        add_default_reviewers(self, diffset)
 
     def get_public_reviews(self):
         """
@@ -392,8 +447,36 @@ class ReviewRequest(models.Model):
             # and all ReviewRequestVisit objects.
             self.visits.all().delete()
 
+        self.last_activity = datetime.now()
+        is_new = self.id is None
+
+        if not is_new:
+            # Drafts maintain has_draft with direct updates, so this copy
+            # may predate them. Re-check it rather than writing back a
+            # stale value.
+            drafts = ReviewRequestDraft.objects.filter(review_request=self)
+            self.has_draft = drafts.count() > 0
+
         super(ReviewRequest, self).save()
 
+        if is_new or self._dashboard_state != (self.public, self.status):
+            from reviewboard.reviews.sidebar import clear_dashboard_counts
+            clear_dashboard_counts(self)
+            self._dashboard_state = (self.public, self.status)
+
+    def delete(self):
+        from reviewboard.reviews.sidebar import \
+            clear_group_dashboard_counts, clear_profile_dashboard_counts, \
+            get_dashboard_count_ids
+
+        # The targets are gone after the delete, so look them up first.
+        user_ids, group_ids = get_dashboard_count_ids(self)
+
+        super(ReviewRequest, self).delete()
+
+        clear_group_dashboard_counts(group_ids)
+        clear_profile_dashboard_counts(user_ids)
+
     def can_publish(self):
         return not self.public or get_object_or_none(self.draft) is not None
 
@@ -418,6 +501,7 @@ class ReviewRequest(models.Model):
             pass
         else:
             draft.delete()
+            self.has_draft = False
 
     def reopen(self, user=None):
         """
@@ -447,6 +531,7 @@ class ReviewRequest(models.Model):
             # This will in turn save the review request, so we'll be done.
             changes = draft.publish(self)
             draft.delete()
+            self.has_draft = False
         else:
             changes = None
 
@@ -477,6 +562,20 @@ class ReviewRequest(models.Model):
         r = ReviewRequest.objects.get(pk=self.id)
         self.shipit_count = r.shipit_count
 
+    def update_review_counts(self, public_reviews=0, ship_its=0):
+        """
+        Atomicly adds to the public review and ship-it counts on the review
+        request.
+        """
+        ReviewRequest.objects.filter(pk=self.id).update(
+            public_review_count=F('public_review_count') + public_reviews,
+            shipit_count=F('shipit_count') + ship_its)
+
+        # Update our copy.
+        r = ReviewRequest.objects.get(pk=self.id)
+        self.public_review_count = r.public_review_count
+        self.shipit_count = r.shipit_count
+
     class Meta:
         ordering = ['-last_updated', 'submitter', 'summary']
         unique_together = (('changenum', 'repository'),)
@@ -561,6 +660,23 @@ class ReviewRequestDraft(models.Model):
         self.summary = truncate(self.summary, MAX_SUMMARY_LENGTH)
         super(ReviewRequestDraft, self).save()
 
+        # Update the review request directly, so that its last_updated
+        # timestamp is left alone.
+        ReviewRequest.objects.filter(pk=self.review_request_id).update(
+            has_draft=True,
+            last_activity=self.last_updated)
+
+    def delete(self):
+        review_request_id = self.review_request_id
+
+        super(ReviewRequestDraft, self).delete()
+
+        # Bump the last activity time as well, so that cached pages built
+        # while the draft existed are no longer considered fresh.
+        ReviewRequest.objects.filter(pk=review_request_id).update(
+            has_draft=False,
+            last_activity=datetime.now())
+
     @staticmethod
     def create(review_request):
         """
@@ -601,6 +717,8 @@ class ReviewRequestDraft(models.Model):
 
             draft.save();
 
+        review_request.has_draft = True
+
         return draft
 
     def add_default_reviewers(self):
@@ -611,40 +729,12 @@ class ReviewRequestDraft(models.Model):
         adds any missing reviewers based on regular expression comparisons with
         the set of files in the diff.
         """
+        from reviewboard.reviews.defaultreviewers import add_default_reviewers
 
         if not self.diffset:
             return
 
-        people = set()
-        groups = set()
-
-        # TODO: This is kind of inefficient, and could maybe be optimized in
-        # some fancy way.  Certainly the most superficial optimization that
-        # could be made would be to cache the compiled regexes somewhere.
-        files = self.diffset.files.all()
-        for default in DefaultReviewer.objects.all():
-            try:
-                regex = re.compile(default.file_regex)
-            except:
-                continue
-
-            for filediff in files:
-                if regex.match(filediff.source_file or filediff.dest_file):
-                    for person in default.people.all():
-                        people.add(person)
-                    for group in default.groups.all():
-                        groups.add(group)
-                    break
-
-        existing_people = self.target_people.all()
-        for person in people:
-            if person not in existing_people:
-                self.target_people.add(person)
-
-        existing_groups = self.target_groups.all()
-        for group in groups:
-            if group not in existing_groups:
-                self.target_groups.add(group)
+        add_default_reviewers(self, self.diffset)
 
     def publish(self, review_request=None):
         """
@@ -683,6 +773,10 @@ class ReviewRequestDraft(models.Model):
         For the 'diff' field, there is only ever an 'added' field, containing
         the ID of the new diffset.
         """
+        from reviewboard.reviews.sidebar import \
+            clear_dashboard_counts, clear_group_dashboard_counts, \
+            clear_profile_dashboard_counts, get_dashboard_count_ids
+
         if not review_request:
             review_request = self.review_request
 
@@ -701,7 +795,8 @@ class ReviewRequestDraft(models.Model):
 
                 a.__dict__[name] = value
 
-        def update_list(a, b, name, record_changes=True, name_field=None):
+        def update_list(a, b, name, record_changes=True, name_field=None,
+                        clear_counts=False):
             aset = set([x.id for x in a.all()])
             bset = set([x.id for x in b.all()])
 
@@ -710,9 +805,21 @@ class ReviewRequestDraft(models.Model):
                     self.changedesc.record_field_change(name, a.all(), b.all(),
                                                         name_field)
 
+                # The dashboard counts of both the old and the new targets
+                # change. The old ones are looked up now and cleared along
+                # with the new ones once the targets have been saved.
+                if clear_counts:
+                    old_user_ids, old_group_ids = \
+                        get_dashboard_count_ids(review_request)
+
                 a.clear()
                 map(a.add, b.all())
 
+                if clear_counts:
+                    clear_group_dashboard_counts(old_group_ids)
+                    clear_profile_dashboard_counts(old_user_ids)
+                    clear_dashboard_counts(review_request)
+
 
         update_field(review_request, self, 'summary')
         update_field(review_request, self, 'description')
@@ -720,9 +827,10 @@ class ReviewRequestDraft(models.Model):
         update_field(review_request, self, 'branch')
 
         update_list(review_request.target_groups, self.target_groups,
-                    'target_groups', name_field="name")
+                    'target_groups', name_field="name", clear_counts=True)
         update_list(review_request.target_people, self.target_people,
-                    'target_people', name_field="username")
+                    'target_people', name_field="username",
+                    clear_counts=True)
 
         # Specifically handle bug numbers
         old_bugs = set(review_request.get_bug_list())
@@ -842,23 +950,37 @@ class Comment(models.Model):
         else:
             return self.replies.filter(review__public=True)
 
+    def get_review(self):
+        """
+        Returns the review containing this comment. This may have been
+        loaded already along with the comment.
+        """
+        if not hasattr(self, '_review'):
+            self._review = self.review.get()
+
+        return self._review
+
     def get_absolute_url(self):
         revision_path = str(self.filediff.diffset.revision)
         if self.interfilediff:
             revision_path += "-%s" % self.interfilediff.diffset.revision
 
         return "%sdiff/%s/?file=%s#file%sline%s" % \
-             (self.review.get().review_request.get_absolute_url(),
+             (self.get_review().review_request.get_absolute_url(),
               revision_path, self.filediff.id, self.filediff.id,
               self.first_line)
 
     def get_review_url(self):
         return "%s#comment%d" % \
-            (self.review.get().review_request.get_absolute_url(), self.id)
+            (self.get_review().review_request.get_absolute_url(), self.id)
 
     def save(self, **kwargs):
         super(Comment, self).save()
 
+        from reviewboard.reviews.commentcounts import \
+            invalidate_comment_counts
+        invalidate_comment_counts([self.filediff_id])
+
         try:
             # Update the review timestamp.
             review = self.review.get()
@@ -867,6 +989,15 @@ class Comment(models.Model):
         except Review.DoesNotExist:
             pass
 
+    def delete(self):
+        filediff_id = self.filediff_id
+
+        super(Comment, self).delete()
+
+        from reviewboard.reviews.commentcounts import \
+            invalidate_comment_counts
+        invalidate_comment_counts([filediff_id])
+
     def __unicode__(self):
         return self.text
 
@@ -922,13 +1053,27 @@ class ScreenshotComment(models.Model):
         return '<img src="%s" width="%s" height="%s" alt="%s" />' % \
             (url, self.w, self.h, escape(self.text))
 
+    def get_review(self):
+        """
+        Returns the review containing this comment. This may have been
+        loaded already along with the comment.
+        """
+        if not hasattr(self, '_review'):
+            self._review = self.review.get()
+
+        return self._review
+
     def get_review_url(self):
         return "%s#scomment%d" % \
-            (self.review.get().review_request.get_absolute_url(), self.id)
+            (self.get_review().review_request.get_absolute_url(), self.id)
 
     def save(self, **kwargs):
         super(ScreenshotComment, self).save()
 
+        from reviewboard.reviews.commentcounts import \
+            invalidate_screenshot_comment_counts
+        invalidate_screenshot_comment_counts([self.screenshot_id])
+
         try:
             # Update the review timestamp.
             review = self.review.get()
@@ -937,6 +1082,15 @@ class ScreenshotComment(models.Model):
         except Review.DoesNotExist:
             pass
 
+    def delete(self):
+        screenshot_id = self.screenshot_id
+
+        super(ScreenshotComment, self).delete()
+
+        from reviewboard.reviews.commentcounts import \
+            invalidate_screenshot_comment_counts
+        invalidate_screenshot_comment_counts([screenshot_id])
+
     def __unicode__(self):
         return self.text
 
@@ -1051,20 +1205,25 @@ class Review(models.Model):
         self.public = True
         self.save()
 
-        for comment in self.comments.all():
-            comment.timetamp = self.timestamp
-            comment.save()
-
-        for comment in self.screenshot_comments.all():
-            comment.timetamp = self.timestamp
-            comment.save()
+        # Update the comments all at once. Saving each comment would save
+        # the review again.
+        self.comments.update(timestamp=self.timestamp)
+        self.screenshot_comments.update(timestamp=self.timestamp)
+        self._invalidate_comment_counts()
 
         # Update the last_updated timestamp on the review request.
         self.review_request.last_review_timestamp = self.timestamp
         self.review_request.save()
 
-        # Atomicly update the shipit_count
-        if self.ship_it:
+        # Let everyone else who has seen the review request know there's
+        # something new.
+        self.review_request.visits.exclude(user=self.user).update(
+            unread_review_count=F('unread_review_count') + 1)
+
+        # Atomicly update the public review count and shipit_count
+        if self.base_reply_to_id is None:
+            self.review_request.update_review_counts(1, int(self.ship_it))
+        elif self.ship_it:
             self.review_request.increment_ship_it()
 
     def delete(self):
@@ -1073,11 +1232,28 @@ class Review(models.Model):
 
         This will enforce that all contained comments are also deleted.
         """
-        for comment in self.comments.all():
-            comment.delete()
+        # The comments are gone after this, so look up what they're on
+        # first.
+        comment_count_ids = self._get_comment_count_ids()
+
+        for manager in (self.comments, self.screenshot_comments):
+            comment_ids = list(manager.values_list('pk', flat=True))
+
+            if comment_ids:
+                manager.clear()
+                delete_comments(manager.model, comment_ids)
+
+        self._invalidate_comment_counts(comment_count_ids)
 
-        for comment in self.screenshot_comments.all():
-            comment.delete()
+        if self.public:
+            if self.base_reply_to_id is None:
+                self.review_request.update_review_counts(-1,
+                                                         -int(self.ship_it))
+
+            self.review_request.visits.filter(
+                timestamp__lt=self.timestamp,
+                unread_review_count__gt=0).exclude(user=self.user).update(
+                    unread_review_count=F('unread_review_count') - 1)
 
         super(Review, self).delete()
 
@@ -1085,6 +1261,33 @@ class Review(models.Model):
         return "%s#review%s" % (self.review_request.get_absolute_url(),
                                 self.id)
 
+    def _get_comment_count_ids(self):
+        """
+        Returns a tuple of the IDs of the filediffs and the screenshots that
+        this review comments on.
+        """
+        return (list(self.comments.values_list('filediff', flat=True)),
+                list(self.screenshot_comments.values_list('screenshot',
+                                                          flat=True)))
+
+    def _invalidate_comment_counts(self, comment_count_ids=None):
+        """
+        Marks the cached comment lists for the files and screenshots that
+        this review comments on as out of date.
+
+        The IDs from _get_comment_count_ids can be passed if they were
+        looked up before the comments were removed.
+        """
+        from reviewboard.reviews.commentcounts import \
+            invalidate_comment_counts, invalidate_screenshot_comment_counts
+
+        if comment_count_ids is None:
+            comment_count_ids = self._get_comment_count_ids()
+
+        filediff_ids, screenshot_ids = comment_count_ids
+        invalidate_comment_counts(filediff_ids)
+        invalidate_screenshot_comment_counts(screenshot_ids)
+
     class Meta:
         ordering = ['timestamp']
         get_latest_by = 'timestamp'
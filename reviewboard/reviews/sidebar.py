@@ -0,0 +1,167 @@
+from django.contrib.auth.models import User
+from django.db.models import F
+
+from reviewboard.accounts.models import DASHBOARD_COUNT_FIELDS, Profile
+from reviewboard.reviews.models import Group, ReviewRequest
+
+
+def get_dashboard_count(user, view, group=None):
+    """
+    Returns the number of review requests in a view of the dashboard
+    sidebar for a user.
+
+    The counts are stored on the user's profile and on groups, and are
+    only counted again after clear_dashboard_counts has been called for a
+    review request in the view.
+
+    A count is only stored if the counts haven't been cleared since the
+    profile or group was loaded. Otherwise, it may have been counted before
+    the change that cleared it, and is counted again next time.
+    """
+    if view == 'to-group':
+        return _get_group_count(user, group)
+
+    profile = user.get_profile()
+    field = DASHBOARD_COUNT_FIELDS[view]
+    count = getattr(profile, field)
+
+    if count is None:
+        count = count_review_requests(user, view)
+        setattr(profile, field, count)
+
+        # Update the profile directly, so that we don't write over
+        # anything else that may have changed.
+        Profile.objects.filter(
+            pk=profile.pk,
+            dashboard_counts_version=profile.dashboard_counts_version
+        ).update(**{field: count})
+
+    return count
+
+
+def count_review_requests(user, view, group=None):
+    """
+    Counts the review requests in a view of the dashboard sidebar for a
+    user, without using the stored counts.
+
+    For the 'to-group' view, only public review requests are counted.
+    """
+    if view == 'starred':
+        review_requests = \
+            user.get_profile().starred_review_requests.public(user)
+    elif view == 'outgoing':
+        review_requests = ReviewRequest.objects.from_user(user.username, user)
+    elif view == 'mine':
+        review_requests = ReviewRequest.objects.from_user(user.username, user,
+                                                          None)
+    elif view == 'incoming':
+        review_requests = ReviewRequest.objects.to_user(user.username, user)
+    elif view == 'to-me':
+        review_requests = ReviewRequest.objects.to_user_directly(user.username,
+                                                                 user)
+    elif view == 'to-group':
+        review_requests = ReviewRequest.objects.to_group(group.name)
+    else:
+        raise ValueError("Invalid dashboard view '%s'" % view)
+
+    return review_requests.count()
+
+
+def get_dashboard_count_ids(review_request):
+    """
+    Returns a tuple of the user IDs and group IDs with dashboard sidebar
+    counts that include a review request.
+
+    This covers the submitter, the target people and groups, the members
+    of the target groups and the users who starred the review request.
+    """
+    group_ids = list(review_request.target_groups.values_list('pk',
+                                                              flat=True))
+
+    user_ids = set([review_request.submitter_id])
+    user_ids.update(review_request.target_people.values_list('pk', flat=True))
+    user_ids.update(review_request.starred_by.values_list('user', flat=True))
+
+    if group_ids:
+        user_ids.update(User.objects.filter(review_groups__in=group_ids)
+                                    .values_list('pk', flat=True))
+
+    return user_ids, group_ids
+
+
+def clear_dashboard_counts(review_request):
+    """
+    Marks the dashboard sidebar counts that include a review request as
+    needing to be recomputed.
+
+    This must be called after the change to the review request has been
+    saved. See get_dashboard_count_ids for the counts that are cleared.
+    """
+    user_ids, group_ids = get_dashboard_count_ids(review_request)
+    clear_group_dashboard_counts(group_ids)
+    clear_profile_dashboard_counts(user_ids)
+
+
+def clear_profile_dashboard_counts(user_ids):
+    """
+    Marks the dashboard sidebar counts of each user in a list of user IDs
+    as needing to be recomputed.
+    """
+    if user_ids:
+        values = dict([(field, None)
+                       for field in DASHBOARD_COUNT_FIELDS.values()])
+        Profile.objects.filter(user__in=user_ids).update(
+            dashboard_counts_version=F('dashboard_counts_version') + 1,
+            **values)
+
+
+def clear_group_dashboard_counts(group_ids):
+    """
+    Marks the dashboard sidebar counts of each group in a list of group IDs
+    as needing to be recomputed.
+    """
+    if group_ids:
+        Group.objects.filter(pk__in=group_ids).update(
+            incoming_request_count=None,
+            incoming_request_count_version=
+                F('incoming_request_count_version') + 1)
+
+
+def _get_group_count(user, group):
+    count = group.incoming_request_count
+
+    if count is None:
+        count = count_review_requests(user, 'to-group', group)
+        group.incoming_request_count = count
+        Group.objects.filter(
+            pk=group.pk,
+            incoming_request_count_version=group.incoming_request_count_version
+        ).update(incoming_request_count=count)
+
+    # Users also see their own unpublished review requests in the groups'
+    # lists, which the stored counts don't include.
+    return count + _get_unpublished_group_counts(user).get(group.id, 0)
+
+
+def _get_unpublished_group_counts(user):
+    """
+    Returns a dictionary mapping group IDs to the number of the user's
+    unpublished review requests that are pending review by the group.
+
+    This is counted once per request, for all groups.
+    """
+    if not hasattr(user, '_unpublished_group_counts'):
+        counts = {}
+
+        group_ids = ReviewRequest.objects.filter(
+            submitter=user,
+            public=False,
+            status='P').values_list('target_groups', flat=True)
+
+        for group_id in group_ids:
+            if group_id is not None:
+                counts[group_id] = counts.get(group_id, 0) + 1
+
+        user._unpublished_group_counts = counts
+
+    return user._unpublished_group_counts
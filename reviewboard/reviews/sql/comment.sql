@@ -0,0 +1,4 @@
+CREATE
+	INDEX comment__filediff_interfilediff_line
+	ON reviews_comment
+	(filediff_id, interfilediff_id, first_line);
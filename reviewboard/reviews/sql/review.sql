@@ -0,0 +1,9 @@
+CREATE
+	INDEX review__review_request_public_reply
+	ON reviews_review
+	(review_request_id, public, base_reply_to_id);
+
+CREATE
+	INDEX review__user_review_request_public
+	ON reviews_review
+	(user_id, review_request_id, public);
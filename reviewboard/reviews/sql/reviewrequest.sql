@@ -7,3 +7,8 @@ CREATE
 	INDEX reviewrequest_target_people__reviewrequest_user
 	ON reviews_reviewrequest_target_people
 	(reviewrequest_id, user_id);
+
+CREATE
+	INDEX reviewrequest__status_public_submitter
+	ON reviews_reviewrequest
+	(status, public, submitter_id);
@@ -1,18 +1,29 @@
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
 from django import template
 from django.conf import settings
 from django.db.models import Q
-from django.db.models.query import QuerySet
 from django.template import NodeList, TemplateSyntaxError
-from django.template.loader import render_to_string
+from django.template.loader import get_template, render_to_string
 from django.utils import simplejson
+from django.utils.encoding import smart_str
+from django.utils.timesince import timesince
+from django.utils.translation import get_language
 from djblets.util.decorators import basictag, blocktag
-from djblets.util.misc import get_object_or_none
-from djblets.util.templatetags.djblets_utils import humanize_list
+from djblets.util.misc import cache_memoize, get_object_or_none
+from djblets.util.templatetags.djblets_utils import humanize_list, \
+                                                   user_displayname
 
 from reviewboard.accounts.models import Profile
 from reviewboard.diffviewer.models import DiffSet
-from reviewboard.reviews.models import Comment, Group, ReviewRequest, \
+from reviewboard.reviews.commentcounts import get_comment_counts, \
+                                             get_screenshot_comment_counts
+from reviewboard.reviews.models import Group, ReviewRequest, \
                                        ScreenshotComment
+from reviewboard.reviews.sidebar import get_dashboard_count
 
 
 register = template.Library()
@@ -108,50 +119,8 @@ def commentcounts(context, filediff, interfilediff=None):
       localdraft  True if this is the current user's draft comment
       =========== ==================================================
     """
-    comment_dict = {}
-    user = context.get('user', None)
-
-    if interfilediff:
-        query = Comment.objects.filter(filediff=filediff,
-                                       interfilediff=interfilediff)
-    else:
-        query = Comment.objects.filter(filediff=filediff,
-                                       interfilediff__isnull=True)
-
-    for comment in query:
-        review = get_object_or_none(comment.review)
-
-        if review and (review.public or review.user == user):
-            key = (comment.first_line, comment.num_lines)
-
-            comment_dict.setdefault(key, []).append({
-                'comment_id': comment.id,
-                'text': comment.text,
-                'line': comment.first_line,
-                'num_lines': comment.num_lines,
-                'user': {
-                    'username': review.user.username,
-                    'name': review.user.get_full_name() or review.user.username,
-                },
-                #'timestamp': comment.timestamp,
-                'url': comment.get_review_url(),
-                'localdraft': review.user == user and \
-                              not review.public,
-            })
-
-    comments_array = []
-
-    for key, value in comment_dict.iteritems():
-        comments_array.append({
-            'linenum': key[0],
-            'num_lines': key[1],
-            'comments': value,
-        })
-
-    comments_array.sort(cmp=lambda x, y: cmp(x['linenum'], y['linenum'] or
-                                         cmp(x['num_lines'], y['num_lines'])))
-
-    return simplejson.dumps(comments_array)
+    return simplejson.dumps(get_comment_counts(filediff, interfilediff,
+                                               context.get('user', None)))
 
 
 @register.tag
@@ -173,33 +142,8 @@ def screenshotcommentcounts(context, screenshot):
       h           The height of the comment's region
       =========== ==================================================
     """
-    comments = {}
-    user = context.get('user', None)
-
-    for comment in screenshot.comments.all():
-        review = get_object_or_none(comment.review)
-
-        if review and (review.public or review.user == user):
-            position = '%dx%d+%d+%d' % (comment.w, comment.h, \
-                                        comment.x, comment.y)
-
-            comments.setdefault(position, []).append({
-                'id': comment.id,
-                'text': comment.text,
-                'user': {
-                    'username': review.user.username,
-                    'name': review.user.get_full_name() or review.user.username,
-                },
-                'url': comment.get_review_url(),
-                'localdraft' : review.user == user and \
-                               not review.public,
-                'x' : comment.x,
-                'y' : comment.y,
-                'w' : comment.w,
-                'h' : comment.h,
-            })
-
-    return simplejson.dumps(comments)
+    return simplejson.dumps(get_screenshot_comment_counts(
+        screenshot, context.get('user', None)))
 
 
 @register.tag
@@ -254,17 +198,26 @@ def reply_list(context, review, comment, context_type, context_id):
     s = ""
 
     if context_type == "comment" or context_type == "screenshot_comment":
-        for reply_comment in comment.public_replies(user):
-            s += generate_reply_html(reply_comment.review.get(),
-                                     reply_comment.timestamp,
+        # The review_detail view loads the replies along with the comments.
+        if hasattr(comment, '_replies'):
+            replies = comment._replies
+        else:
+            replies = [(reply_comment.review.get(), reply_comment)
+                       for reply_comment in comment.public_replies(user)]
+
+        for reply, reply_comment in replies:
+            s += generate_reply_html(reply, reply_comment.timestamp,
                                      reply_comment.text)
     elif context_type == "body_top" or context_type == "body_bottom":
-        q = Q(public=True)
+        replies = getattr(review, "_%s_replies" % context_type, None)
 
-        if user:
-            q = q | Q(user=user)
+        if replies is None:
+            q = Q(public=True)
 
-        replies = getattr(review, "%s_replies" % context_type).filter(q)
+            if user:
+                q = q | Q(user=user)
+
+            replies = getattr(review, "%s_replies" % context_type).filter(q)
 
         for reply in replies:
             s += generate_reply_html(reply, reply.timestamp,
@@ -277,6 +230,63 @@ def reply_list(context, review, comment, context_type, context_id):
     return s
 
 
+@register.tag
+@basictag(takes_context=True)
+def review_box(context, review):
+    """
+    Renders a review on the review request page, along with its comments
+    and replies, using the template :template:`reviews/review_box.html`.
+
+    Reviews loaded by the review_detail view are cached once rendered. The
+    cache key covers the replies, the relative times, the user names and
+    the screenshot captions shown, so new replies, renamed users, changed
+    captions and the passing of time are reflected. Reviews with draft
+    replies by the user aren't cached.
+    """
+    def render_review_box():
+        context.push()
+        context['review'] = review
+        s = get_template('reviews/review_box.html').render(context)
+        context.pop()
+
+        return s
+
+    user = context.get('user', None)
+    reply_reviews = getattr(review, '_reply_reviews', None)
+
+    if reply_reviews is None:
+        return render_review_box()
+
+    timestamps = [review.timestamp]
+    user_names = [user_displayname(review.user)]
+
+    for reply in reply_reviews:
+        if not reply.public:
+            return render_review_box()
+
+        timestamps.append(reply.timestamp)
+        user_names.append(user_displayname(reply.user))
+
+    for comment in review.ordered_comments + \
+                   review.ordered_screenshot_comments:
+        timestamps += [reply_comment.timestamp
+                       for reply, reply_comment in comment._replies]
+
+    captions = [comment.screenshot.caption
+                for comment in review.ordered_screenshot_comments]
+
+    key_data = [review.timestamp, user and user.is_authenticated(),
+                get_language(), settings.AJAX_SERIAL]
+    key_data += [(reply.id, reply.timestamp) for reply in reply_reviews]
+    key_data += [timesince(timestamp) for timestamp in timestamps]
+    key_data += user_names + captions
+
+    key = "review-box:%s:%s" % (review.id,
+                                md5(smart_str(repr(key_data))).hexdigest())
+
+    return cache_memoize(key, render_review_box)
+
+
 @register.inclusion_tag('reviews/review_reply_section.html',
                         takes_context=True)
 def reply_section(context, review, comment, context_type, context_id):
@@ -316,37 +326,20 @@ def dashboard_entry(context, level, text, view, group=None):
     show_count = True
     count = 0
 
-    if view == 'all':
-        review_requests = ReviewRequest.objects.public(user)
-    elif view == 'outgoing':
-        review_requests = ReviewRequest.objects.from_user(user.username, user)
-    elif view == 'mine':
-        review_requests = ReviewRequest.objects.from_user(user.username, user,
-                                                          None)
-    elif view == 'incoming':
-        review_requests = ReviewRequest.objects.to_user(user.username, user)
-    elif view == 'to-me':
-        review_requests = ReviewRequest.objects.to_user_directly(user.username,
-                                                                 user)
-    elif view == 'to-group':
-        review_requests = ReviewRequest.objects.to_group(group.name, user)
-    elif view == 'starred':
-        review_requests = \
-            user.get_profile().starred_review_requests.public(user)
+    if view in ('starred', 'watched-groups'):
         starred = True
+
+    if view == 'all':
+        count = ReviewRequest.objects.public(user).count()
     elif view == 'watched-groups':
-        starred = True
         show_count = False
+    elif view in ('outgoing', 'mine', 'incoming', 'to-me', 'to-group',
+                  'starred'):
+        count = get_dashboard_count(user, view, group)
     else:
         raise template.TemplateSyntaxError, \
             "Invalid view type '%s' passed to 'dashboard_entry' tag." % view
 
-    if show_count:
-        if type(review_requests) == QuerySet:
-            count = review_requests.count()
-        else:
-            count = len(review_requests)
-
     return {
         'MEDIA_URL': settings.MEDIA_URL,
         'level': level,
@@ -483,10 +476,13 @@ def star(context, obj):
     return render_star(context.get('user', None), obj)
 
 
-def render_star(user, obj):
+def render_star(user, obj, starred=None):
     """
     Does the actual work of rendering the star. The star tag is a wrapper
     around this.
+
+    If starred is None, the user's profile is checked to see if the object
+    is starred.
     """
     if user.is_anonymous():
         return ""
@@ -502,16 +498,18 @@ def render_star(user, obj):
             'id': obj.id
         }
 
-        starred = bool(get_object_or_none(profile.starred_review_requests,
-                                          pk=obj.id))
+        if starred is None:
+            starred = bool(get_object_or_none(profile.starred_review_requests,
+                                              pk=obj.id))
     elif isinstance(obj, Group):
         obj_info = {
             'type': 'groups',
             'id': obj.name
         }
 
-        starred = bool(get_object_or_none(profile.starred_groups,
-                                          pk=obj.id))
+        if starred is None:
+            starred = bool(get_object_or_none(profile.starred_groups,
+                                              pk=obj.id))
     else:
         raise template.TemplateSyntaxError, \
             "star tag received an incompatible object type (%s)" % \
@@ -1,19 +1,43 @@
 import logging
+import os
+import re
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.core.urlresolvers import reverse
 from django.core import mail
+from django.core.files import File
+from django.core.urlresolvers import get_resolver, reverse, \
+                                     RegexURLResolver
+from django.db import connection
 from django.template import Context, Template
 from django.test import TestCase
+from django.utils import simplejson
 
 from djblets.siteconfig.models import SiteConfiguration
 
+from reviewboard.accounts.models import Profile, ReviewRequestVisit
+from reviewboard.diffviewer.models import DiffSet, FileDiff
+from reviewboard.reviews.commentcounts import get_comment_counts
+from reviewboard.reviews.defaultreviewers import DefaultReviewerMatcher, \
+                                                get_default_reviewer_matcher
 from reviewboard.reviews.email import get_email_address_for_user, \
                                       get_email_addresses_for_group, \
                                       mail_review_request, mail_review, \
                                       mail_reply
-from reviewboard.reviews.models import Group, ReviewRequest, \
-                                       ReviewRequestDraft, Review
+from reviewboard.reviews.models import Comment, DefaultReviewer, Group, \
+                                       ReviewRequest, ReviewRequestDraft, \
+                                       Review, Screenshot, ScreenshotComment
+from reviewboard.reviews.sidebar import clear_group_dashboard_counts, \
+                                        clear_profile_dashboard_counts, \
+                                        count_review_requests, \
+                                        get_dashboard_count
+from reviewboard.scmtools.core import PRE_CREATION
+from reviewboard.scmtools.models import Repository
+
+
+# Matches the numbers in SQL, so that queries differing only by IDs can be
+# counted together.
+NUMBER_RE = re.compile(r'\b\d+\b')
 
 
 class EmailTests(TestCase):
@@ -313,6 +337,47 @@ class ViewTests(TestCase):
 
         self.client.logout()
 
+    def testReviewDetailReviews(self):
+        """Testing review_detail view's loading of reviews and replies"""
+        response = self.client.get('/r/3/')
+        self.assertEqual(response.status_code, 200)
+
+        reviews = dict([(entry['review'].id, entry['review'])
+                        for entry in self.getContextVar(response, 'entries')
+                        if 'review' in entry])
+        self.assertEqual(sorted(reviews.keys()), [2, 4, 5])
+
+        comments = reviews[2].ordered_comments
+        self.assertEqual([comment.id for comment in comments], [1])
+        self.assertEqual([(reply.id, reply_comment.id)
+                          for reply, reply_comment in comments[0]._replies],
+                         [(3, 2)])
+
+        self.assertEqual([comment.id
+                          for comment in reviews[4].ordered_comments],
+                         [3, 4])
+        self.assertEqual([reply.id for reply in reviews[5]._body_top_replies],
+                         [6, 7])
+
+    def testReviewDetailDiscardedDraft(self):
+        """Testing review_detail view's ETag after discarding a draft"""
+        self.client.login(username='admin', password='admin')
+
+        review_request = ReviewRequest.objects.get(pk=3)
+        draft = ReviewRequestDraft.create(review_request)
+        draft.summary = 'Draft summary'
+        draft.save()
+
+        response = self.client.get('/r/3/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        ReviewRequestDraft.objects.get(pk=draft.pk).delete()
+
+        response = self.client.get('/r/3/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
     def testReviewDetailSitewideLogin(self):
         """Testing review_detail view with site-wide login enabled"""
         self.siteconfig.set("auth_require_sitewide_login", True)
@@ -556,6 +621,30 @@ class ViewTests(TestCase):
 
         self.client.logout()
 
+    def testDashboardBulkLoading(self):
+        """Testing dashboard columns rendered from bulk-loaded data"""
+        self.client.login(username='doc', password='doc')
+
+        profile = User.objects.get(username='doc').get_profile()
+        profile.dashboard_columns = 'star,summary,my_comments,review_count'
+        profile.save()
+
+        response = self.client.get('/dashboard/', {'view': 'mine'})
+        self.assertEqual(response.status_code, 200)
+
+        datagrid = self.getContextVar(response, 'datagrid')
+        self.assert_(datagrid)
+        self.assertEqual(len(datagrid.columns), 4)
+
+        for row in datagrid.rows:
+            review_request = ReviewRequest.objects.get(pk=row['object'].pk)
+
+            for column in datagrid.columns:
+                self.assertEqual(column.render_data(row['object']),
+                                 column.render_data(review_request))
+
+        self.client.logout()
+
 
 class DraftTests(TestCase):
     fixtures = ['test_users', 'test_reviewrequests', 'test_scmtools']
@@ -697,6 +786,993 @@ class ConcurrencyTests(TestCase):
         self.assertEqual(comments[2].text, comment_text_3)
 
 
+
+class CounterTests(TestCase):
+    fixtures = ['test_users', 'test_reviewrequests', 'test_scmtools']
+
+    def setUp(self):
+        self.review_request = ReviewRequest.objects.get(
+            summary="Add permission checking for JSON API")
+
+    def testPublicReviewCount(self):
+        """Testing public review counts on review requests"""
+        review_count = self.review_request.public_review_count
+        shipit_count = self.review_request.shipit_count
+
+        review = Review(review_request=self.review_request,
+                        user=User.objects.get(username="doc"),
+                        ship_it=True)
+        review.save()
+        review.publish()
+
+        review_request = ReviewRequest.objects.get(pk=self.review_request.pk)
+        self.assertEqual(review_request.public_review_count, review_count + 1)
+        self.assertEqual(review_request.shipit_count, shipit_count + 1)
+
+        Review.objects.get(pk=review.pk).delete()
+
+        review_request = ReviewRequest.objects.get(pk=self.review_request.pk)
+        self.assertEqual(review_request.public_review_count, review_count)
+        self.assertEqual(review_request.shipit_count, shipit_count)
+
+    def testHasDraft(self):
+        """Testing draft flags on review requests"""
+        self.assert_(not self.review_request.has_draft)
+
+        draft = ReviewRequestDraft.create(self.review_request)
+        self.assert_(self.review_request.has_draft)
+
+        review_request = ReviewRequest.objects.get(pk=self.review_request.pk)
+        self.assert_(review_request.has_draft)
+        self.assertEqual(review_request.last_activity, draft.last_updated)
+
+        draft.delete()
+
+        review_request = ReviewRequest.objects.get(pk=self.review_request.pk)
+        self.assert_(not review_request.has_draft)
+
+    def testHasDraftStaleSave(self):
+        """Testing draft flags after saving a stale review request"""
+        self.assert_(not self.review_request.has_draft)
+
+        ReviewRequestDraft.create(
+            ReviewRequest.objects.get(pk=self.review_request.pk))
+
+        review = Review(review_request=self.review_request,
+                        user=User.objects.get(username="doc"))
+        review.save()
+        review.publish()
+
+        review_request = ReviewRequest.objects.get(pk=self.review_request.pk)
+        self.assert_(review_request.has_draft)
+
+        self.client.login(username='admin', password='admin')
+        response = self.client.get(review_request.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        self.assert_(response.context['draft'] is not None)
+
+    def testUnreadReviewCount(self):
+        """Testing unread review counts on review request visits"""
+        self.client.login(username='grumpy', password='grumpy')
+        response = self.client.get(self.review_request.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+
+        visit = ReviewRequestVisit.objects.get(
+            user__username='grumpy', review_request=self.review_request)
+        self.assertEqual(visit.unread_review_count, 0)
+
+        review = Review(review_request=self.review_request,
+                        user=User.objects.get(username="doc"))
+        review.save()
+        review.publish()
+
+        visit = ReviewRequestVisit.objects.get(pk=visit.pk)
+        self.assertEqual(visit.unread_review_count, 1)
+
+        review_request = ReviewRequest.objects.all().with_counts(
+            User.objects.get(username='grumpy')).get(
+                pk=self.review_request.pk)
+        self.assertEqual(review_request.new_review_count, 1)
+
+        response = self.client.get(self.review_request.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+
+        visit = ReviewRequestVisit.objects.get(pk=visit.pk)
+        self.assertEqual(visit.unread_review_count, 0)
+
+        self.client.logout()
+
+
+class ReviewTests(TestCase):
+    """Tests publishing and deleting reviews."""
+    fixtures = ['test_users', 'test_reviewrequests', 'test_scmtools']
+
+    def setUp(self):
+        self.review_request = ReviewRequest.objects.get(
+            summary="Add permission checking for JSON API")
+        self.filediff = FileDiff.objects.get(pk=11)
+
+    def createReview(self, num_comments):
+        review = Review(review_request=self.review_request,
+                        user=User.objects.get(username="grumpy"))
+        review.save()
+
+        for i in range(num_comments):
+            comment = Comment(filediff=self.filediff, first_line=i + 1,
+                              num_lines=1, text="Comment %s" % i)
+            comment.save()
+            review.comments.add(comment)
+
+        return Review.objects.get(pk=review.pk)
+
+    def countQueries(self, func):
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+
+        try:
+            func()
+        finally:
+            settings.DEBUG = old_debug
+
+        return len(connection.queries)
+
+    def testPublish(self):
+        """Testing Review.publish updates the comments"""
+        review = self.createReview(3)
+        review.publish()
+
+        review = Review.objects.get(pk=review.pk)
+        self.assert_(review.public)
+
+        for comment in review.comments.all():
+            self.assertEqual(comment.timestamp, review.timestamp)
+
+    def testPublishQueryCount(self):
+        """Testing Review.publish query count with many comments"""
+        small_count = self.countQueries(self.createReview(2).publish)
+        large_count = self.countQueries(self.createReview(150).publish)
+        self.assertEqual(small_count, large_count)
+
+    def testDelete(self):
+        """Testing Review.delete deletes the comments and replies"""
+        review = self.createReview(3)
+        review.publish()
+        comment_ids = list(review.comments.values_list('pk', flat=True))
+
+        reply = Review(review_request=self.review_request,
+                       user=User.objects.get(username="doc"),
+                       base_reply_to=review)
+        reply.save()
+        reply_comment = Comment(filediff=self.filediff, first_line=1,
+                                num_lines=1, text="Reply",
+                                reply_to_id=comment_ids[0])
+        reply_comment.save()
+        reply.comments.add(reply_comment)
+
+        review.delete()
+
+        self.assertEqual(Comment.objects.filter(pk__in=comment_ids).count(),
+                         0)
+        self.assertEqual(Comment.objects.filter(pk=reply_comment.pk).count(),
+                         0)
+
+    def testDeleteQueryCount(self):
+        """Testing Review.delete query count with many comments"""
+        # The comments are deleted in batches of DELETE_BATCH_SIZE, so up
+        # to that many take no more queries than a few.
+        small_count = self.countQueries(self.createReview(2).delete)
+        large_count = self.countQueries(self.createReview(150).delete)
+        self.assertEqual(small_count, large_count)
+
+
+class CommentCountsTests(TestCase):
+    """Tests the comment lists used by the diff viewer."""
+    fixtures = ['test_users', 'test_reviewrequests', 'test_scmtools']
+
+    def setUp(self):
+        self.filediff = FileDiff.objects.get(pk=11)
+        self.review_request = ReviewRequest.objects.get(
+            summary="Add permission checking for JSON API")
+
+    def getCommentIds(self, user):
+        return [(entry['linenum'],
+                 [comment['comment_id'] for comment in entry['comments']])
+                for entry in get_comment_counts(self.filediff, None, user)]
+
+    def testCommentCounts(self):
+        """Testing get_comment_counts"""
+        user = User.objects.get(username='doc')
+        entries = get_comment_counts(self.filediff, None, user)
+
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['linenum'], 333)
+        self.assertEqual(entries[0]['num_lines'], 9)
+
+        comment = entries[0]['comments'][0]
+        self.assertEqual(comment['comment_id'], 1)
+        self.assertEqual(comment['user']['username'], 'doc')
+        self.assertEqual(comment['url'],
+                         Comment.objects.get(pk=1).get_review_url())
+        self.assert_(not comment['localdraft'])
+
+        self.assertEqual([comment['comment_id']
+                          for comment in entries[0]['comments']], [1, 2])
+
+    def testCommentCountsInvalidation(self):
+        """Testing get_comment_counts after comments change"""
+        grumpy = User.objects.get(username='grumpy')
+        doc = User.objects.get(username='doc')
+        self.assertEqual(self.getCommentIds(grumpy), [(333, [1, 2])])
+
+        review = Review(review_request=self.review_request, user=grumpy)
+        review.save()
+        comment = Comment(filediff=self.filediff, first_line=10,
+                          num_lines=1, text="Draft comment")
+        comment.save()
+        review.comments.add(comment)
+
+        self.assertEqual(self.getCommentIds(grumpy),
+                         [(10, [comment.pk]), (333, [1, 2])])
+        self.assertEqual(self.getCommentIds(doc), [(333, [1, 2])])
+
+        entries = get_comment_counts(self.filediff, None, grumpy)
+        self.assert_(entries[0]['comments'][0]['localdraft'])
+
+        review.publish()
+        self.assertEqual(self.getCommentIds(doc),
+                         [(10, [comment.pk]), (333, [1, 2])])
+
+        Review.objects.get(pk=review.pk).delete()
+        self.assertEqual(self.getCommentIds(doc), [(333, [1, 2])])
+
+
+class DashboardCountTests(TestCase):
+    fixtures = ['test_users', 'test_reviewrequests', 'test_scmtools']
+
+    def testStoredCounts(self):
+        """Testing stored dashboard sidebar counts"""
+        user = User.objects.get(username='doc')
+
+        for view in ('starred', 'outgoing', 'mine', 'incoming', 'to-me'):
+            self.assertEqual(get_dashboard_count(user, view),
+                             count_review_requests(user, view))
+
+        profile = Profile.objects.get(user=user)
+        self.assertEqual(profile.outgoing_request_count,
+                         count_review_requests(user, 'outgoing'))
+
+    def testClearedCounts(self):
+        """Testing dashboard sidebar counts after closing a review request"""
+        user = User.objects.get(username='doc')
+        get_dashboard_count(user, 'outgoing')
+
+        review_request = ReviewRequest.objects.from_user('doc', user)[0]
+        review_request.close(ReviewRequest.SUBMITTED)
+
+        user = User.objects.get(username='doc')
+        self.assertEqual(user.get_profile().outgoing_request_count, None)
+        self.assertEqual(get_dashboard_count(user, 'outgoing'),
+                         count_review_requests(user, 'outgoing'))
+
+    def testGroupCounts(self):
+        """Testing dashboard sidebar counts for groups"""
+        user = User.objects.get(username='doc')
+        group = Group.objects.get(name='devgroup')
+
+        self.assertEqual(get_dashboard_count(user, 'to-group', group),
+                         ReviewRequest.objects.to_group('devgroup',
+                                                        user).count())
+        self.assertEqual(
+            Group.objects.get(pk=group.pk).incoming_request_count,
+            ReviewRequest.objects.to_group('devgroup').count())
+
+    def testCountsClearedWhileCounting(self):
+        """Testing dashboard sidebar counts cleared while being counted"""
+        user = User.objects.get(username='doc')
+        group = Group.objects.get(name='devgroup')
+        self.assertEqual(user.get_profile().outgoing_request_count, None)
+        self.assertEqual(group.incoming_request_count, None)
+
+        # Something else clears the counts after they were loaded, so a
+        # count made now may be out of date and mustn't be stored.
+        clear_profile_dashboard_counts([user.pk])
+        clear_group_dashboard_counts([group.pk])
+
+        self.assertEqual(get_dashboard_count(user, 'outgoing'),
+                         count_review_requests(user, 'outgoing'))
+        get_dashboard_count(user, 'to-group', group)
+
+        self.assertEqual(Profile.objects.get(user=user).outgoing_request_count,
+                         None)
+        self.assertEqual(
+            Group.objects.get(pk=group.pk).incoming_request_count, None)
+
+        user = User.objects.get(username='doc')
+        get_dashboard_count(user, 'outgoing')
+        self.assertEqual(Profile.objects.get(user=user).outgoing_request_count,
+                         count_review_requests(user, 'outgoing'))
+
+    def testDeletedReviewRequestCounts(self):
+        """Testing dashboard sidebar counts after deleting a review request"""
+        user = User.objects.get(username='doc')
+        count = get_dashboard_count(user, 'outgoing')
+
+        ReviewRequest.objects.from_user('doc', user)[0].delete()
+
+        user = User.objects.get(username='doc')
+        self.assertEqual(user.get_profile().outgoing_request_count, None)
+        self.assertEqual(get_dashboard_count(user, 'outgoing'), count - 1)
+
+    def testStaleProfileSave(self):
+        """Testing dashboard sidebar counts after saving a stale profile"""
+        user = User.objects.get(username='doc')
+        get_dashboard_count(user, 'outgoing')
+        profile = Profile.objects.get(user=user)
+        self.assertNotEqual(profile.outgoing_request_count, None)
+
+        review_request = ReviewRequest.objects.from_user('doc', user)[0]
+        review_request.close(ReviewRequest.SUBMITTED)
+
+        profile.syntax_highlighting = False
+        profile.save()
+
+        profile = Profile.objects.get(user=user)
+        self.assert_(not profile.syntax_highlighting)
+        self.assertEqual(profile.outgoing_request_count, None)
+        self.assertEqual(get_dashboard_count(user, 'outgoing'),
+                         count_review_requests(user, 'outgoing'))
+
+
+class DefaultReviewerTests(TestCase):
+    """Tests matching default reviewers against files."""
+    fixtures = ['test_users']
+
+    def testMatcher(self):
+        """Testing DefaultReviewerMatcher"""
+        matcher = DefaultReviewerMatcher([
+            ('.*', [1], []),
+            ('/trunk/lib/.*', [2], [10]),
+            (r'.*\.py$', [3], []),
+            (r'/trunk/(lib|src)/\w+\.c', [4], []),
+            ('/trunk/lib(', [5], []),
+        ])
+
+        self.assertEqual(matcher.match([]), (set(), set()))
+        self.assertEqual(matcher.match(['/trunk/lib/foo.c']),
+                         (set([1, 2, 4]), set([10])))
+        self.assertEqual(matcher.match(['/trunk/src/foo.py']),
+                         (set([1, 3]), set()))
+        self.assertEqual(matcher.match(['/branches/lib/foo.pyc']),
+                         (set([1]), set()))
+
+    def testMatcherInvalidation(self):
+        """Testing get_default_reviewer_matcher after changes"""
+        user = User.objects.get(username='doc')
+        default = DefaultReviewer(name='Trunk', file_regex='/trunk/.*')
+        default.save()
+        default.people.add(user)
+
+        matcher = get_default_reviewer_matcher()
+        self.assertEqual(matcher.match(['/trunk/foo.c']),
+                         (set([user.pk]), set()))
+
+        default.file_regex = '/branches/.*'
+        default.save()
+
+        matcher = get_default_reviewer_matcher()
+        self.assertEqual(matcher.match(['/trunk/foo.c']), (set(), set()))
+
+        default.delete()
+
+        matcher = get_default_reviewer_matcher()
+        self.assertEqual(matcher.match(['/branches/foo.c']), (set(), set()))
+
+    def testMatcherAdminInvalidation(self):
+        """Testing get_default_reviewer_matcher after admin UI changes"""
+        user = User.objects.get(username='doc')
+        default = DefaultReviewer(name='Trunk', file_regex='/trunk/.*')
+        default.save()
+
+        matcher = get_default_reviewer_matcher()
+        self.assertEqual(matcher.match(['/trunk/foo.c']), (set(), set()))
+
+        self.client.login(username='admin', password='admin')
+        response = self.client.post(
+            '/admin/db/reviews/defaultreviewer/%s/' % default.pk, {
+                'name': 'Trunk',
+                'file_regex': '/trunk/.*',
+                'people': [user.pk],
+            })
+        self.assertEqual(response.status_code, 302)
+
+        matcher = get_default_reviewer_matcher()
+        self.assertEqual(matcher.match(['/trunk/foo.c']),
+                         (set([user.pk]), set()))
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Tests the number of SQL queries made by each view and API call.
+
+    Each request is made on a site with hundreds of review requests,
+    reviews, comments and diffs, and is checked against the query count
+    budgets in testdata/query_budgets.json. A view that makes a query for
+    each object on a page will go over its budget.
+
+    Each request also has a generous budget for the time spent in SQL,
+    which can be scaled with RB_SQL_TIME_FACTOR on slow machines. The
+    slowest requests are logged.
+
+    Running the test with RB_RECORD_QUERY_BUDGETS set writes the measured
+    query counts, plus some headroom, to the budgets file instead of
+    checking them.
+    """
+    fixtures = ['test_users', 'test_reviewrequests', 'test_scmtools']
+
+    NUM_REVIEW_REQUESTS = 200
+    NUM_FILES = 3
+    NUM_REVIEWS = 2
+    NUM_COMMENTS = 3
+    NUM_BUSY_REVIEWS = 30
+
+    BUDGETS_FILE = os.path.join(os.path.dirname(__file__), 'testdata',
+                                'query_budgets.json')
+
+    # The number of queries a recorded budget allows over the measured
+    # count, the seconds each request may spend in SQL before it's scaled
+    # by RB_SQL_TIME_FACTOR, and the number of slowest requests logged.
+    BUDGET_HEADROOM = 2
+    SQL_TIME_BUDGET = 2.0
+    NUM_SLOWEST_LOGGED = 10
+    DIFF_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                             'scmtools', 'testdata', 'svn_makefile.diff')
+    IMAGE_FILE = os.path.join(settings.HTDOCS_ROOT, 'media', 'rb', 'images',
+                              'trophy.png')
+
+    DIFF = '--- %(path)s\t(revision 0)\n' \
+           '+++ %(path)s\t(working copy)\n' \
+           '@@ -0,0 +1,3 @@\n' \
+           '+Line 1\n' \
+           '+Line 2\n' \
+           '+Line 3\n'
+
+    # The requests made, as (method, URL, data) tuples. The URLs are filled
+    # in with the IDs of the objects created by createData. Each one must
+    # have a budget, and each URL pattern must be covered.
+    REQUESTS = [
+        # reviewboard/urls.py
+        ('GET', '/', None),
+        ('GET', '/dashboard/', None),
+        ('GET', '/dashboard/?view=outgoing', None),
+        ('GET', '/dashboard/?view=to-group&group=%(group)s', None),
+        ('GET', '/users/', None),
+        ('GET', '/users/%(username)s/', None),
+        ('GET', '/groups/', None),
+        ('GET', '/groups/%(group)s/', None),
+        ('GET', '/groups/%(group)s/members/', None),
+        ('GET', '/feeds/rss/r/', None),
+        ('GET', '/feeds/atom/users/%(username)s/', None),
+        ('GET', '/feeds/rss/groups/%(group)s/', None),
+
+        # reviewboard/reviews/urls.py
+        ('GET', '/r/', None),
+        ('GET', '/r/new/', None),
+        ('GET', '/r/%(review_request)s/', None),
+        ('GET', '/r/%(review_request)s/reviews/draft/inline-form/', None),
+        ('GET', '/r/%(review_request)s/diff/', None),
+        ('GET', '/r/%(review_request)s/diff/1/', None),
+        ('GET', '/r/%(review_request)s/diff/raw/', None),
+        ('GET', '/r/%(review_request)s/diff/1/raw/', None),
+        ('GET', '/r/%(review_request)s/diff/1/fragment/%(filediff)s/', None),
+        ('GET', '/r/%(review_request)s/diff/1/fragment/%(filediff)s/'
+                'chunk/0/', None),
+        ('GET', '/r/%(review_request)s/fragments/diff-comments/'
+                '%(comments)s/', None),
+        ('GET', '/r/%(review_request)s/diff/1-2/', None),
+        ('GET', '/r/%(review_request)s/diff/1-2/fragment/%(filediff)s/',
+         None),
+        ('GET', '/r/%(review_request)s/diff/1-2/fragment/%(filediff)s/'
+                'chunk/0/', None),
+        ('GET', '/r/%(review_request)s/s/%(screenshot)s/', None),
+        ('GET', '/r/%(review_request)s/preview-email/', None),
+        ('GET', '/r/%(review_request)s/reviews/%(review)s/preview-email/',
+         None),
+        ('GET', '/r/%(review_request)s/reviews/%(review)s/replies/'
+                '%(reply)s/preview-email/', None),
+        ('GET', '/r/search/?q=Line', None),
+        ('GET', '/r/%(review_request)s/s/%(deleted_screenshot)s/delete/',
+         None),
+
+        # reviewboard/iphone/urls.py
+        ('GET', '/iphone/', None),
+        ('GET', '/iphone/account/login/', None),
+        ('GET', '/iphone/account/preferences/', None),
+        ('GET', '/iphone/dashboard/', None),
+        ('GET', '/iphone/dashboard/list/?view=incoming', None),
+        ('GET', '/iphone/users/', None),
+        ('GET', '/iphone/users/%(username)s/', None),
+        ('GET', '/iphone/groups/', None),
+        ('GET', '/iphone/groups/%(group)s/', None),
+        ('GET', '/iphone/r/', None),
+        ('GET', '/iphone/r/%(review_request)s/', None),
+        ('GET', '/iphone/r/%(review_request)s/diff/', None),
+        ('GET', '/iphone/r/%(review_request)s/diff/1/%(filediff)s/', None),
+        ('GET', '/iphone/account/logout/', None),
+
+        # reviewboard/webapi/urls.py
+        ('POST', '/api/json/accounts/login/', {
+            'username': 'admin',
+            'password': 'admin',
+        }),
+        ('GET', '/api/json/info/', None),
+        ('GET', '/api/json/repositories/', None),
+        ('GET', '/api/json/repositories/%(repository)s/info/', None),
+        ('GET', '/api/json/users/', None),
+        ('GET', '/api/json/groups/', None),
+        ('GET', '/api/json/groups/%(group)s/users/', None),
+        ('POST', '/api/json/groups/%(group)s/star/', {}),
+        ('POST', '/api/json/groups/%(group)s/unstar/', {}),
+        ('GET', '/api/json/reviewrequests/all/', None),
+        ('GET', '/api/json/reviewrequests/all/count/', None),
+        ('GET', '/api/json/reviewrequests/to/group/%(group)s/', None),
+        ('GET', '/api/json/reviewrequests/to/group/%(group)s/count/', None),
+        ('GET', '/api/json/reviewrequests/to/user/%(username)s/', None),
+        ('GET', '/api/json/reviewrequests/to/user/%(username)s/count/',
+         None),
+        ('GET', '/api/json/reviewrequests/to/user/%(username)s/directly/',
+         None),
+        ('GET', '/api/json/reviewrequests/to/user/%(username)s/directly/'
+                'count/', None),
+        ('GET', '/api/json/reviewrequests/from/user/%(username)s/', None),
+        ('GET', '/api/json/reviewrequests/from/user/%(username)s/count/',
+         None),
+        ('POST', '/api/json/reviewrequests/new/', {
+            'repository_path': 'http://reviewboard.googlecode.com/svn',
+        }),
+        ('GET', '/api/json/reviewrequests/%(review_request)s/', None),
+        ('GET', '/api/json/reviewrequests/repository/%(repository)s/'
+                'changenum/%(changenum)s/', None),
+        ('POST', '/api/json/reviewrequests/%(review_request)s/star/', {}),
+        ('POST', '/api/json/reviewrequests/%(review_request)s/unstar/', {}),
+        ('GET', '/api/json/reviewrequests/%(review_request)s/updated/',
+         None),
+        ('GET', '/api/json/reviewrequests/%(draft_review_request)s/draft/',
+         None),
+        ('POST', '/api/json/reviewrequests/%(draft_review_request)s/draft/'
+                 'set/summary/', {
+            'value': 'New summary',
+        }),
+        ('POST', '/api/json/reviewrequests/%(draft_review_request)s/draft/'
+                 'set/', {
+            'description': 'New description',
+        }),
+        ('POST', '/api/json/reviewrequests/%(draft_review_request)s/draft/'
+                 'save/', {}),
+        ('POST', '/api/json/reviewrequests/%(draft_review_request)s/diff/'
+                 'new/', lambda: {
+            'path': open(QueryBudgetTests.DIFF_FILE, 'r'),
+            'basedir': '/trunk',
+        }),
+        ('POST', '/api/json/reviewrequests/%(draft_review_request)s/'
+                 'screenshot/new/', lambda: {
+            'path': open(QueryBudgetTests.IMAGE_FILE, 'rb'),
+        }),
+        ('POST', '/api/json/reviewrequests/%(draft_review_request)s/'
+                 'publish/', {}),
+        ('POST', '/api/json/reviewrequests/%(draft_review_request)s/draft/'
+                 'discard/', {}),
+        ('POST', '/api/json/reviewrequests/%(review_request)s/reviews/draft/'
+                 'save/', {
+            'shipit': 0,
+            'body_top': 'Body',
+            'body_bottom': '',
+        }),
+        ('GET', '/api/json/reviewrequests/%(review_request)s/reviews/draft/',
+         None),
+        ('POST', '/api/json/reviewrequests/%(review_request)s/diff/1/file/'
+                 '%(filediff)s/line/1/comments/', {
+            'action': 'set',
+            'num_lines': 1,
+            'text': 'Comment',
+        }),
+        ('GET', '/api/json/reviewrequests/%(review_request)s/diff/1-2/file/'
+                '%(filediff)s-%(interfilediff)s/line/1/comments/', None),
+        ('GET', '/api/json/reviewrequests/%(review_request)s/reviews/draft/'
+                'comments/', None),
+        ('POST', '/api/json/reviewrequests/%(review_request)s/reviews/draft/'
+                 'publish/', {
+            'shipit': 1,
+            'body_top': 'Body',
+            'body_bottom': '',
+        }),
+        ('POST', '/api/json/reviewrequests/%(review_request)s/s/'
+                 '%(screenshot)s/comments/10x10+0+0/', {
+            'action': 'set',
+            'text': 'Comment',
+        }),
+        ('POST', '/api/json/reviewrequests/%(review_request)s/reviews/draft/'
+                 'delete/', {}),
+        ('GET', '/api/json/reviewrequests/%(review_request)s/reviews/',
+         None),
+        ('GET', '/api/json/reviewrequests/%(review_request)s/reviews/count/',
+         None),
+        ('GET', '/api/json/reviewrequests/%(review_request)s/reviews/'
+                '%(review)s/', None),
+        ('GET', '/api/json/reviewrequests/%(review_request)s/reviews/'
+                '%(review)s/comments/', None),
+        ('GET', '/api/json/reviewrequests/%(review_request)s/reviews/'
+                '%(review)s/comments/count/', None),
+        ('POST', '/api/json/reviewrequests/%(review_request)s/reviews/'
+                 '%(review)s/replies/draft/', {
+            'type': 'body_top',
+            'value': 'Reply',
+        }),
+        ('POST', '/api/json/reviewrequests/%(review_request)s/reviews/'
+                 '%(review)s/replies/draft/save/', {}),
+        ('POST', '/api/json/reviewrequests/%(review_request)s/reviews/'
+                 '%(review)s/replies/draft/discard/', {}),
+        ('GET', '/api/json/reviewrequests/%(review_request)s/reviews/'
+                '%(review)s/replies/', None),
+        ('GET', '/api/json/reviewrequests/%(review_request)s/reviews/'
+                '%(review)s/replies/count/', None),
+        ('POST', '/api/json/reviewrequests/%(closed_review_request)s/close/'
+                 'submitted/', {}),
+        ('POST', '/api/json/reviewrequests/%(closed_review_request)s/'
+                 'reopen/', {}),
+        ('POST', '/api/json/reviewrequests/%(deleted_review_request)s/'
+                 'delete/', {}),
+        ('POST', '/api/json/accounts/logout/', {}),
+        ('GET', '/account/logout/', None),
+    ]
+
+    # URL patterns that aren't covered, along with the reason.
+    UNCOVERED_PATTERNS = {
+        '^media/(?P<path>.*)$': 'Only served when DEBUG is on.',
+        '^api/(?P<api_format>json|xml)/reviewrequests/'
+        '(?P<review_request_id>[0-9]+)/update_from_changenum/$':
+            'Subversion does not support change numbers.',
+    }
+
+    def testQueryBudgets(self):
+        """Testing SQL query budgets of views and API calls"""
+        ids = self.createData()
+        budgets = self.loadBudgets()
+        record = bool(os.environ.get('RB_RECORD_QUERY_BUDGETS'))
+        sql_time_budget = self.SQL_TIME_BUDGET * \
+                          float(os.environ.get('RB_SQL_TIME_FACTOR', 1))
+        failures = []
+        sql_times = []
+
+        for method, url, data in self.REQUESTS:
+            label = '%s %s' % (method, url)
+
+            try:
+                response, queries = self.makeRequest(method, url % ids, data)
+            except Exception, e:
+                failures.append('%s raised %s: %s' %
+                                (label, e.__class__.__name__, e))
+                continue
+
+            if response.status_code >= 500:
+                failures.append('%s returned HTTP %s' %
+                                (label, response.status_code))
+
+            if record:
+                budgets[label] = len(queries) + self.BUDGET_HEADROOM
+            elif len(queries) > budgets[label]:
+                failures.append(self.describeQueryCountFailure(
+                    label, queries, budgets[label]))
+
+            sql_time = sum([float(query['time']) for query in queries])
+            sql_times.append((sql_time, label, queries))
+
+            if sql_time > sql_time_budget:
+                failures.append('%s\nThis is over the budget of %.3fs.' %
+                                (self.describeSQLTime(label, queries,
+                                                      sql_time),
+                                 sql_time_budget))
+
+        sql_times.sort(reverse=True)
+
+        for sql_time, label, queries in sql_times[:self.NUM_SLOWEST_LOGGED]:
+            logging.info(self.describeSQLTime(label, queries, sql_time))
+
+        if record and not failures:
+            self.saveBudgets(budgets)
+
+        self.assert_(not failures, '\n\n'.join(failures))
+
+    def testQueryBudgetCoverage(self):
+        """Testing SQL query budgets cover every URL"""
+        budgets = self.loadBudgets()
+        labels = ['%s %s' % (method, url) for method, url, data in
+                  self.REQUESTS]
+
+        for label in labels:
+            self.assert_(label in budgets,
+                         'There is no query budget for %s' % label)
+
+        for label in budgets:
+            self.assert_(label in labels,
+                         'The query budget for %s is not used' % label)
+
+        # Fill in each URL with a placeholder ID, and strip the query
+        # string and the leading slash, to match against the patterns.
+        paths = [(url.split('?')[0] % IdPlaceholders())[1:]
+                 for method, url, data in self.REQUESTS]
+
+        for pattern in self.getURLPatterns():
+            if pattern in self.UNCOVERED_PATTERNS:
+                continue
+
+            regex = re.compile(pattern)
+            self.assert_([path for path in paths if regex.match(path)],
+                         'No request covers the URL pattern %s' % pattern)
+
+    def createData(self):
+        """
+        Creates review requests with diffs, reviews, comments and replies,
+        with one much busier review request. Returns a dictionary of the
+        IDs used to fill in the URLs.
+        """
+        users = list(User.objects.order_by('pk'))
+        admin = users[0]
+        group = Group.objects.get(name='devgroup')
+        repository = Repository.objects.get(pk=1)
+        review_requests = []
+
+        for i in range(self.NUM_REVIEW_REQUESTS):
+            submitter = users[i % len(users)]
+            reviewers = [user for user in users if user != submitter]
+
+            review_request = self.createReviewRequest(submitter, repository,
+                                                      group, reviewers[0])
+            review_requests.append(review_request)
+
+            for j in range(self.NUM_REVIEWS):
+                self.createReview(review_request,
+                                  reviewers[j % len(reviewers)])
+
+        # The busy review request belongs to the admin user, who the
+        # requests are made as.
+        review_request = review_requests[0]
+        self.assertEqual(review_request.submitter, admin)
+        self.createDiffSet(review_request, 2)
+
+        screenshot = self.createScreenshot(review_request)
+        deleted_screenshot = self.createScreenshot(review_request)
+
+        for i in range(self.NUM_BUSY_REVIEWS):
+            review = self.createReview(review_request,
+                                       users[1 + i % (len(users) - 1)],
+                                       screenshot)
+
+        reply = self.createReply(review, admin)
+
+        ReviewRequest.objects.filter(pk=review_requests[1].pk).update(
+            changenum=1234)
+
+        draft_review_request, closed_review_request, \
+            deleted_review_request = [
+                review_requests[i]
+                for i in range(len(users), len(users) * 4, len(users))
+            ]
+        ReviewRequestDraft.create(draft_review_request)
+
+        return {
+            'username': users[1].username,
+            'group': group.name,
+            'repository': repository.pk,
+            'changenum': 1234,
+            'review_request': review_request.pk,
+            'draft_review_request': draft_review_request.pk,
+            'closed_review_request': closed_review_request.pk,
+            'deleted_review_request': deleted_review_request.pk,
+            'filediff': review_request.diffset_history.diffsets.get(
+                revision=1).files.all()[0].pk,
+            'interfilediff': review_request.diffset_history.diffsets.get(
+                revision=2).files.all()[0].pk,
+            'comments': ','.join([str(comment.pk)
+                                  for comment in review.comments.all()]),
+            'review': review.pk,
+            'reply': reply.pk,
+            'screenshot': screenshot.pk,
+            'deleted_screenshot': deleted_screenshot.pk,
+        }
+
+    def createReviewRequest(self, submitter, repository, group, reviewer):
+        review_request = ReviewRequest.objects.create(submitter, repository)
+        review_request.summary = 'Review request %s' % review_request.pk
+        review_request.description = 'Description'
+        review_request.testing_done = 'Testing'
+        review_request.public = True
+        review_request.save()
+        review_request.target_groups.add(group)
+        review_request.target_people.add(reviewer)
+
+        self.createDiffSet(review_request, 1)
+
+        return review_request
+
+    def createDiffSet(self, review_request, revision):
+        diffset = DiffSet(name='diff', revision=revision,
+                          repository=review_request.repository,
+                          history=review_request.diffset_history)
+        diffset.save()
+
+        for i in range(self.NUM_FILES):
+            path = '/trunk/file%s.txt' % i
+            FileDiff(diffset=diffset, source_file=path, dest_file=path,
+                     source_revision=PRE_CREATION,
+                     dest_detail='(working copy)',
+                     diff=self.DIFF % {'path': path}).save()
+
+    def createScreenshot(self, review_request):
+        screenshot = Screenshot(caption='Trophy')
+        f = open(self.IMAGE_FILE, 'rb')
+        screenshot.image.save('trophy.png', File(f))
+        f.close()
+        review_request.screenshots.add(screenshot)
+
+        return screenshot
+
+    def createReview(self, review_request, user, screenshot=None):
+        review = Review(review_request=review_request, user=user,
+                        body_top='Body')
+        review.save()
+
+        filediffs = list(review_request.diffset_history.diffsets.get(
+            revision=1).files.all())
+
+        for i in range(self.NUM_COMMENTS):
+            comment = Comment(filediff=filediffs[i % len(filediffs)],
+                              first_line=i + 1, num_lines=1,
+                              text='Comment %s' % i)
+            comment.save()
+            review.comments.add(comment)
+
+        if screenshot:
+            comment = ScreenshotComment(screenshot=screenshot, x=0, y=0,
+                                        w=10, h=10, text='Comment')
+            comment.save()
+            review.screenshot_comments.add(comment)
+
+        review.publish()
+
+        return review
+
+    def createReply(self, review, user):
+        reply = Review(review_request=review.review_request, user=user,
+                       base_reply_to=review, body_top='Reply',
+                       body_top_reply_to=review)
+        reply.save()
+
+        for comment in review.comments.all():
+            reply_comment = Comment(filediff=comment.filediff,
+                                    first_line=comment.first_line,
+                                    num_lines=comment.num_lines,
+                                    reply_to=comment, text='Reply')
+            reply_comment.save()
+            reply.comments.add(reply_comment)
+
+        reply.publish()
+
+        return reply
+
+    def makeRequest(self, method, path, data):
+        """
+        Makes a request as the admin user, returning the response and the
+        queries made.
+        """
+        self.client.login(username='admin', password='admin')
+
+        if callable(data):
+            data = data()
+
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+
+        try:
+            if method == 'POST':
+                response = self.client.post(path, data)
+            else:
+                response = self.client.get(path)
+        finally:
+            settings.DEBUG = old_debug
+
+            for value in (data or {}).values():
+                if isinstance(value, file):
+                    value.close()
+
+        return response, connection.queries
+
+    def loadBudgets(self):
+        f = open(self.BUDGETS_FILE, 'r')
+        budgets = simplejson.loads(f.read())
+        f.close()
+
+        return budgets
+
+    def saveBudgets(self, budgets):
+        """
+        Writes the budgets to the budgets file, in the order of the
+        requests.
+        """
+        lines = []
+
+        for method, url, data in self.REQUESTS:
+            label = '%s %s' % (method, url)
+            lines.append('    %s: %s' % (simplejson.dumps(label),
+                                         budgets[label]))
+
+        f = open(self.BUDGETS_FILE, 'w')
+        f.write('{\n%s\n}\n' % ',\n'.join(lines))
+        f.close()
+
+    def getURLPatterns(self, urlconf='reviewboard.urls', prefix='^'):
+        """
+        Returns the regular expressions for the URL patterns in the URL
+        configuration and the configurations it includes from reviews,
+        webapi and iphone.
+        """
+        patterns = []
+
+        for pattern in get_resolver(urlconf).url_patterns:
+            regex = prefix + pattern.regex.pattern.lstrip('^')
+
+            if isinstance(pattern, RegexURLResolver):
+                if pattern.urlconf_name in ('reviewboard.reviews.urls',
+                                            'reviewboard.webapi.urls',
+                                            'reviewboard.iphone.urls'):
+                    patterns += self.getURLPatterns(pattern.urlconf_name,
+                                                    regex)
+            else:
+                patterns.append(regex)
+
+        return patterns
+
+    def describeQueryCountFailure(self, label, queries, budget):
+        """
+        Describes a view going over its query count budget, naming the
+        first query over the budget and the query made the most times.
+        """
+        counts = {}
+
+        for query in queries:
+            sql = NUMBER_RE.sub('N', query['sql'])
+            counts[sql] = counts.get(sql, 0) + 1
+
+        most_repeated = max([(count, sql) for sql, count in counts.items()])
+
+        return '%s made %s queries, over its budget of %s.\n' \
+               'The first query over the budget was:\n    %s\n' \
+               'The query made the most times (%s times) was:\n    %s' % \
+               (label, len(queries), budget, queries[budget]['sql'],
+                most_repeated[0], most_repeated[1])
+
+    def describeSQLTime(self, label, queries, sql_time):
+        """
+        Describes the time a view spent in SQL, naming the slowest query.
+        """
+        if not queries:
+            return '%s made no queries.' % label
+
+        slowest = max([(float(query['time']), query['sql'])
+                       for query in queries])
+
+        return '%s spent %.3fs in SQL.\n' \
+               'The slowest query (%.3fs) was:\n    %s' % \
+               (label, sql_time, slowest[0], slowest[1])
+
+
+class IdPlaceholders(dict):
+    """Fills in every ID in a URL with 1."""
+    def __getitem__(self, key):
+        return 1
+
+
 class IfNeatNumberTagTests(TestCase):
     def testMilestones(self):
         """Testing the ifneatnumber tag with milestone numbers"""
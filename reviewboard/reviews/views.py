@@ -96,6 +96,101 @@ fields_changed_name_map = {
     'diff': 'Diff',
 }
 
+
+def _get_review_comments(model, field_name, review_ids):
+    """
+    Returns a queryset of the comments of a type in any of the reviews in a
+    list of review IDs. Each comment has a review_id attribute for the
+    review it belongs to.
+    """
+    field = Review._meta.get_field(field_name)
+
+    return model.objects.filter(review__in=review_ids).extra(select={
+        'review_id': '%s.%s' % (field.m2m_db_table(),
+                                field.m2m_column_name()),
+    })
+
+
+def _load_reviews(review_request, user):
+    """
+    Loads the public reviews on a review request for display, along with
+    their comments and the replies the user can see.
+
+    This takes a fixed number of queries, however many reviews, comments
+    and replies there are. The comments and replies are stored on the
+    reviews and comments for the review_box and reply_list template tags.
+    """
+    reviews = list(review_request.get_public_reviews().select_related('user'))
+
+    if not reviews:
+        return reviews
+
+    reviews_by_id = {}
+
+    for review in reviews:
+        review.review_request = review_request
+        review.ordered_comments = []
+        review.ordered_screenshot_comments = []
+        review._reply_reviews = []
+        review._body_top_replies = []
+        review._body_bottom_replies = []
+        reviews_by_id[review.id] = review
+
+    q = Q(public=True)
+
+    if user.is_authenticated():
+        q = q | Q(user=user)
+
+    all_reviews = reviews_by_id.copy()
+
+    reply_reviews = Review.objects.filter(
+        q, base_reply_to__in=reviews_by_id.keys())
+
+    for reply in reply_reviews.select_related('user'):
+        reply.review_request = review_request
+        all_reviews[reply.id] = reply
+        reviews_by_id[reply.base_reply_to_id]._reply_reviews.append(reply)
+
+        if reply.body_top_reply_to_id in reviews_by_id:
+            review = reviews_by_id[reply.body_top_reply_to_id]
+            review._body_top_replies.append(reply)
+
+        if reply.body_bottom_reply_to_id in reviews_by_id:
+            review = reviews_by_id[reply.body_bottom_reply_to_id]
+            review._body_bottom_replies.append(reply)
+
+    comments = _get_review_comments(Comment, 'comments', all_reviews.keys())\
+        .select_related('filediff__diffset', 'interfilediff__diffset')
+    screenshot_comments = _get_review_comments(
+        ScreenshotComment, 'screenshot_comments', all_reviews.keys())\
+        .select_related('screenshot')
+
+    for queryset, attrname in ((comments, 'ordered_comments'),
+                               (screenshot_comments,
+                                'ordered_screenshot_comments')):
+        top_level_comments = []
+        replies = {}
+
+        for comment in queryset:
+            comment._review = all_reviews[comment.review_id]
+
+            if comment.review_id in reviews_by_id:
+                getattr(comment._review, attrname).append(comment)
+                top_level_comments.append(comment)
+            elif comment.reply_to_id:
+                replies.setdefault(comment.reply_to_id, []).append(
+                    (comment._review, comment))
+
+        for comment in top_level_comments:
+            comment._replies = replies.get(comment.id, [])
+
+    for review in reviews:
+        review.ordered_comments.sort(
+            key=lambda comment: (comment.filediff_id, comment.first_line))
+
+    return reviews
+
+
 @check_login_required
 def review_detail(request, review_request_id,
                   template_name="reviews/review_detail.html"):
@@ -105,7 +200,6 @@ def review_detail(request, review_request_id,
     """
     review_request = get_object_or_404(ReviewRequest, pk=review_request_id)
 
-    reviews = review_request.get_public_reviews()
     review = review_request.get_pending_review(request.user)
 
     if request.user.is_authenticated():
@@ -115,6 +209,7 @@ def review_detail(request, review_request_id,
             visited, visited_is_new = ReviewRequestVisit.objects.get_or_create(
                 user=request.user, review_request=review_request)
             visited.timestamp = datetime.now()
+            visited.unread_review_count = 0
             visited.save()
 
 
@@ -131,17 +226,16 @@ def review_detail(request, review_request_id,
         except Review.DoesNotExist:
             pass
 
-    # Find out if we can bail early. Generate an ETag for this.
-    timestamps = [review_request.last_updated]
-    draft = review_request.get_draft()
-
-    if draft:
-        timestamps.append(draft.last_updated)
+    # Find out if we can bail early. Generate an ETag for this. The last
+    # activity time covers changes to both the review request and its draft.
+    draft = None
 
-    last_activity_time = get_latest_timestamp(timestamps)
+    if review_request.has_draft:
+        draft = review_request.get_draft()
 
-    etag = "%s:%s:%s:%s" % (request.user, last_activity_time, review_timestamp,
-                            settings.AJAX_SERIAL)
+    etag = "%s:%s:%s:%s:%s" % (request.user, review_request.last_activity,
+                               review_request.has_draft, review_timestamp,
+                               settings.AJAX_SERIAL)
 
     if etag_if_none_match(request, etag):
         return HttpResponseNotModified()
@@ -151,10 +245,7 @@ def review_detail(request, review_request_id,
 
     entries = []
 
-    for temp_review in reviews:
-        temp_review.ordered_comments = \
-            temp_review.comments.order_by('filediff', 'first_line')
-
+    for temp_review in _load_reviews(review_request, request.user):
         entries.append({
             'review': temp_review,
             'timestamp': temp_review.timestamp,
@@ -0,0 +1,291 @@
+import logging
+import os
+import tempfile
+import threading
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.encoding import smart_str
+
+from reviewboard.scmtools.core import HEAD, PRE_CREATION, UNKNOWN
+
+
+class BlobStore(object):
+    """
+    Base class for a store of file contents fetched from repositories.
+
+    A blob store sits beneath the memcached layer, so that a file we've
+    already fetched from a repository survives cache evictions and process
+    restarts. Blobs are keyed by the repository, the path of the file and
+    its revision.
+
+    Only files at specific revisions are stored. Files at HEAD (or at an
+    unknown revision) may change at any time and are never stored.
+    """
+    def get(self, repository, path, revision):
+        """
+        Returns the stored contents of a file, or None if the file isn't
+        in the store.
+        """
+        raise NotImplementedError
+
+    def put(self, repository, path, revision, data):
+        """Stores the contents of a file."""
+        raise NotImplementedError
+
+    def exists(self, repository, path, revision):
+        """Returns whether a file is in the store."""
+        return self.get(repository, path, revision) is not None
+
+    def clear(self, repository=None):
+        """
+        Removes all stored files for a repository, or for every repository
+        if one isn't specified.
+        """
+        raise NotImplementedError
+
+    def is_storable(self, revision):
+        """Returns whether files at the specified revision can be stored."""
+        return revision not in (HEAD, UNKNOWN, PRE_CREATION)
+
+
+class FileSystemBlobStore(BlobStore):
+    """
+    A blob store that keeps file contents on the local disk.
+
+    Files are stored in the directory specified by the
+    SCM_BLOB_STORE_PATH setting, with a subdirectory per repository.
+    When the total size of the store grows past SCM_BLOB_STORE_MAX_SIZE
+    bytes, the least recently used files are evicted. The modification
+    time of each file is updated when it's read, and is used to determine
+    how recently it was used.
+    """
+    # The fraction of the maximum size to shrink to when evicting. This
+    # prevents an eviction pass on every write once the store is full.
+    EVICTION_RATIO = 0.9
+
+    def __init__(self, path=None, max_size=None):
+        self.path = path or settings.SCM_BLOB_STORE_PATH
+        self.max_size = max_size or settings.SCM_BLOB_STORE_MAX_SIZE
+        self._total_size = None
+        self._lock = threading.Lock()
+
+    def get(self, repository, path, revision):
+        if not self.is_storable(revision):
+            return None
+
+        filename = self._get_blob_filename(repository, path, revision)
+
+        try:
+            fp = open(filename, 'rb')
+        except IOError:
+            return None
+
+        try:
+            data = fp.read()
+        finally:
+            fp.close()
+
+        try:
+            # Mark this as recently used.
+            os.utime(filename, None)
+        except OSError:
+            pass
+
+        return data
+
+    def exists(self, repository, path, revision):
+        return (self.is_storable(revision) and
+                os.path.exists(self._get_blob_filename(repository, path,
+                                                       revision)))
+
+    def put(self, repository, path, revision, data):
+        if not self.is_storable(revision):
+            return
+
+        filename = self._get_blob_filename(repository, path, revision)
+        dirname = os.path.dirname(filename)
+
+        try:
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+
+            # Write to a temporary file first and move it into place, so
+            # that readers in other processes never see a partial file.
+            fd, tmpfile = tempfile.mkstemp(dir=dirname)
+            fp = os.fdopen(fd, 'wb')
+
+            try:
+                fp.write(data)
+            finally:
+                fp.close()
+
+            # The file may already be stored, in which case it's replaced
+            # and only the difference in size is added to the total.
+            try:
+                old_size = os.path.getsize(filename)
+            except OSError:
+                old_size = 0
+
+            os.rename(tmpfile, filename)
+        except (IOError, OSError), e:
+            logging.warning("Unable to store '%s' r%s in the blob store "
+                            "at %s: %s" % (path, revision, self.path, e))
+            return
+
+        self._lock.acquire()
+
+        try:
+            if self._total_size is None:
+                self._total_size = self._calculate_total_size()
+            else:
+                self._total_size += len(data) - old_size
+
+            if self._total_size > self.max_size:
+                self._evict()
+        finally:
+            self._lock.release()
+
+    def clear(self, repository=None):
+        if repository:
+            root = self._get_repository_dir(repository)
+        else:
+            root = self.path
+
+        self._lock.acquire()
+
+        try:
+            if not os.path.exists(root):
+                return
+
+            # Other processes may be evicting or writing files while we
+            # walk the tree, so files and directories that have already
+            # gone, or that aren't empty, are skipped.
+            for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+                for name in filenames:
+                    try:
+                        os.unlink(os.path.join(dirpath, name))
+                    except OSError:
+                        pass
+
+                for name in dirnames:
+                    try:
+                        os.rmdir(os.path.join(dirpath, name))
+                    except OSError:
+                        pass
+
+            self._total_size = None
+        finally:
+            self._lock.release()
+
+    def _get_repository_dir(self, repository):
+        return os.path.join(self.path, str(repository.id))
+
+    def _get_blob_filename(self, repository, path, revision):
+        # The repository's path is part of the key, so that pointing an
+        # existing repository somewhere else doesn't serve stale data.
+        digest = sha1('%s:%s:%s' % (smart_str(repository.path),
+                                    smart_str(path),
+                                    smart_str(revision))).hexdigest()
+
+        return os.path.join(self._get_repository_dir(repository),
+                            digest[:2], digest)
+
+    def _get_blobs(self):
+        """Returns a list of (mtime, size, filename) for all stored blobs."""
+        blobs = []
+
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for name in filenames:
+                filename = os.path.join(dirpath, name)
+
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    # Another process may have evicted this already.
+                    continue
+
+                blobs.append((st.st_mtime, st.st_size, filename))
+
+        return blobs
+
+    def _calculate_total_size(self):
+        return sum([size for mtime, size, filename in self._get_blobs()])
+
+    def _evict(self):
+        """
+        Evicts the least recently used blobs until the store is below
+        its target size.
+
+        Other processes may be writing to the store as well, so the size
+        is recalculated from the disk rather than trusted.
+        """
+        blobs = self._get_blobs()
+        blobs.sort()
+
+        total_size = sum([size for mtime, size, filename in blobs])
+        target_size = int(self.max_size * self.EVICTION_RATIO)
+
+        for mtime, size, filename in blobs:
+            if total_size <= target_size:
+                break
+
+            try:
+                os.unlink(filename)
+                total_size -= size
+            except OSError:
+                pass
+
+        self._total_size = total_size
+
+
+_blob_store = None
+_blob_store_lock = threading.Lock()
+
+
+def get_blob_store():
+    """
+    Returns the blob store configured for this site.
+
+    The class used is specified by the SCM_BLOB_STORE setting, which is
+    the full path to a BlobStore subclass. If it's empty, no blob store is
+    used and this returns None.
+    """
+    global _blob_store
+
+    class_path = getattr(settings, 'SCM_BLOB_STORE', None)
+
+    if not class_path:
+        return None
+
+    if _blob_store is None:
+        _blob_store_lock.acquire()
+
+        try:
+            if _blob_store is None:
+                i = class_path.rfind('.')
+                module, attr = class_path[:i], class_path[i+1:]
+
+                try:
+                    mod = __import__(module, {}, {}, [attr])
+                except ImportError, e:
+                    raise ImproperlyConfigured, \
+                        'Error importing blob store %s: "%s"' % (module, e)
+
+                try:
+                    cls = getattr(mod, attr)
+                except AttributeError:
+                    raise ImproperlyConfigured, \
+                        'Module "%s" does not define a "%s" blob store' % \
+                        (module, attr)
+
+                _blob_store = cls()
+        finally:
+            _blob_store_lock.release()
+
+    return _blob_store
@@ -1,5 +1,7 @@
 import calendar
 from datetime import datetime, timedelta
+import os
+import threading
 import time
 
 try:
@@ -9,6 +11,7 @@ except ImportError:
 
 from reviewboard.scmtools.core import SCMTool, PRE_CREATION
 from reviewboard.scmtools.errors import SCMError
+from reviewboard.scmtools.lrucache import LRUCache
 
 
 # BZRTool: An interface to Bazaar SCM Tool (http://bazaar-vcs.org/)
@@ -16,6 +19,9 @@ from reviewboard.scmtools.errors import SCMError
 class BZRTool(SCMTool):
     name = "Bazaar"
 
+    # Branch handles are shared, and each has its own lock.
+    thread_safe = True
+
     # Timestamp format in bzr diffs.
     # This isn't totally accurate: there should be a %z at the end.
     # Unfortunately, strptime() doesn't support %z.
@@ -35,21 +41,11 @@ class BZRTool(SCMTool):
         revspec = self._revspec_from_revision(revision)
         filepath = self._get_full_path(path)
 
-        branch = None
         try:
-            try:
-                tree, branch, relpath = bzrdir.BzrDir.open_containing_tree_or_branch(filepath)
-                branch.lock_read()
-                fileid = tree.path2id(relpath)
-                revtree = revisionspec.RevisionSpec.from_string(revspec).as_tree(branch)
-                contents = revtree.get_file_text(fileid)
-            except Exception, e:
-                raise SCMError(e)
-        finally:
-            if branch:
-                branch.unlock()
-
-        return contents
+            handle, relpath = get_bzr_branch(filepath)
+            return handle.get_file_text(relpath, revspec)
+        except Exception, e:
+            raise SCMError(e)
 
     def parse_diff_revision(self, file_str, revision_str):
         if revision_str == BZRTool.PRE_CREATION_TIMESTAMP:
@@ -107,3 +103,91 @@ class BZRTool(SCMTool):
         # convert to local time
         return datetime.fromtimestamp(calendar.timegm(timestamp.timetuple()))
 
+
+class BzrBranchHandle(object):
+    """
+    An open Bazaar branch, along with a cache of recently used revision
+    trees.
+
+    Files in a diff usually share a revision, so the tree for a revspec
+    only needs to be built once. The handle is locked while in use, since
+    bzrlib objects aren't thread-safe.
+    """
+    # The number of revision trees to keep around.
+    MAX_REVISION_TREES = 32
+
+    def __init__(self, tree, branch):
+        self.tree = tree
+        self.branch = branch
+        self.lock = threading.Lock()
+        self.revtrees = LRUCache(self.MAX_REVISION_TREES)
+
+    def get_file_text(self, relpath, revspec):
+        def build_revtree():
+            spec = revisionspec.RevisionSpec.from_string(revspec)
+            return spec.as_tree(self.branch)
+
+        self.lock.acquire()
+
+        try:
+            self.branch.lock_read()
+
+            try:
+                revtree = self.revtrees.get_or_create(revspec, build_revtree)
+
+                if self.tree:
+                    fileid = self.tree.path2id(relpath)
+                else:
+                    fileid = revtree.path2id(relpath)
+
+                return revtree.get_file_text(fileid)
+            finally:
+                self.branch.unlock()
+        finally:
+            self.lock.release()
+
+
+# The number of directories and branches to remember.
+MAX_BZR_BRANCHES = 64
+
+# Open branches, keyed by their base URL.
+_bzr_branches = LRUCache(MAX_BZR_BRANCHES)
+
+# The branch base URL and path within the branch for each directory.
+_bzr_dirs = LRUCache(MAX_BZR_BRANCHES)
+
+
+def get_bzr_branch(filepath):
+    """
+    Returns a tuple of (branch handle, path within the branch) for the
+    file at the given path.
+
+    Branches are opened once per process and shared, no matter how many
+    directories within them files are fetched from.
+    """
+    dirpath, filename = os.path.split(filepath)
+    dir_info = _bzr_dirs.get(dirpath)
+
+    if dir_info:
+        base, reldir = dir_info
+        handle = _bzr_branches.get(base)
+    else:
+        handle = None
+
+    if not handle:
+        tree, branch, reldir = \
+            bzrdir.BzrDir.open_containing_tree_or_branch(dirpath)
+        base = branch.base
+
+        handle = _bzr_branches.get(base)
+
+        if not handle:
+            handle = BzrBranchHandle(tree, branch)
+            _bzr_branches.put(base, handle)
+
+        _bzr_dirs.put(dirpath, (base, reldir))
+
+    if reldir:
+        return handle, '%s/%s' % (reldir, filename)
+    else:
+        return handle, filename
@@ -1,5 +1,12 @@
+import logging
 import os
+import select
+import shutil
+import signal
 import subprocess
+import tempfile
+import threading
+import time
 
 from reviewboard.diffviewer.parser import DiffParser
 from reviewboard.scmtools.core import SCMTool, HEAD, PRE_CREATION
@@ -7,6 +14,13 @@ from reviewboard.scmtools.errors import SCMError, FileNotFoundError
 
 
 class ClearCaseTool(SCMTool):
+    # Files are read through a shared cleartool session, which serializes
+    # its commands.
+    thread_safe = True
+
+    # The number of results to remember for unextend_path and adjust_path.
+    MAX_MEMOIZED_PATHS = 10000
+
     def __init__(self, repository):
         self.repopath = repository.path
 
@@ -15,7 +29,28 @@ class ClearCaseTool(SCMTool):
         self.client = ClearCaseClient(self.repopath)
         self.uses_atomic_revisions = False
 
+        self._unextended_paths = {}
+        self._adjusted_paths = {}
+
     def unextend_path(self, path):
+        return self._memoize(self._unextended_paths, path,
+                             self._unextend_path)
+
+    def adjust_path(self, path):
+        return self._memoize(self._adjusted_paths, path, self._adjust_path)
+
+    def _memoize(self, results, path, func):
+        try:
+            return results[path]
+        except KeyError:
+            if len(results) >= self.MAX_MEMOIZED_PATHS:
+                results.clear()
+
+            result = func(path)
+            results[path] = result
+            return result
+
+    def _unextend_path(self, path):
         # ClearCase extended path is kind of unreadable on the diff viewer.
         # For example:
         #     /vobs/comm/@@/main/122/network/@@/main/55/sntp/
@@ -61,7 +96,7 @@ class ClearCaseTool(SCMTool):
         else:
             assert False
 
-    def adjust_path(self, path):
+    def _adjust_path(self, path):
         # This function adjust the given path to the
         #   linux path used on the server
         drive, elem_path = os.path.splitdrive(path)
@@ -122,11 +157,252 @@ class ClearCaseDiffParser(DiffParser):
 
         return linenum
 
+
+class CleartoolSessionError(Exception):
+    """An error talking to an interactive cleartool process."""
+    pass
+
+
+class CleartoolSession(object):
+    """
+    A long-running interactive cleartool process for a view.
+
+    Starting cleartool can take a second or more, so rather than starting
+    one per file, commands are fed to a single process. The process runs
+    in its own temporary directory, and each command is followed by a
+    "pwd". When that directory shows up in the output, the command is
+    done.
+
+    Commands are serialized with a lock. If a command times out or the
+    process dies, the process is restarted and the command retried once.
+    After repeated failures, the session is disabled for a while and
+    callers are expected to fall back on running separate processes.
+    """
+    command = ['cleartool']
+
+    # The number of seconds to wait for a command to finish.
+    TIMEOUT = 60
+
+    # The number of failed commands in a row before the session is
+    # disabled, and the number of seconds it stays disabled.
+    MAX_FAILURES = 3
+    DISABLE_TIME = 5 * 60
+
+    # The name of the file that get_file has cleartool write to, in the
+    # session's working directory.
+    GET_FILENAME = 'get.tmp'
+
+    # Characters that can't be passed safely in a quoted argument. A quote
+    # would end the argument, and a newline would end the command and
+    # start another.
+    UNSAFE_CHARS = '"\r\n'
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._process = None
+        self._workdir = None
+        self._buffer = ''
+        self._failures = 0
+        self._disabled_until = 0
+
+    def is_available(self):
+        return os.name != 'nt' and time.time() >= self._disabled_until
+
+    def can_pass(self, filename):
+        """Returns whether a filename can be passed to cleartool safely."""
+        for c in self.UNSAFE_CHARS:
+            if c in filename:
+                return False
+
+        return True
+
+    def run(self, command):
+        """
+        Runs a command, returning its output. Error messages are included
+        in the output.
+        """
+        self.lock.acquire()
+
+        try:
+            return self._run_with_retry(command)
+        finally:
+            self.lock.release()
+
+    def get_file(self, filename):
+        """
+        Returns the contents of a file, or None if cleartool couldn't
+        get it.
+
+        The file is written to the session's private working directory,
+        rather than to a shared temporary directory where someone else
+        could put a file or symlink in its place.
+        """
+        if not self.can_pass(filename):
+            raise CleartoolSessionError("Can't pass %r to cleartool" %
+                                        filename)
+
+        self.lock.acquire()
+
+        try:
+            # The name is relative to the working directory, which changes
+            # if the process is restarted. Only one command runs at a time,
+            # so the same name can be used for every file.
+            self._run_with_retry('get -to "%s" "%s"' %
+                                 (self.GET_FILENAME, filename))
+            tmpfile = os.path.join(self._workdir, self.GET_FILENAME)
+
+            if not os.path.exists(tmpfile):
+                return None
+
+            try:
+                f = open(tmpfile, 'rb')
+
+                try:
+                    return f.read()
+                finally:
+                    f.close()
+            finally:
+                os.unlink(tmpfile)
+        finally:
+            self.lock.release()
+
+    def _run_with_retry(self, command):
+        """
+        Runs a command, restarting the process and retrying once if it
+        fails. This must be called with the lock held.
+        """
+        for attempt in range(2):
+            try:
+                if self._process is None:
+                    self._start()
+
+                output = self._run(command)
+                self._failures = 0
+                return output
+            except (CleartoolSessionError, IOError, OSError), e:
+                logging.warning("cleartool session for %s failed: %s" %
+                                (self.path, e))
+                self._stop()
+
+        self._failures += 1
+
+        if self._failures >= self.MAX_FAILURES:
+            self._failures = 0
+            self._disabled_until = time.time() + self.DISABLE_TIME
+
+        raise CleartoolSessionError(str(e))
+
+    def _run(self, command):
+        marker = self._workdir + '\n'
+
+        self._process.stdin.write('%s\npwd\n' % command)
+        self._process.stdin.flush()
+
+        deadline = time.time() + self.TIMEOUT
+        fd = self._process.stdout.fileno()
+
+        while True:
+            if self._buffer.startswith(marker):
+                i = 0
+            else:
+                i = self._buffer.find('\n' + marker)
+
+                if i != -1:
+                    i += 1
+
+            if i != -1:
+                output = self._buffer[:i]
+                self._buffer = self._buffer[i + len(marker):]
+                return output
+
+            timeout = deadline - time.time()
+
+            if timeout <= 0 or not select.select([fd], [], [], timeout)[0]:
+                raise CleartoolSessionError("Timed out running '%s'" %
+                                            command)
+
+            data = os.read(fd, 65536)
+
+            if not data:
+                raise CleartoolSessionError("cleartool exited unexpectedly")
+
+            self._buffer += data
+
+    def _start(self):
+        self._workdir = os.path.realpath(
+            tempfile.mkdtemp(prefix='reviewboard.cleartool.'))
+        self._buffer = ''
+        self._process = subprocess.Popen(self.command,
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.STDOUT,
+                                         cwd=self._workdir,
+                                         close_fds=True)
+
+    def _stop(self):
+        if self._process:
+            p = self._process
+            self._process = None
+
+            try:
+                p.stdin.close()
+                p.stdout.close()
+            except IOError:
+                pass
+
+            try:
+                os.kill(p.pid, signal.SIGKILL)
+            except OSError:
+                # It already exited.
+                pass
+
+            p.wait()
+
+        if self._workdir:
+            shutil.rmtree(self._workdir, ignore_errors=True)
+            self._workdir = None
+
+
+_cleartool_sessions = {}
+_cleartool_sessions_lock = threading.Lock()
+
+
+def get_cleartool_session(path):
+    """Returns the shared cleartool session for a view."""
+    _cleartool_sessions_lock.acquire()
+
+    try:
+        if path not in _cleartool_sessions:
+            _cleartool_sessions[path] = CleartoolSession(path)
+
+        return _cleartool_sessions[path]
+    finally:
+        _cleartool_sessions_lock.release()
+
+
 class ClearCaseClient:
     def __init__(self, path):
         self.path = path
 
     def cat_file(self, filename, revision):
+        session = get_cleartool_session(self.path)
+
+        if session.is_available() and session.can_pass(filename):
+            try:
+                contents = session.get_file(filename)
+
+                if contents is not None:
+                    return contents
+            except CleartoolSessionError, e:
+                logging.warning("Falling back on cat for %s: %s" %
+                                (filename, e))
+
+        # Either the session isn't usable, or cleartool couldn't get the
+        # file. cat will tell us why.
+        return self._cat_file(filename)
+
+    def _cat_file(self, filename):
         p = subprocess.Popen(
             ['cat', filename],
             stderr=subprocess.PIPE,
@@ -144,4 +420,3 @@ class ClearCaseClient:
             raise FileNotFoundError(filename)
         else:
             raise SCMError(errmsg)
-
@@ -40,6 +40,21 @@ PRE_CREATION = Revision("PRE-CREATION")
 class SCMTool:
     name = None
 
+    # Whether a single instance of this tool can be used by several threads
+    # at once.
+    #
+    # Tool instances are cached per process by Repository.get_scmtool().
+    # Thread-safe tools are shared by every thread in the process. Tools
+    # that hold state which can't be shared (open connections, clients that
+    # aren't reentrant, etc.) should leave this as False, in which case
+    # each thread gets its own instance.
+    thread_safe = False
+
+    # Whether files are read from storage local to this server. Files from
+    # these tools are cheap to read, so they bypass the cache, blob store
+    # and fetch service.
+    uses_local_storage = False
+
     def __init__(self, repository):
         self.repository = repository
         self.uses_atomic_revisions = False
@@ -55,6 +70,16 @@ class SCMTool:
         except FileNotFoundError, e:
             return False
 
+    def prefetch_files(self, files):
+        """
+        Hints that the files in the list of (path, revision) tuples are
+        about to be fetched.
+
+        Tools that can fetch several files at once more cheaply than one
+        after another can override this to fetch them up front.
+        """
+        pass
+
     def parse_diff_revision(self, file_str, revision_str):
         raise NotImplementedError
 
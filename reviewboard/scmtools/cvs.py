@@ -13,6 +13,10 @@ from reviewboard.diffviewer.parser import DiffParser, DiffParserError
 class CVSTool(SCMTool):
     name = "CVS"
 
+    # CVSClient keeps the temporary directory of the checkout in progress
+    # on the instance, so instances must not be shared.
+    thread_safe = False
+
     regex_rev = re.compile(r'^.*?(\d+(\.\d+)+)\r?$')
     regex_repopath = re.compile(r'^(?P<hostname>.*):(?P<port>\d+)?(?P<path>.*)')
 
@@ -133,7 +137,6 @@ class CVSDiffParser(DiffParser):
 class CVSClient:
     def __init__(self, repository, path):
         self.tempdir = ""
-        self.currentdir = os.getcwd()
         self.repository = repository
         self.path = path
 
@@ -143,12 +146,10 @@ class CVSClient:
             raise ImportError
 
     def cleanup(self):
-        if self.currentdir != os.getcwd():
-            # Restore current working directory
-            os.chdir(self.currentdir)
-            # Remove temporary directory
-            if self.tempdir != "":
-                os.rmdir(self.tempdir)
+        # Remove temporary directory
+        if self.tempdir != "":
+            os.rmdir(self.tempdir)
+            self.tempdir = ""
 
     def cat_file(self, filename, revision):
         # We strip the repo off of the fully qualified path as CVS does
@@ -186,13 +187,16 @@ class CVSClient:
 
     def _cat_specific_file(self, filename, revision):
         # Somehow CVS sometimes seems to write .cvsignore files to current
-        # working directory even though we force stdout with -p.
+        # working directory even though we force stdout with -p. Run it in
+        # a temporary directory. The working directory is shared by every
+        # thread in the process, so it's passed to the child process rather
+        # than changed with os.chdir.
         self.tempdir = tempfile.mkdtemp()
-        os.chdir(self.tempdir)
 
         p = subprocess.Popen(['cvs', '-f', '-d', self.repository, 'checkout',
                               '-r', str(revision), '-p', filename],
                              stderr=subprocess.PIPE, stdout=subprocess.PIPE,
+                             cwd=self.tempdir,
                              close_fds=(os.name != 'nt'))
         contents = p.stdout.read()
         errmsg = p.stderr.read()
@@ -26,6 +26,14 @@ class EmptyChangeSetError(ChangeSetError):
         ChangeSetError.__init__(self, _('Changeset %s is empty') % changenum)
 
 
+class SCMTimeoutError(SCMError):
+    pass
+
+
+class RepositoryUnavailableError(SCMError):
+    pass
+
+
 class FileNotFoundError(SCMError):
     def __init__(self, path, revision=None, detail=None):
         from reviewboard.scmtools.core import HEAD
@@ -0,0 +1,252 @@
+import logging
+import Queue
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.utils.translation import ugettext as _
+
+from reviewboard.scmtools.errors import FileNotFoundError, \
+                                        RepositoryUnavailableError, \
+                                        SCMTimeoutError
+from reviewboard.scmtools.negativecache import cached_get_file
+
+
+class FetchJob(object):
+    """A call waiting to be run, or running, in a FetchService."""
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.event = threading.Event()
+        self.cancelled = False
+        self.result = None
+        self.exc_info = None
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args)
+        except:
+            self.exc_info = sys.exc_info()
+
+        self.event.set()
+
+
+class FetchService(object):
+    """
+    Runs repository operations for a repository on a bounded pool of
+    worker threads.
+
+    Request threads hand calls to the service and wait for the result
+    with a deadline, so a slow or hung repository can't tie up every web
+    worker. At most SCM_FETCH_WORKERS calls run at once, and at most
+    SCM_FETCH_QUEUE_SIZE wait their turn. Calls that miss their deadline
+    are cancelled if they haven't started yet.
+
+    The service also acts as a circuit breaker. After FAILURE_THRESHOLD
+    failures or timeouts in a row, it fails every call immediately for
+    RESET_TIME seconds. After that, one call is let through to see if the
+    repository has recovered.
+    """
+    FAILURE_THRESHOLD = 5
+    RESET_TIME = 60
+
+    def __init__(self, name, workers=None, queue_size=None, timeout=None):
+        self.name = name
+        self.num_workers = workers or settings.SCM_FETCH_WORKERS
+        self.timeout = timeout or settings.SCM_FETCH_TIMEOUT
+        self.queue = Queue.Queue(queue_size or settings.SCM_FETCH_QUEUE_SIZE)
+        self.lock = threading.Lock()
+        self.workers = []
+        self.failures = 0
+        self.open_until = None
+        self.trial_running = False
+
+    def run(self, func, *args):
+        """
+        Runs func(*args) on a worker thread and returns its result,
+        raising any exception it raised.
+
+        RepositoryUnavailableError is raised if the circuit breaker is
+        open or too many calls are waiting. SCMTimeoutError is raised if
+        the call doesn't finish in time.
+        """
+        is_trial = self._check_circuit()
+        job = FetchJob(func, args)
+
+        try:
+            self._start_workers()
+
+            try:
+                self.queue.put_nowait(job)
+            except Queue.Full:
+                raise RepositoryUnavailableError(
+                    _("Too many requests are waiting on %s") % self.name)
+
+            job.event.wait(self.timeout)
+
+            if not job.event.isSet():
+                job.cancelled = True
+                self._record_result(False, is_trial)
+                raise SCMTimeoutError(
+                    _("Timed out waiting on %s") % self.name)
+
+            if job.exc_info:
+                # Files that don't exist don't say anything about the
+                # health of the repository.
+                self._record_result(
+                    issubclass(job.exc_info[0], FileNotFoundError), is_trial)
+                raise job.exc_info[0], job.exc_info[1], job.exc_info[2]
+
+            self._record_result(True, is_trial)
+            return job.result
+        finally:
+            if is_trial:
+                self.trial_running = False
+
+    def run_in_background(self, func, *args):
+        """
+        Queues func(*args) to run on a worker thread, without waiting for
+        it. Returns whether it was queued.
+
+        This is for work that's only a hint, such as prefetching files. It
+        has no deadline and isn't counted by the circuit breaker, so a slow
+        batch can't make the repository look like it's failing. Nothing is
+        queued while the circuit breaker is open, or once the queue is half
+        full, so that there's always room left for calls that are waited on.
+        """
+        if (self.open_until is not None or
+            self.queue.qsize() >= self.queue.maxsize / 2):
+            return False
+
+        self._start_workers()
+
+        try:
+            self.queue.put_nowait(FetchJob(func, args))
+        except Queue.Full:
+            return False
+
+        return True
+
+    def _check_circuit(self):
+        """
+        Raises RepositoryUnavailableError if the circuit breaker is open.
+        Returns whether this call is a trial of a repository that was
+        failing.
+        """
+        self.lock.acquire()
+
+        try:
+            if self.open_until is None:
+                return False
+
+            if time.time() < self.open_until or self.trial_running:
+                raise RepositoryUnavailableError(
+                    _("%s is not responding. Try again later.") % self.name)
+
+            self.trial_running = True
+            return True
+        finally:
+            self.lock.release()
+
+    def _record_result(self, success, is_trial):
+        self.lock.acquire()
+
+        try:
+            if success:
+                self.failures = 0
+                self.open_until = None
+            else:
+                self.failures += 1
+
+                if is_trial or self.failures >= self.FAILURE_THRESHOLD:
+                    if self.open_until is None:
+                        logging.error("%s is failing. Failing requests to "
+                                      "it for %s seconds." %
+                                      (self.name, self.RESET_TIME))
+
+                    self.open_until = time.time() + self.RESET_TIME
+        finally:
+            self.lock.release()
+
+    def _start_workers(self):
+        if len(self.workers) >= self.num_workers:
+            return
+
+        self.lock.acquire()
+
+        try:
+            while len(self.workers) < self.num_workers:
+                worker = threading.Thread(target=self._worker)
+                worker.setDaemon(True)
+                worker.start()
+                self.workers.append(worker)
+        finally:
+            self.lock.release()
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+
+            if not job.cancelled:
+                job.run()
+
+
+_fetch_services = {}
+_fetch_services_lock = threading.Lock()
+
+
+def get_fetch_service(repository):
+    """Returns the fetch service for a repository."""
+    _fetch_services_lock.acquire()
+
+    try:
+        if repository.id not in _fetch_services:
+            _fetch_services[repository.id] = FetchService(repository.name)
+
+        return _fetch_services[repository.id]
+    finally:
+        _fetch_services_lock.release()
+
+
+def fetch_repository_file(repository, path, revision):
+    """
+    Fetches a file from a repository through its fetch service.
+
+    This is subject to the deadline, concurrency limits and circuit
+    breaker of the service.
+    """
+    # Make sure the tool is loaded now, rather than from the database
+    # connection of a worker thread.
+    repository.tool
+
+    return get_fetch_service(repository).run(_fetch_file, repository, path,
+                                             revision)
+
+
+def _fetch_file(repository, path, revision):
+    tool = repository.get_scmtool()
+    return cached_get_file(repository, tool, path, revision)
+
+
+def prefetch_repository_files(repository, files):
+    """
+    Tells the SCMTool for a repository, through its fetch service, that
+    the files in the list of (path, revision) tuples are about to be
+    fetched.
+
+    The files are prefetched in the background. See
+    FetchService.run_in_background.
+    """
+    repository.tool
+
+    get_fetch_service(repository).run_in_background(_prefetch_files,
+                                                    repository, files)
+
+
+def _prefetch_files(repository, files):
+    try:
+        repository.get_scmtool().prefetch_files(files)
+    except Exception, e:
+        logging.warning("Unable to prefetch files from %s: %s" %
+                        (repository, e))
@@ -18,6 +18,9 @@ class GitTool(SCMTool):
     """
     name = "Git"
 
+    # Every operation runs its own git process, so nothing is shared.
+    thread_safe = True
+
     def __init__(self, repository):
         SCMTool.__init__(self, repository)
         self.client = GitClient(repository.path)
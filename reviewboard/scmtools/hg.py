@@ -1,4 +1,11 @@
+import base64
+import httplib
+import os
+import socket
+import threading
+import urllib
 import urllib2
+import urlparse
 try:
     from urllib2 import quote as urllib_quote
 except ImportError:
@@ -7,10 +14,15 @@ except ImportError:
 from reviewboard.diffviewer.parser import DiffParser, DiffParserError
 from reviewboard.scmtools.core import \
     FileNotFoundError, SCMTool, HEAD, PRE_CREATION
+from reviewboard.scmtools.lrucache import LRUCache
 
 class HgTool(SCMTool):
     name = "Mercurial"
 
+    # Mercurial repository objects are not thread-safe, so instances must
+    # not be shared.
+    thread_safe = False
+
     def __init__(self, repository):
         SCMTool.__init__(self, repository)
         if repository.path.startswith('http'):
@@ -26,6 +38,11 @@ class HgTool(SCMTool):
     def get_file(self, path, revision=HEAD):
         return self.client.cat_file(path, str(revision))
 
+    def prefetch_files(self, files):
+        if isinstance(self.client, HgWebClient):
+            self.client.prefetch_files([(path, str(revision))
+                                        for path, revision in files])
+
     def parse_diff_revision(self, file_str, revision_str):
         revision = revision_str
         if file_str == "/dev/null":
@@ -92,42 +109,270 @@ class HgDiffParser(DiffParser):
         return linenum
 
 
+class HgConnectionPool(object):
+    """
+    A pool of keep-alive HTTP connections to a server.
+
+    Connections are handed out to one caller at a time and put back once
+    the response has been read, so that later requests can skip the TCP
+    and TLS handshakes.
+    """
+    def __init__(self, scheme, netloc):
+        if scheme == 'https':
+            self.connection_class = httplib.HTTPSConnection
+        else:
+            self.connection_class = httplib.HTTPConnection
+
+        self.netloc = netloc
+        self.lock = threading.Lock()
+        self.idle = []
+
+    def get(self):
+        """
+        Returns a tuple of (connection, reused), where reused says whether
+        the connection came from the pool.
+        """
+        self.lock.acquire()
+
+        try:
+            if self.idle:
+                return self.idle.pop(), True
+        finally:
+            self.lock.release()
+
+        return self.connection_class(self.netloc), False
+
+    def put(self, conn):
+        self.lock.acquire()
+
+        try:
+            self.idle.append(conn)
+        finally:
+            self.lock.release()
+
+
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+
+
+def get_connection_pool(scheme, netloc):
+    """Returns the shared connection pool for a server."""
+    _connection_pools_lock.acquire()
+
+    try:
+        key = (scheme, netloc)
+
+        if key not in _connection_pools:
+            _connection_pools[key] = HgConnectionPool(scheme, netloc)
+
+        return _connection_pools[key]
+    finally:
+        _connection_pools_lock.release()
+
+
+# The raw file URL flavour known to work for each repository URL.
+_raw_paths = {}
+
+# Files fetched by HgWebClient.prefetch_files that haven't been asked for
+# yet, keyed by (repository URL, path, revision). These are shared by all
+# threads, since the thread that prefetches files isn't necessarily the
+# one that fetches them. Files at tip are never kept, since they may
+# change before they're asked for.
+MAX_PREFETCHED_FILES = 256
+MAX_PREFETCHED_BYTES = 32 * 1024 * 1024
+_prefetched_files = LRUCache(MAX_PREFETCHED_FILES, MAX_PREFETCHED_BYTES)
+
+
 class HgWebClient:
+    RAW_PATHS = ["raw-file", "raw"]
+
+    # The maximum number of files to fetch at once in prefetch_files.
+    MAX_PREFETCH_THREADS = 4
+
     def __init__(self, repoPath, username, password):
-        self.url = repoPath
+        self.url = repoPath.rstrip('/')
         self.username = username
         self.password = password
 
+        self.scheme, self.netloc, self.base_path = \
+            urlparse.urlsplit(self.url)[:3]
+        self.pool = get_connection_pool(self.scheme, self.netloc)
+
+        # Requests through a proxy are made with urllib2, which knows how
+        # to talk to one, rather than over the pooled connections.
+        if (self.scheme in urllib.getproxies() and
+            not urllib.proxy_bypass(self.netloc.split(':')[0])):
+            self.opener = urllib2.build_opener()
+        else:
+            self.opener = None
+
+        self.headers = {}
+
+        if self.username:
+            self.headers['Authorization'] = 'Basic %s' % base64.b64encode(
+                '%s:%s' % (self.username, self.password or ''))
+
     def cat_file(self, path, rev="tip"):
         if rev == HEAD:
             rev = "tip"
         elif rev == PRE_CREATION:
             rev = ""
 
-        found = False
+        data = _prefetched_files.pop((self.url, path, rev))
 
-        for rawpath in ["raw-file", "raw"]:
+        if data is not None:
+            return data
+
+        if self.url in _raw_paths:
+            rawpaths = [_raw_paths[self.url]]
+        else:
+            rawpaths = self.RAW_PATHS
+
+        for rawpath in rawpaths:
             try:
-                passman = urllib2.HTTPPasswordMgrWithDefaultRealm()
-                passman.add_password(None, self.url, self.username,
-                                     self.password)
-                authhandler = urllib2.HTTPBasicAuthHandler(passman)
-                opener = urllib2.build_opener(authhandler)
-                f = opener.open('%s/%s/%s/%s' %
-                                (self.url, rawpath, rev, urllib_quote(path)))
-                return f.read()
+                data = self._get('%s/%s/%s/%s' % (self.base_path, rawpath,
+                                                  rev, urllib_quote(path)))
+                _raw_paths[self.url] = rawpath
+                return data
             except Exception, e:
                 pass
 
-        if not found:
-            raise FileNotFoundError(path, rev, str(e))
+        raise FileNotFoundError(path, rev, str(e))
+
+    def prefetch_files(self, files):
+        """
+        Fetches a list of (path, revision) tuples in parallel, keeping the
+        contents around for later calls to cat_file.
+
+        Errors are ignored here. They'll be raised again when cat_file
+        is called for the file.
+
+        Files at HEAD or tip aren't prefetched, since what they contain
+        depends on when they're fetched. No more files are prefetched than
+        can be kept, since later ones would push out the first ones before
+        they're asked for.
+        """
+        files = [(path, rev) for path, rev in files
+                 if rev not in (HEAD, "tip")][:MAX_PREFETCHED_FILES]
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                lock.acquire()
+
+                try:
+                    if not files:
+                        return
+
+                    path, rev = files.pop()
+                finally:
+                    lock.release()
+
+                try:
+                    data = self.cat_file(path, rev)
+                except FileNotFoundError:
+                    continue
+
+                _prefetched_files.put((self.url, path, rev), data)
+
+        threads = [threading.Thread(target=worker)
+                   for i in range(min(len(files), self.MAX_PREFETCH_THREADS))]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+    def _get(self, url):
+        """
+        Fetches a URL over a pooled connection, raising an exception for
+        anything other than a successful response.
+        """
+        if self.opener:
+            request = urllib2.Request('%s://%s%s' % (self.scheme,
+                                                     self.netloc, url),
+                                      headers=self.headers)
+            return self.opener.open(request).read()
+
+        conn, reused = self.pool.get()
+
+        try:
+            conn.request('GET', url, headers=self.headers)
+            response = conn.getresponse()
+        except (httplib.HTTPException, socket.error):
+            conn.close()
+
+            if not reused:
+                raise
+
+            # The server most likely closed the idle connection. Try again
+            # on a new one.
+            conn = self.pool.connection_class(self.pool.netloc)
+            conn.request('GET', url, headers=self.headers)
+            response = conn.getresponse()
+
+        try:
+            data = response.read()
+        except (httplib.HTTPException, socket.error):
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            self.pool.put(conn)
+
+        if response.status != 200:
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                                    response.msg, None)
+
+        return data
 
     def get_filenames(self, rev):
         raise NotImplemented
 
 
-class HgClient:
-    def __init__(self, repoPath):
+# Open repositories, keyed by path. Mercurial repository objects aren't
+# thread-safe, so each thread gets its own, which go away with the thread.
+_hg_repositories = threading.local()
+
+
+class HgRepositoryHandle(object):
+    """
+    An open Mercurial repository, along with a cache of recently used
+    changesets.
+
+    The handle notices when new changesets are committed to the
+    repository and reopens it, so that it never serves a stale view.
+    """
+    # The number of changesets to keep resolved.
+    MAX_CHANGECTXS = 32
+
+    def __init__(self, path):
+        self.path = path
+        self.repo = None
+        self.fingerprint = None
+        self.changectxs = LRUCache(self.MAX_CHANGECTXS)
+
+    def get_repository(self):
+        """Returns the repository, reopening it if it has changed."""
+        fingerprint = self._get_fingerprint()
+
+        if self.repo is None or fingerprint != self.fingerprint:
+            self.repo = self._open()
+            self.fingerprint = fingerprint
+            self.changectxs.clear()
+
+        return self.repo
+
+    def get_changectx(self, rev):
+        repo = self.get_repository()
+
+        return self.changectxs.get_or_create(
+            rev, lambda: repo.changectx(rev))
+
+    def _open(self):
         from mercurial import hg, ui
         from mercurial.__version__ import version
 
@@ -139,7 +384,45 @@ class HgClient:
             hg_ui = ui.ui()
             hg_ui.setconfig('ui', 'interactive', 'off')
 
-        self.repo = hg.repository(hg_ui, path=repoPath)
+        return hg.repository(hg_ui, path=self.path)
+
+    def _get_fingerprint(self):
+        """
+        Returns something that changes whenever a changeset is committed
+        to the repository.
+        """
+        for changelog in ('store/00changelog.i', '00changelog.i'):
+            try:
+                st = os.stat(os.path.join(self.path, '.hg', changelog))
+                return (st.st_mtime, st.st_size)
+            except OSError:
+                pass
+
+        # This may be a bundle rather than a repository.
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime, st.st_size)
+        except OSError:
+            return None
+
+
+def get_hg_repository(path):
+    """Returns the open repository handle for a path in this thread."""
+    try:
+        handles = _hg_repositories.handles
+    except AttributeError:
+        handles = _hg_repositories.handles = {}
+
+    if path not in handles:
+        handles[path] = HgRepositoryHandle(path)
+
+    return handles[path]
+
+
+class HgClient:
+    def __init__(self, repoPath):
+        self.handle = get_hg_repository(repoPath)
+        self.handle.get_repository()
 
     def cat_file(self, path, rev="tip"):
         if rev == HEAD:
@@ -147,11 +430,11 @@ class HgClient:
         elif rev == PRE_CREATION:
             rev = ""
         try:
-            return self.repo.changectx(rev).filectx(path).data()
+            return self.handle.get_changectx(rev).filectx(path).data()
         except Exception, e:
             # LookupError moves from repo to revlog in hg v0.9.4, so we
             # catch the more general Exception to avoid the dependency.
             raise FileNotFoundError(path, rev, str(e))
 
     def get_filenames(self, rev):
-        return self.repo.changectx(rev).TODO
+        return self.handle.get_changectx(rev).TODO
@@ -1,8 +1,27 @@
-from scmtools.core import FileNotFoundError, SCMTool, HEAD
+import os
+
+from reviewboard.scmtools.core import FileNotFoundError, SCMTool, HEAD
+from reviewboard.scmtools.lrucache import LRUCache
+
+
+# Recently read files, keyed by (path, mtime, size, inode). A file that
+# changes on disk gets a new key, so stale contents are never served.
+MAX_CACHED_FILES = 64
+MAX_CACHED_BYTES = 16 * 1024 * 1024
+_file_cache = LRUCache(MAX_CACHED_FILES, MAX_CACHED_BYTES)
+
 
 class LocalFileTool(SCMTool):
     name = "Local File"
 
+    # Files are read from the local disk, so there's no point in caching
+    # them anywhere else.
+    uses_local_storage = True
+
+    # Files are opened and read per call, and the file cache is
+    # thread-safe.
+    thread_safe = True
+
     def __init__(self, repository):
         self.repopath = repository.path
 
@@ -16,12 +35,19 @@ class LocalFileTool(SCMTool):
         if not path or revision != HEAD:
             raise FileNotFoundError(path, revision)
 
+        filename = self.repopath + '/' + path
+
         try:
-            fp = open(self.repopath + '/' + path, 'r')
-            data = fp.read()
-            fp.close()
-            return data
-        except IOError, e:
+            st = os.stat(filename)
+        except OSError, e:
+            raise FileNotFoundError(path, revision, str(e))
+
+        key = (filename, st.st_mtime, st.st_size, st.st_ino)
+
+        try:
+            return _file_cache.get_or_create(key,
+                                             lambda: self._read(filename))
+        except (IOError, OSError), e:
             raise FileNotFoundError(path, revision, str(e))
 
     def parse_diff_revision(self, file_str, revision_str):
@@ -29,3 +55,11 @@ class LocalFileTool(SCMTool):
 
     def get_fields(self):
         return ['diff_path']
+
+    def _read(self, filename):
+        fp = open(filename, 'rb')
+
+        try:
+            return fp.read()
+        finally:
+            fp.close()
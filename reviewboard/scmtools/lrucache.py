@@ -0,0 +1,114 @@
+import threading
+
+
+class LRUCache(object):
+    """
+    A small thread-safe cache that holds on to the most recently used items.
+
+    This is meant for caching a handful of expensive objects, such as
+    revision trees or changesets, in memory. Lookups and insertions are
+    linear in the size of the cache, so it shouldn't be made large.
+
+    If max_bytes is specified, the items must be strings, and the total
+    length of the items is kept below it as well. Items longer than that
+    aren't kept at all.
+    """
+    def __init__(self, max_size, max_bytes=None):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self._items = {}
+        self._order = []
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+
+        try:
+            if key not in self._items:
+                return default
+
+            self._touch(key)
+            return self._items[key]
+        finally:
+            self._lock.release()
+
+    def put(self, key, value):
+        self._lock.acquire()
+
+        try:
+            if key in self._items:
+                self._remove(key)
+
+            if self.max_bytes is not None and len(value) > self.max_bytes:
+                return
+
+            self._order.append(key)
+            self._items[key] = value
+
+            if self.max_bytes is not None:
+                self._bytes += len(value)
+
+            while (len(self._order) > self.max_size or
+                   (self.max_bytes is not None and
+                    self._bytes > self.max_bytes)):
+                self._remove(self._order[0])
+        finally:
+            self._lock.release()
+
+    def get_or_create(self, key, create_func):
+        """
+        Returns the item for a key, calling create_func to create it if
+        it's not in the cache.
+
+        create_func is called without holding the lock, so two threads may
+        both create the item. The last one wins.
+        """
+        value = self.get(key, _missing)
+
+        if value is _missing:
+            value = create_func()
+            self.put(key, value)
+
+        return value
+
+    def pop(self, key, default=None):
+        """Removes the item for a key and returns it."""
+        self._lock.acquire()
+
+        try:
+            if key not in self._items:
+                return default
+
+            value = self._items[key]
+            self._remove(key)
+            return value
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+
+        try:
+            self._items = {}
+            self._order = []
+            self._bytes = 0
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._items)
+
+    def _touch(self, key):
+        self._order.remove(key)
+        self._order.append(key)
+
+    def _remove(self, key):
+        self._order.remove(key)
+        value = self._items.pop(key)
+
+        if self.max_bytes is not None:
+            self._bytes -= len(value)
+
+
+_missing = object()
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from reviewboard.scmtools.models import Repository
+from reviewboard.scmtools.negativecache import clear_negative_cache
+
+
+class Command(BaseCommand):
+    help = 'Forgets the files recorded as missing from repositories.'
+    args = '[repository name ...]'
+
+    def handle(self, *args, **options):
+        if args:
+            repositories = []
+
+            for name in args:
+                try:
+                    repositories.append(Repository.objects.get(name=name))
+                except Repository.DoesNotExist:
+                    raise CommandError("No repository named '%s'" % name)
+        else:
+            repositories = Repository.objects.all()
+
+        for repository in repositories:
+            clear_negative_cache(repository)
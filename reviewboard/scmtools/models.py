@@ -1,6 +1,62 @@
+import threading
+
 from django.core.exceptions import ImproperlyConfigured
 from django.db import models
 
+from reviewboard.scmtools.stats import instrument_scmtool
+
+
+# The per-process registry of SCMTool instances.
+#
+# Constructing an SCMTool can be expensive (spawning processes, opening
+# repositories, compiling regexes, building clients), so we keep one around
+# for each repository and hand it out on every call to get_scmtool().
+#
+# Thread-safe tools are kept in _scmtool_registry, keyed on the repository
+# ID. Tools that are not thread-safe are kept in a dictionary local to the
+# thread using them, so they go away along with the thread. Each entry maps
+# to a tuple of the repository's configuration fingerprint, the generation
+# of the repository's tools and the tool instance. An entry whose
+# fingerprint doesn't match the repository's current configuration, or
+# which was added before the repository's tools were last invalidated, is
+# considered stale and is replaced.
+_scmtool_registry = {}
+_scmtool_registry_lock = threading.Lock()
+_scmtool_generations = {}
+_thread_scmtools = threading.local()
+
+
+def _invalidate_scmtools(repository_id=None):
+    """
+    Removes cached SCMTool instances from the registry.
+
+    If a repository ID is specified, only the tools for that repository
+    are removed. Otherwise, the entire registry is cleared. Tools local to
+    other threads can't be reached from here, so they're marked as stale
+    by bumping the generation of the repository's tools, or of all tools.
+    """
+    _scmtool_registry_lock.acquire()
+
+    try:
+        _scmtool_generations[repository_id] = \
+            _scmtool_generations.get(repository_id, 0) + 1
+
+        if repository_id is None:
+            _scmtool_registry.clear()
+        elif repository_id in _scmtool_registry:
+            del _scmtool_registry[repository_id]
+    finally:
+        _scmtool_registry_lock.release()
+
+
+def _get_thread_scmtools():
+    """Returns the registry of tools owned by the current thread."""
+    try:
+        return _thread_scmtools.registry
+    except AttributeError:
+        _thread_scmtools.registry = {}
+        return _thread_scmtools.registry
+
 
 class Tool(models.Model):
     name = models.CharField(max_length=32, unique=True)
@@ -9,6 +65,29 @@ class Tool(models.Model):
     def __unicode__(self):
         return self.name
 
+    def get_scmtool_class(self):
+        path = self.class_name
+        i = path.rfind('.')
+        module, attr = path[:i], path[i+1:]
+
+        try:
+            mod = __import__(module, {}, {}, [attr])
+        except ImportError, e:
+            raise ImproperlyConfigured, \
+                'Error importing SCM Tool %s: "%s"' % (module, e)
+
+        try:
+            return getattr(mod, attr)
+        except AttributeError:
+            raise ImproperlyConfigured, \
+                'Module "%s" does not define a "%s" SCM Tool' % (module, attr)
+
+    def save(self, **kwargs):
+        super(Tool, self).save()
+
+        # Any repository may be using this tool, so we can't be selective.
+        _invalidate_scmtools()
+
     class Meta:
         ordering = ("name",)
 
@@ -24,24 +103,87 @@ class Repository(models.Model):
     encoding = models.CharField(max_length=32, blank=True)
 
     def get_scmtool(self):
-        path = self.tool.class_name
-        i = path.rfind('.')
-        module, attr = path[:i], path[i+1:]
+        """
+        Returns the SCMTool instance for this repository.
+
+        Saved repositories share a single tool instance per process (or per
+        thread, for tools that aren't thread-safe). The instance is rebuilt
+        whenever the repository's configuration changes. See
+        SCMTool.thread_safe for details.
+        """
+        if self.id is None:
+            # We can't key unsaved repositories, so build a fresh tool.
+            return self.tool.get_scmtool_class()(self)
+
+        fingerprint = self._get_scmtool_fingerprint()
+        thread_registry = _get_thread_scmtools()
+
+        # Thread-safe tools are shared by all threads. Look for one of
+        # those first, and fall back on one owned by this thread.
+        _scmtool_registry_lock.acquire()
 
         try:
-            mod = __import__(module, {}, {}, [attr])
-        except ImportError, e:
-            raise ImproperlyConfigured, \
-                'Error importing SCM Tool %s: "%s"' % (module, e)
+            generation = (_scmtool_generations.get(None, 0),
+                          _scmtool_generations.get(self.id, 0))
+
+            for registry in (_scmtool_registry, thread_registry):
+                entry = registry.get(self.id)
+
+                if (entry and entry[0] == fingerprint and
+                    entry[1] == generation):
+                    return entry[2]
+        finally:
+            _scmtool_registry_lock.release()
+
+        # Build the tool outside the lock, since this may be slow.
+        cls = self.tool.get_scmtool_class()
+        tool = cls(self)
+        instrument_scmtool(tool, self)
+
+        if getattr(cls, 'thread_safe', False):
+            registry = _scmtool_registry
+        else:
+            registry = thread_registry
+
+        _scmtool_registry_lock.acquire()
 
         try:
-            cls = getattr(mod, attr)
-        except AttributeError:
-            raise ImproperlyConfigured, \
-                'Module "%s" does not define a "%s" SCM Tool' % (module, attr)
+            registry[self.id] = (fingerprint, generation, tool)
+        finally:
+            _scmtool_registry_lock.release()
+
+        return tool
+
+    def _get_scmtool_fingerprint(self):
+        """
+        Returns a tuple of the settings that the SCMTool depends on.
+
+        If any of these change, a cached tool is no longer valid.
+        """
+        return (self.tool_id, self.path, self.mirror_path, self.username,
+                self.password, self.encoding)
+
+    def save(self, **kwargs):
+        from reviewboard.scmtools.negativecache import clear_negative_cache
+
+        super(Repository, self).save()
+        _invalidate_scmtools(self.id)
+
+        # The configuration may have changed, so files that were missing
+        # before may be found now.
+        clear_negative_cache(self)
+
+    def delete(self):
+        from reviewboard.scmtools.blobstore import get_blob_store
+
+        blob_store = get_blob_store()
 
-        return cls(self)
+        if blob_store:
+            blob_store.clear(self)
 
+        repository_id = self.id
+        super(Repository, self).delete()
+        _invalidate_scmtools(repository_id)
 
     def __unicode__(self):
         return self.name
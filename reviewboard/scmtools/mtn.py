@@ -1,5 +1,9 @@
+import logging
 import os
+import select
 import subprocess
+import threading
+import time
 
 from djblets.util.filesystem import is_exe_in_path
 
@@ -11,6 +15,9 @@ from reviewboard.scmtools.errors import FileNotFoundError, SCMError
 class MonotoneTool(SCMTool):
     name = "Monotone"
 
+    # Operations go through a shared stdio session, which serializes them.
+    thread_safe = True
+
     # Known limitations of this tool include:
     #    - It depends on a local database which we somehow need to determine
     #      how to update.
@@ -67,6 +74,306 @@ class MonotoneDiffParser(DiffParser):
         return linenum
 
 
+class MonotoneStdioError(Exception):
+    """An error talking to an ``mtn automate stdio`` process."""
+    pass
+
+
+class MonotoneStdioParser(object):
+    """
+    Parses responses from ``mtn automate stdio``.
+
+    Two formats of the protocol exist. Format 1 (mtn 0.45 and older) sends
+    packets of the form::
+
+        <command number>:<error code>:<last>:<size>:<data>
+
+        where <last> is "m" if more packets follow and "l" for the last one.
+
+    Format 2 (mtn 0.46 and newer) starts with a "format-version: 2" header,
+    then sends packets of the form::
+
+        <command number>:<stream>:<size>:<data>
+
+        where <stream> is "m" for output, "e" for errors, "w", "p" or "t"
+        for warnings and progress, and "l" for the last packet, whose data
+        is the error code.
+
+    The format is detected from the first byte of the first response.
+    """
+    def __init__(self, fp):
+        self.fp = fp
+        self.format = None
+        self._pushback = ''
+
+    def read_response(self, cmdnum):
+        """
+        Reads the response to a command, returning a tuple of
+        (error code, output, error output).
+        """
+        if self.format is None:
+            self._read_header()
+
+        out = []
+        err = []
+
+        while True:
+            if int(self._read_field()) != cmdnum:
+                raise MonotoneStdioError("Unexpected response to a command")
+
+            if self.format == 1:
+                errcode = int(self._read_field())
+                last = self._read_field()
+                data = self._read_data()
+
+                if errcode == 0:
+                    out.append(data)
+                else:
+                    err.append(data)
+
+                if last == 'l':
+                    return errcode, ''.join(out), ''.join(err)
+            else:
+                stream = self._read_field()
+                data = self._read_data()
+
+                if stream == 'm':
+                    out.append(data)
+                elif stream == 'e':
+                    err.append(data)
+                elif stream == 'l':
+                    return int(data), ''.join(out), ''.join(err)
+
+    def _read_header(self):
+        c = self._read(1)
+
+        if c == 'f':
+            header = c + self.fp.readline()
+
+            if not header.startswith('format-version: 2'):
+                raise MonotoneStdioError("Unsupported stdio format: %s" %
+                                         header.strip())
+
+            # The header is followed by a blank line.
+            self.fp.readline()
+            self.format = 2
+        else:
+            self._pushback = c
+            self.format = 1
+
+    def _read_field(self):
+        field = []
+
+        while True:
+            c = self._read(1)
+
+            if c == ':':
+                return ''.join(field)
+
+            field.append(c)
+
+    def _read_data(self):
+        size = int(self._read_field())
+        return self._read(size)
+
+    def _read(self, size):
+        if self._pushback:
+            data = self._pushback
+            self._pushback = ''
+            size -= 1
+        else:
+            data = ''
+
+        if size > 0:
+            chunk = self.fp.read(size)
+
+            if len(chunk) < size:
+                raise MonotoneStdioError("Unexpected end of stdio output")
+
+            data += chunk
+
+        return data
+
+
+class MonotoneStdioReader(object):
+    """
+    Reads the output of an ``mtn automate stdio`` process with a deadline.
+
+    This provides the read and readline methods used by
+    MonotoneStdioParser. If the process doesn't send the data before the
+    deadline, MonotoneStdioError is raised, rather than waiting forever on
+    a hung process.
+    """
+    def __init__(self, fp):
+        self.fd = fp.fileno()
+        self.deadline = None
+        self._buffer = ''
+        self._eof = False
+
+    def read(self, size):
+        while len(self._buffer) < size and self._fill():
+            pass
+
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return data
+
+    def readline(self):
+        while '\n' not in self._buffer and self._fill():
+            pass
+
+        i = self._buffer.find('\n') + 1 or len(self._buffer)
+        data = self._buffer[:i]
+        self._buffer = self._buffer[i:]
+        return data
+
+    def _fill(self):
+        """
+        Reads more output into the buffer, returning False at the end of
+        the output.
+        """
+        if self._eof:
+            return False
+
+        # select() only works on sockets on Windows, so there's no
+        # deadline there.
+        if self.deadline is not None and os.name != 'nt':
+            timeout = self.deadline - time.time()
+
+            if (timeout <= 0 or
+                not select.select([self.fd], [], [], timeout)[0]):
+                raise MonotoneStdioError("Timed out waiting for mtn")
+
+        data = os.read(self.fd, 65536)
+
+        if not data:
+            self._eof = True
+            return False
+
+        self._buffer += data
+        return True
+
+
+class MonotoneStdioSession(object):
+    """
+    A long-running ``mtn automate stdio`` process for a database.
+
+    Running each command in a new mtn process means opening the database
+    every time, which is slow for diffs touching many files. A session
+    keeps one process open and feeds it commands. Commands are serialized
+    with a lock, and the process is restarted if it dies or stops making
+    sense.
+    """
+    # The number of seconds to wait for a command to finish.
+    TIMEOUT = 60
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._process = None
+        self._parser = None
+        self._reader = None
+        self._stderr = None
+        self._cmdnum = 0
+
+    def run(self, *args):
+        """
+        Runs a command, returning a tuple of
+        (error code, output, error output).
+
+        If the process fails, it's restarted and the command is retried
+        once. MonotoneStdioError is raised if that fails too.
+        """
+        self.lock.acquire()
+
+        try:
+            try:
+                return self._run(args)
+            except (MonotoneStdioError, IOError, OSError, ValueError), e:
+                logging.warning("mtn stdio session for %s failed, "
+                                "restarting: %s" % (self.path, e))
+                self._stop()
+
+            try:
+                return self._run(args)
+            except (MonotoneStdioError, IOError, OSError, ValueError), e:
+                self._stop()
+                raise MonotoneStdioError(str(e))
+        finally:
+            self.lock.release()
+
+    def _run(self, args):
+        if self._process is None:
+            self._start()
+
+        command = 'l%se' % ''.join(['%d:%s' % (len(arg), arg)
+                                    for arg in args])
+        self._process.stdin.write(command)
+        self._process.stdin.flush()
+
+        cmdnum = self._cmdnum
+        self._cmdnum += 1
+
+        self._reader.deadline = time.time() + self.TIMEOUT
+        return self._parser.read_response(cmdnum)
+
+    def _start(self):
+        # Errors are reported through stdout, so stderr isn't needed.
+        self._stderr = open(os.devnull, 'w')
+        self._process = subprocess.Popen(
+            ['mtn', '-d', self.path, 'automate', 'stdio'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self._stderr,
+            close_fds=(os.name != 'nt'))
+        self._reader = MonotoneStdioReader(self._process.stdout)
+        self._parser = MonotoneStdioParser(self._reader)
+        self._cmdnum = 0
+
+    def _stop(self):
+        if self._process is None:
+            return
+
+        p = self._process
+        self._process = None
+        self._parser = None
+        self._reader = None
+
+        try:
+            p.stdin.close()
+            p.stdout.close()
+        except IOError:
+            pass
+
+        try:
+            p.terminate()
+        except (AttributeError, OSError):
+            # Either it already exited, or this version of Python can't
+            # terminate processes. Closing stdin will make it exit.
+            pass
+
+        p.wait()
+        self._stderr.close()
+        self._stderr = None
+
+
+_stdio_sessions = {}
+_stdio_sessions_lock = threading.Lock()
+
+
+def get_stdio_session(path):
+    """Returns the shared stdio session for a database."""
+    _stdio_sessions_lock.acquire()
+
+    try:
+        if path not in _stdio_sessions:
+            _stdio_sessions[path] = MonotoneStdioSession(path)
+
+        return _stdio_sessions[path]
+    finally:
+        _stdio_sessions_lock.release()
+
+
 class MonotoneClient:
     def __init__(self, path):
         if not is_exe_in_path('mtn'):
@@ -80,6 +387,23 @@ class MonotoneClient:
             raise SCMError("Repository %s does not exist" % path)
 
     def get_file(self, fileid):
+        try:
+            errcode, out, err = \
+                get_stdio_session(self.path).run('get_file', fileid)
+        except MonotoneStdioError, e:
+            logging.warning("Falling back on running mtn for each file: %s" %
+                            e)
+            return self._get_file_subprocess(fileid)
+
+        if errcode == 0:
+            return out
+
+        if "no file" in err:
+            raise FileNotFoundError(fileid)
+        else:
+            raise SCMError(err)
+
+    def _get_file_subprocess(self, fileid):
         args = ['mtn', '-d', self.path, 'automate', 'get_file', fileid]
 
         p = subprocess.Popen(args,
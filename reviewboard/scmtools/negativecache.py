@@ -0,0 +1,153 @@
+import time
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import smart_str
+
+from reviewboard.scmtools.errors import FileNotFoundError
+from reviewboard.scmtools.stats import increment_cache_counter
+
+
+HITS_KEY = 'scm-negative-cache-hits'
+MISSES_KEY = 'scm-negative-cache-misses'
+STORES_KEY = 'scm-negative-cache-stores'
+
+
+def cached_get_file(repository, tool, path, revision):
+    """
+    Fetches a file using the tool, remembering for a short time if the
+    file wasn't found.
+
+    Lookups of files that are known not to exist raise FileNotFoundError
+    without going to the repository.
+    """
+    key = _make_key(repository, path, revision)
+    _check_missing(key, path, revision)
+
+    try:
+        return tool.get_file(path, revision)
+    except FileNotFoundError, e:
+        _store_missing(key, e.detail)
+        raise
+
+
+def cached_file_exists(repository, tool, path, revision):
+    """
+    Checks whether a file exists using the tool, remembering for a short
+    time if it doesn't.
+    """
+    key = _make_key(repository, path, revision)
+
+    try:
+        _check_missing(key, path, revision)
+    except FileNotFoundError:
+        return False
+
+    if tool.file_exists(path, revision):
+        return True
+
+    _store_missing(key, None)
+    return False
+
+
+def exclude_missing_files(repository, files):
+    """
+    Returns the (path, revision) tuples from a list of files that aren't
+    known to be missing, checking them all with one cache lookup.
+    """
+    generation = _get_generation(repository)
+    keys = [_make_key(repository, path, revision, generation)
+            for path, revision in files]
+    missing = cache.get_many(keys)
+
+    return [file for file, key in zip(files, keys) if key not in missing]
+
+
+def clear_negative_cache(repository):
+    """
+    Forgets every missing file recorded for a repository.
+
+    Rather than finding and deleting each key, this moves the repository
+    on to a new generation. Keys from the old generation are never looked
+    up again and expire on their own.
+    """
+    cache.set(_get_generation_key(repository), _new_generation(),
+              settings.CACHE_EXPIRATION_TIME)
+
+
+def get_negative_cache_stats():
+    """
+    Returns a dictionary of statistics on the negative cache.
+
+    ``hits`` is the number of repository lookups that were avoided,
+    ``misses`` is the number of lookups that had to go to the repository,
+    ``lookups`` is the total of the two, and ``stores`` is the number of
+    missing files that were recorded.
+    """
+    stats = {
+        'hits': cache.get(HITS_KEY) or 0,
+        'misses': cache.get(MISSES_KEY) or 0,
+        'stores': cache.get(STORES_KEY) or 0,
+    }
+
+    stats['lookups'] = stats['hits'] + stats['misses']
+
+    if stats['lookups'] == 0:
+        stats['hit_rate'] = 0
+    else:
+        stats['hit_rate'] = 100 * stats['hits'] / stats['lookups']
+
+    return stats
+
+
+def _new_generation():
+    # Generations are based on the time so that a generation key that has
+    # been evicted from the cache doesn't bring old entries back to life.
+    return int(time.time() * 1000)
+
+
+def _get_generation_key(repository):
+    return 'scm-negative-cache-generation:%s' % repository.id
+
+
+def _get_generation(repository):
+    key = _get_generation_key(repository)
+    generation = cache.get(key)
+
+    if generation is None:
+        cache.add(key, _new_generation(), settings.CACHE_EXPIRATION_TIME)
+        generation = cache.get(key)
+
+    return generation
+
+
+def _make_key(repository, path, revision, generation=None):
+    digest = md5('%s:%s' % (smart_str(path), smart_str(revision))).hexdigest()
+
+    if generation is None:
+        generation = _get_generation(repository)
+
+    return 'scm-negative-cache:%s:%s:%s' % (repository.id, generation,
+                                            digest)
+
+
+def _check_missing(key, path, revision):
+    entry = cache.get(key)
+
+    if entry is None:
+        increment_cache_counter(MISSES_KEY)
+    else:
+        increment_cache_counter(HITS_KEY)
+        raise FileNotFoundError(path, revision, entry[0])
+
+
+def _store_missing(key, detail):
+    # The detail is wrapped in a list so that a missing detail can be told
+    # apart from a missing key.
+    cache.set(key, [detail], settings.SCM_NEGATIVE_CACHE_EXPIRATION)
+    increment_cache_counter(STORES_KEY)
@@ -1,11 +1,20 @@
+import logging
 import re
 import subprocess
 
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
 try:
     from P4 import P4Error
 except ImportError:
     pass
 
+from django.core.cache import cache
+from django.utils.encoding import smart_str
+
 from reviewboard.diffviewer.parser import DiffParser
 from reviewboard.scmtools.core import SCMTool, ChangeSet, \
                                       HEAD, PRE_CREATION
@@ -15,6 +24,15 @@ from reviewboard.scmtools.errors import SCMError, EmptyChangeSetError
 class PerforceTool(SCMTool):
     name = "Perforce"
 
+    # The P4 connection is held open between operations and can only be
+    # used by one thread at a time, so instances must not be shared.
+    thread_safe = False
+
+    # The number of seconds that change descriptions fetched by
+    # get_pending_changesets are cached, and reused by get_changeset.
+    # Pending changes can be edited at any time, so this is kept short.
+    CHANGESET_CACHE_EXPIRATION = 60
+
     def __init__(self, repository):
         SCMTool.__init__(self, repository)
 
@@ -52,19 +70,123 @@ class PerforceTool(SCMTool):
             pass
 
     def get_pending_changesets(self, userid):
+        """
+        Returns the pending changesets for a user.
+
+        The descriptions of all the changes are fetched with a single
+        describe. They're cached by the change number and the time the
+        change was last modified, for CHANGESET_CACHE_EXPIRATION seconds.
+        Opening files in a change or reverting them doesn't update that
+        time, so they aren't cached for any longer. Untagged output of
+        "p4 changes" only has the date of each change, so changes listed
+        that way are always described.
+        """
         self._connect()
-        return map(self.get_changeset,
-                   [x.split()[1] for x in
-                       self.p4.run_changes('-s', 'pending', '-u', userid)])
+
+        changes = [self._parse_change_entry(entry) for entry in
+                   self.p4.run_changes('-s', 'pending', '-u', userid)]
+
+        descs = {}
+        keys = {}
+
+        for changenum, modified in changes:
+            if modified:
+                keys[changenum] = self._make_cache_key('describe', userid,
+                                                       changenum, modified)
+
+        cached = cache.get_many(keys.values())
+
+        for changenum, key in keys.iteritems():
+            if key in cached:
+                descs[changenum] = cached[key]
+
+        uncached = [changenum for changenum, modified in changes
+                    if changenum not in descs]
+
+        if uncached:
+            for changenum, desc in self._describe(uncached).iteritems():
+                descs[changenum] = desc
+
+                if changenum in keys:
+                    cache.set(keys[changenum], desc,
+                              self.CHANGESET_CACHE_EXPIRATION)
+
+        changesets = []
+
+        for changenum, modified in changes:
+            desc = descs.get(changenum)
+
+            if desc:
+                # Let get_changeset reuse this for a little while, in case
+                # a review request is about to be created from it.
+                cache.set(self._make_cache_key('changeset', changenum), desc,
+                          self.CHANGESET_CACHE_EXPIRATION)
+
+            changesets.append(self.parse_change_desc(desc, changenum))
+
+        return changesets
 
     def get_changeset(self, changesetid):
-        self._connect()
-        changeset = self.p4.run_describe('-s', str(changesetid))
-        self._disconnect()
+        key = self._make_cache_key('changeset', changesetid)
+        desc = cache.get(key)
+
+        if desc is None:
+            self._connect()
+            changeset = self.p4.run_describe('-s', str(changesetid))
+
+            if not changeset:
+                return None
+
+            desc = changeset[0]
+            cache.set(key, desc, self.CHANGESET_CACHE_EXPIRATION)
+
+        return self.parse_change_desc(desc, changesetid)
+
+    def _describe(self, changenums):
+        """
+        Describes several changes at once, returning a dictionary mapping
+        change numbers to descriptions. Changes that can't be described are
+        left out.
+        """
+        try:
+            descs = self.p4.run_describe('-s', *changenums)
+        except P4Error:
+            # One of the changes may have gone away. Describe them one at a
+            # time so that only it fails.
+            descs = []
+
+            for changenum in changenums:
+                try:
+                    descs += self.p4.run_describe('-s', changenum)
+                except P4Error, e:
+                    logging.warning("Unable to describe change %s on %s: %s"
+                                    % (changenum, self.p4.port, e))
+
+        result = {}
+
+        for desc in descs:
+            result[str(desc['change'])] = desc
+
+        return result
+
+    def _parse_change_entry(self, entry):
+        """
+        Returns a (change number, last modified) tuple for an entry in the
+        output of "p4 changes", in either tagged or untagged form.
+
+        The last modified time is None if it isn't known. Untagged entries
+        only have the date, which doesn't change when a change is edited
+        later the same day.
+        """
+        if isinstance(entry, dict):
+            return str(entry['change']), entry.get('time')
+        else:
+            # Change <num> on <date> by <user>@<client> *pending* '...'
+            return entry.split()[1], None
 
-        if changeset:
-            return self.parse_change_desc(changeset[0], changesetid)
-        return None
+    def _make_cache_key(self, name, *parts):
+        parts = [smart_str(part) for part in (self.p4.port,) + parts]
+        return 'p4-%s-%s' % (name, md5(':'.join(parts)).hexdigest())
 
     def get_diffs_use_absolute_paths(self):
         return True
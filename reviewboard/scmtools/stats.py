@@ -0,0 +1,172 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from reviewboard.scmtools.errors import FileNotFoundError
+
+
+# The SCMTool operations that are measured. Cheap operations, such as
+# parse_diff_revision, aren't worth the cache round trips of measuring them.
+OPERATIONS = ('get_file', 'file_exists', 'get_changeset')
+
+# The upper bounds of the latency histogram buckets, in milliseconds.
+# Anything slower goes in a final, unbounded bucket.
+LATENCY_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+COUNTERS = ('calls', 'errors', 'not_found', 'bytes', 'time_ms')
+
+# Tracks the measured operation running in each thread, so that operations
+# implemented through other measured operations, such as file_exists
+# through get_file, are only counted once.
+_running = threading.local()
+
+
+def instrument_scmtool(tool, repository):
+    """
+    Wraps the measured operations of an SCMTool instance so that their
+    latency, failures and sizes are recorded for the repository.
+
+    Operations called by another measured operation are only counted as
+    part of that one.
+    """
+    for operation in OPERATIONS:
+        func = getattr(tool, operation, None)
+
+        if func:
+            setattr(tool, operation,
+                    _make_wrapper(func, repository.id, operation))
+
+
+def get_scm_stats(repositories):
+    """
+    Returns a list of (repository, operations) tuples, where operations
+    is a list of dictionaries of statistics for each measured operation.
+
+    Each dictionary contains the operation name, its counters, the average
+    latency in milliseconds, and a list of (upper bound, count) tuples for
+    the latency histogram. The last bound is None.
+    """
+    keys = []
+
+    for repository in repositories:
+        for operation in OPERATIONS:
+            keys += [_make_key(repository.id, operation, counter)
+                     for counter in COUNTERS]
+            keys += [_make_key(repository.id, operation, 'bucket-%s' % bound)
+                     for bound in LATENCY_BUCKETS + (None,)]
+
+    values = cache.get_many(keys)
+    results = []
+
+    for repository in repositories:
+        operations = []
+
+        for operation in OPERATIONS:
+            stats = {'operation': operation}
+
+            for counter in COUNTERS:
+                stats[counter] = values.get(
+                    _make_key(repository.id, operation, counter), 0)
+
+            stats['histogram'] = [
+                (bound,
+                 values.get(_make_key(repository.id, operation,
+                                      'bucket-%s' % bound), 0))
+                for bound in LATENCY_BUCKETS + (None,)
+            ]
+
+            if stats['calls']:
+                stats['average_ms'] = stats['time_ms'] / stats['calls']
+            else:
+                stats['average_ms'] = 0
+
+            operations.append(stats)
+
+        results.append((repository, operations))
+
+    return results
+
+
+def increment_cache_counter(key, delta=1):
+    """
+    Increments a counter stored in the cache, creating it if needed.
+
+    Counters may be evicted like anything else in the cache, so they're
+    only suitable for statistics.
+    """
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        if not cache.add(key, delta, settings.CACHE_EXPIRATION_TIME):
+            # Someone else created it first.
+            try:
+                cache.incr(key, delta)
+            except ValueError:
+                pass
+
+
+def _make_key(repository_id, operation, counter):
+    return 'scm-stats:%s:%s:%s' % (repository_id, operation, counter)
+
+
+def _make_wrapper(func, repository_id, operation):
+    def _wrapper(*args, **kwargs):
+        if getattr(_running, 'operation', None):
+            return func(*args, **kwargs)
+
+        _running.operation = operation
+
+        try:
+            return _run_and_record(func, args, kwargs, repository_id,
+                                   operation)
+        finally:
+            _running.operation = None
+
+    _wrapper.__name__ = func.__name__
+    _wrapper.__doc__ = func.__doc__
+
+    return _wrapper
+
+
+def _run_and_record(func, args, kwargs, repository_id, operation):
+    start = time.time()
+
+    try:
+        result = func(*args, **kwargs)
+    except NotImplementedError:
+        raise
+    except FileNotFoundError:
+        _record(repository_id, operation, start, 'not_found')
+        raise
+    except:
+        _record(repository_id, operation, start, 'errors')
+        raise
+
+    if isinstance(result, basestring):
+        increment_cache_counter(
+            _make_key(repository_id, operation, 'bytes'), len(result))
+
+    _record(repository_id, operation, start)
+
+    return result
+
+
+def _record(repository_id, operation, start, failure=None):
+    elapsed_ms = int((time.time() - start) * 1000)
+
+    for bound in LATENCY_BUCKETS:
+        if elapsed_ms <= bound:
+            break
+    else:
+        bound = None
+
+    increment_cache_counter(_make_key(repository_id, operation, 'calls'))
+    increment_cache_counter(_make_key(repository_id, operation, 'time_ms'),
+                            elapsed_ms)
+    increment_cache_counter(_make_key(repository_id, operation,
+                                      'bucket-%s' % bound))
+
+    if failure:
+        increment_cache_counter(_make_key(repository_id, operation, failure))
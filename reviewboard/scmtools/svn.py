@@ -1,13 +1,24 @@
+import logging
 import re
 import urllib
 import urlparse
 import os
 
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
 try:
     from pysvn import ClientError, Revision, opt_revision_kind
 except ImportError:
     pass
 
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import smart_str
+from djblets.util.misc import cache_memoize
+
 from reviewboard.diffviewer.parser import DiffParser
 from reviewboard.scmtools.core import SCMTool, HEAD, PRE_CREATION, UNKNOWN
 from reviewboard.scmtools.errors import SCMError, FileNotFoundError
@@ -39,6 +50,16 @@ class SVNTool(SCMTool):
 
     name = "Subversion"
 
+    # Revisions fetched by get_logs are grouped into ranges, each fetched
+    # with a single log call. A gap of more than this many revisions
+    # starts a new range, so that sparse revisions don't pull in the
+    # history between them.
+    MAX_LOG_GAP = 50
+
+    # pysvn.Client objects are not reentrant, so instances must not be
+    # shared.
+    thread_safe = False
+
     def __init__(self, repository):
         self.repopath = repository.path
         if self.repopath[-1] == '/':
@@ -180,27 +201,148 @@ class SVNTool(SCMTool):
 
 
     def get_filenames_in_revision(self, revision):
-        r = self.__normalize_revision(revision)
-        logs = self.client.log(self.repopath, r, r, True)
+        if revision in (HEAD, PRE_CREATION):
+            r = self.__normalize_revision(revision)
+            logs = self.client.log(self.repopath, r, r, True)
+
+            if len(logs) == 0:
+                return []
+            elif len(logs) == 1:
+                return [f['path'] for f in logs[0]['changed_paths']]
+            else:
+                assert False
 
-        if len(logs) == 0:
-            return []
-        elif len(logs) == 1:
-            return [f['path'] for f in logs[0]['changed_paths']]
-        else:
-            assert False
+        return self.get_filenames_in_revisions([revision])[str(revision)]
+
+    def get_filenames_in_revisions(self, revisions):
+        """
+        Returns a dictionary mapping each of the given revision numbers to
+        the list of paths changed in that revision.
+        """
+        result = {}
+
+        for revision, log in self.get_logs(revisions).iteritems():
+            if log:
+                result[revision] = [f['path'] for f in log['changed_paths']]
+            else:
+                result[revision] = []
+
+        return result
+
+    def get_logs(self, revisions):
+        """
+        Returns a dictionary mapping each of the given revision numbers to
+        its log entry, or None if the revision didn't touch this
+        repository's path.
+
+        Each log entry is a dictionary containing the revision, author,
+        date, message and a list of changed paths. Each changed path is a
+        dictionary with the path and the action performed on it.
+
+        Revisions never change once committed, so log entries are cached
+        for as long as the cache allows. Revisions that aren't cached are
+        fetched with as few log calls as possible.
+
+        Revisions that aren't valid revision numbers are logged and mapped
+        to None, without affecting the others.
+        """
+        revisions = [str(revision) for revision in revisions]
+        keys = dict([(revision, self.__make_cache_key('log', revision))
+                     for revision in revisions])
+        cached = cache.get_many(keys.values())
+
+        result = {}
+        uncached = {}
+
+        for revision in revisions:
+            if keys[revision] in cached:
+                # Revisions with no log entry are stored as empty
+                # dictionaries, since the cache can't store None.
+                result[revision] = cached[keys[revision]] or None
+                continue
+
+            try:
+                revnum = int(revision)
+            except ValueError:
+                revnum = -1
+
+            if revnum < 0:
+                logging.warning("Invalid Subversion revision '%s' for %s" %
+                                (revision, self.repopath))
+                result[revision] = None
+            else:
+                uncached.setdefault(revnum, []).append(revision)
+
+        for start, end in self.__group_revisions(sorted(uncached.keys())):
+            try:
+                logs = self.client.log(
+                    self.repopath,
+                    revision_start=Revision(opt_revision_kind.number, end),
+                    revision_end=Revision(opt_revision_kind.number, start),
+                    discover_changed_paths=True)
+            except ClientError, e:
+                raise SCMError(e)
+
+            entries = {}
+
+            for log in logs:
+                entries[log['revision'].number] = {
+                    'revision': str(log['revision'].number),
+                    'author': log.get('author', ''),
+                    'date': log.get('date'),
+                    'message': log.get('message', ''),
+                    'changed_paths': [
+                        {'path': f['path'], 'action': f['action']}
+                        for f in log['changed_paths']
+                    ],
+                }
+
+            for revnum, names in uncached.iteritems():
+                if start <= revnum <= end:
+                    entry = entries.get(revnum, {})
+
+                    for revision in names:
+                        cache.set(keys[revision], entry,
+                                  settings.CACHE_EXPIRATION_TIME)
+                        result[revision] = entry or None
+
+        return result
 
     def get_repository_info(self):
-        try:
-            info = self.client.info2( self.repopath, recurse=False )
-        except ClientError, e:
-            raise SCMError(e)
+        def fetch_info():
+            try:
+                info = self.client.info2( self.repopath, recurse=False )
+            except ClientError, e:
+                raise SCMError(e)
+
+            return {
+                'uuid': info[0][1].repos_UUID,
+                'root_url': info[0][1].repos_root_URL,
+                'url': info[0][1].URL
+            }
+
+        # None of this changes unless the repository is moved, in which
+        # case the path changes too.
+        return cache_memoize(self.__make_cache_key('info'), fetch_info)
+
+    def __group_revisions(self, revisions):
+        """
+        Splits a sorted list of revision numbers into (start, end) ranges
+        for fetching logs.
+        """
+        ranges = []
+
+        for revision in revisions:
+            if ranges and revision - ranges[-1][1] <= self.MAX_LOG_GAP:
+                ranges[-1][1] = revision
+            else:
+                ranges.append([revision, revision])
+
+        return ranges
 
-        return {
-            'uuid': info[0][1].repos_UUID,
-            'root_url': info[0][1].repos_root_URL,
-            'url': info[0][1].URL
-        }
+    def __make_cache_key(self, name, *parts):
+        parts = [smart_str(part) for part in (self.repopath,) + parts]
+        return 'svn-%s-%s' % (name, md5(':'.join(parts)).hexdigest())
 
     def __normalize_revision(self, revision):
         if revision == HEAD:
@@ -1,6 +1,13 @@
+import BaseHTTPServer
 import imp
 import os
 import nose
+import shutil
+import SocketServer
+import tempfile
+import threading
+import time
+from StringIO import StringIO
 import unittest
 
 from django.test import TestCase as DjangoTestCase
@@ -12,9 +19,24 @@ except ImportError:
 
 from reviewboard.diffviewer.diffutils import patch
 from reviewboard.diffviewer.parser import DiffParserError
+from reviewboard.scmtools.blobstore import FileSystemBlobStore
+from reviewboard.scmtools.clearcase import CleartoolSession, \
+                                           CleartoolSessionError
 from reviewboard.scmtools.core import HEAD, PRE_CREATION, ChangeSet, Revision
-from reviewboard.scmtools.errors import SCMError, FileNotFoundError
+from reviewboard.scmtools.errors import SCMError, FileNotFoundError, \
+                                        RepositoryUnavailableError, \
+                                        SCMTimeoutError
+from reviewboard.scmtools.fetchservice import FetchService
+from reviewboard.scmtools.hg import HgWebClient, get_hg_repository
+from reviewboard.scmtools.lrucache import LRUCache
 from reviewboard.scmtools.models import Repository, Tool
+from reviewboard.scmtools.mtn import MonotoneStdioError, \
+                                     MonotoneStdioParser, MonotoneStdioReader
+from reviewboard.scmtools.stats import get_scm_stats, instrument_scmtool
+from reviewboard.scmtools.negativecache import cached_file_exists, \
+                                               cached_get_file, \
+                                               clear_negative_cache, \
+                                               exclude_missing_files
 
 
 class CoreTests(DjangoTestCase):
@@ -33,6 +55,412 @@ class CoreTests(DjangoTestCase):
         self.assert_(len(cs.files) == 0)
 
 
+class LRUCacheTests(unittest.TestCase):
+    """Unit tests for LRUCache."""
+
+    def testEviction(self):
+        """Testing that LRUCache evicts the least recently used item"""
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+
+        cache.put('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def testMaxBytes(self):
+        """Testing that LRUCache keeps the total size below max_bytes"""
+        cache = LRUCache(10, max_bytes=10)
+        cache.put('a', 'aaaa')
+        cache.put('b', 'bbbb')
+        cache.put('c', 'cccc')
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), 'bbbb')
+        self.assertEqual(cache.get('c'), 'cccc')
+
+        cache.put('b', 'bb')
+        cache.put('d', 'dddd')
+        self.assertEqual(cache.get('b'), 'bb')
+
+        cache.put('e', 'e' * 11)
+        self.assertEqual(cache.get('e'), None)
+        self.assertEqual(len(cache), 3)
+
+    def testGetOrCreate(self):
+        """Testing LRUCache.get_or_create"""
+        cache = LRUCache(2)
+        calls = []
+
+        def create():
+            calls.append(1)
+            return 'value'
+
+        self.assertEqual(cache.get_or_create('a', create), 'value')
+        self.assertEqual(cache.get_or_create('a', create), 'value')
+        self.assertEqual(len(calls), 1)
+
+
+class ToolRegistryTests(DjangoTestCase):
+    """Unit tests for the per-process SCMTool registry."""
+    fixtures = ['test_scmtools.json']
+
+    def setUp(self):
+        self.repo_path = os.path.join(os.path.dirname(__file__),
+                                      'testdata', 'git_repo')
+        self.repository = Repository.objects.create(
+            name='Git test repo',
+            path=self.repo_path,
+            tool=Tool.objects.get(name='Git'))
+
+        try:
+            self.tool = self.repository.get_scmtool()
+        except ImportError:
+            raise nose.SkipTest('git binary not found')
+
+    def testToolReused(self):
+        """Testing that SCMTool instances are reused per repository"""
+        self.assert_(self.repository.get_scmtool() is self.tool)
+
+        repository = Repository.objects.get(pk=self.repository.id)
+        self.assert_(repository.get_scmtool() is self.tool)
+
+    def testToolInvalidatedOnSave(self):
+        """Testing that saving a repository invalidates its SCMTool"""
+        self.repository.save()
+        self.assert_(self.repository.get_scmtool() is not self.tool)
+
+    def testToolInvalidatedOnConfigChange(self):
+        """Testing that a configuration change invalidates an SCMTool"""
+        repository = Repository.objects.get(pk=self.repository.id)
+        repository.path = self.repo_path + '/'
+        self.assert_(repository.get_scmtool() is not self.tool)
+
+    def testThreadUnsafeTool(self):
+        """Testing that SCMTools that aren't thread-safe are per thread"""
+        cls = self.tool.__class__
+        cls.thread_safe = False
+
+        try:
+            self.repository.save()
+            tool = self.repository.get_scmtool()
+            self.assert_(tool is not self.tool)
+            self.assert_(self.repository.get_scmtool() is tool)
+
+            tools = []
+            thread = threading.Thread(
+                target=lambda: tools.append(self.repository.get_scmtool()))
+            thread.start()
+            thread.join()
+
+            self.assertEqual(len(tools), 1)
+            self.assert_(tools[0] is not tool)
+
+            # Saving the repository makes the tools of every thread stale.
+            self.repository.save()
+            self.assert_(self.repository.get_scmtool() is not tool)
+        finally:
+            cls.thread_safe = True
+
+    def testUnsavedRepository(self):
+        """Testing that unsaved repositories don't share SCMTools"""
+        repository = Repository(name='Unsaved', path=self.repo_path,
+                                tool=Tool.objects.get(name='Git'))
+        self.assert_(repository.get_scmtool() is not
+                     repository.get_scmtool())
+
+
+class BlobStoreTests(DjangoTestCase):
+    """Unit tests for the on-disk blob store."""
+    fixtures = ['test_scmtools.json']
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='reviewboard.')
+        self.store = FileSystemBlobStore(self.path, max_size=100)
+        self.repository = Repository.objects.create(
+            name='Blob test repo',
+            path='/blobs',
+            tool=Tool.objects.get(name='Git'))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def testGetPut(self):
+        """Testing storing and fetching files in the blob store"""
+        self.assertEqual(self.store.get(self.repository, 'README', 'abc'),
+                         None)
+        self.store.put(self.repository, 'README', 'abc', 'Hello\n')
+        self.assertEqual(self.store.get(self.repository, 'README', 'abc'),
+                         'Hello\n')
+        self.assertEqual(self.store.get(self.repository, 'README', 'def'),
+                         None)
+
+    def testHeadNotStored(self):
+        """Testing that files at HEAD aren't kept in the blob store"""
+        self.store.put(self.repository, 'README', HEAD, 'Hello\n')
+        self.assertEqual(self.store.get(self.repository, 'README', HEAD),
+                         None)
+
+    def testEviction(self):
+        """Testing that the blob store evicts least recently used files"""
+        self.store.put(self.repository, 'a', '1', 'a' * 40)
+        os.utime(self.store._get_blob_filename(self.repository, 'a', '1'),
+                 (0, 0))
+        self.store.put(self.repository, 'b', '1', 'b' * 40)
+        self.store.put(self.repository, 'c', '1', 'c' * 40)
+
+        self.assertEqual(self.store.get(self.repository, 'a', '1'), None)
+        self.assertEqual(self.store.get(self.repository, 'c', '1'), 'c' * 40)
+
+    def testOverwrite(self):
+        """Testing that overwriting a blob doesn't count its size twice"""
+        self.store.put(self.repository, 'a', '1', 'a' * 40)
+        self.store.put(self.repository, 'b', '1', 'b' * 40)
+        self.store.put(self.repository, 'b', '1', 'b' * 40)
+
+        self.assertEqual(self.store._total_size, 80)
+        self.assertEqual(self.store.get(self.repository, 'a', '1'), 'a' * 40)
+
+    def testClear(self):
+        """Testing clearing a repository from the blob store"""
+        self.store.put(self.repository, 'README', 'abc', 'Hello\n')
+        self.store.clear(self.repository)
+        self.assertEqual(self.store.get(self.repository, 'README', 'abc'),
+                         None)
+
+
+class NegativeCacheTests(DjangoTestCase):
+    """Unit tests for the cache of missing repository files."""
+    fixtures = ['test_scmtools.json']
+
+    class MissingFileTool(object):
+        def __init__(self):
+            self.lookups = 0
+
+        def get_file(self, path, revision):
+            self.lookups += 1
+            raise FileNotFoundError(path, revision, 'not here')
+
+        def file_exists(self, path, revision):
+            self.lookups += 1
+            return False
+
+    def setUp(self):
+        self.repository = Repository.objects.get(pk=1)
+        self.tool = self.MissingFileTool()
+        clear_negative_cache(self.repository)
+
+    def testGetFile(self):
+        """Testing that missing files are only looked up once"""
+        for i in range(3):
+            self.assertRaises(FileNotFoundError, cached_get_file,
+                              self.repository, self.tool, '/missing', '1')
+
+        self.assertEqual(self.tool.lookups, 1)
+        self.assertFalse(cached_file_exists(self.repository, self.tool,
+                                            '/missing', '1'))
+        self.assertEqual(self.tool.lookups, 1)
+
+    def testFileExists(self):
+        """Testing that file_exists results are cached when negative"""
+        for i in range(3):
+            self.assertFalse(cached_file_exists(self.repository, self.tool,
+                                                '/missing', '1'))
+
+        self.assertEqual(self.tool.lookups, 1)
+
+    def testExcludeMissingFiles(self):
+        """Testing leaving out files that are known to be missing"""
+        self.assertRaises(FileNotFoundError, cached_get_file,
+                          self.repository, self.tool, '/missing', '1')
+        self.assertEqual(
+            exclude_missing_files(self.repository,
+                                  [('/missing', '1'), ('/missing', '2')]),
+            [('/missing', '2')])
+
+    def testClear(self):
+        """Testing clearing the cache of missing files"""
+        self.assertRaises(FileNotFoundError, cached_get_file,
+                          self.repository, self.tool, '/missing', '1')
+        clear_negative_cache(self.repository)
+        self.assertRaises(FileNotFoundError, cached_get_file,
+                          self.repository, self.tool, '/missing', '1')
+        self.assertEqual(self.tool.lookups, 2)
+
+
+class StatsTests(DjangoTestCase):
+    """Unit tests for SCMTool statistics."""
+    fixtures = ['test_scmtools.json']
+
+    class DummyTool(object):
+        def get_file(self, path, revision):
+            if path == '/missing':
+                raise FileNotFoundError(path, revision)
+            elif path == '/broken':
+                raise SCMError('broken')
+
+            return 'Hello\n'
+
+        def file_exists(self, path, revision):
+            try:
+                self.get_file(path, revision)
+                return True
+            except FileNotFoundError:
+                return False
+
+    def testInstrument(self):
+        """Testing that SCMTool operations are measured"""
+        repository = Repository.objects.create(
+            name='Stats test repo',
+            path='/stats',
+            tool=Tool.objects.get(name='Git'))
+        tool = self.DummyTool()
+        instrument_scmtool(tool, repository)
+
+        tool.get_file('/README', '1')
+        tool.get_file('/README', '2')
+        self.assertRaises(FileNotFoundError, tool.get_file, '/missing', '1')
+        self.assertRaises(SCMError, tool.get_file, '/broken', '1')
+
+        stats = get_scm_stats([repository])[0][1][0]
+        self.assertEqual(stats['operation'], 'get_file')
+        self.assertEqual(stats['calls'], 4)
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['not_found'], 1)
+        self.assertEqual(stats['bytes'], 12)
+        self.assertEqual(sum([count for bound, count in stats['histogram']]),
+                         4)
+
+    def testInstrumentNested(self):
+        """Testing that SCMTool operations using others are counted once"""
+        repository = Repository.objects.create(
+            name='Nested stats test repo',
+            path='/stats-nested',
+            tool=Tool.objects.get(name='Git'))
+        tool = self.DummyTool()
+        instrument_scmtool(tool, repository)
+
+        self.assert_(tool.file_exists('/README', '1'))
+        self.assert_(not tool.file_exists('/missing', '1'))
+
+        stats = dict([(op['operation'], op)
+                      for op in get_scm_stats([repository])[0][1]])
+        self.assertEqual(stats['file_exists']['calls'], 2)
+        self.assertEqual(stats['get_file']['calls'], 0)
+
+
+class FetchServiceTests(unittest.TestCase):
+    """Unit tests for FetchService."""
+
+    def setUp(self):
+        self.service = FetchService('Test repo', workers=2, queue_size=2,
+                                    timeout=0.5)
+        self.service.FAILURE_THRESHOLD = 2
+
+    def testRun(self):
+        """Testing FetchService.run"""
+        self.assertEqual(self.service.run(lambda x: x * 2, 21), 42)
+        self.assertRaises(FileNotFoundError, self.service.run,
+                          self._raise, FileNotFoundError('/foo'))
+        self.assertEqual(self.service.failures, 0)
+
+    def testTimeout(self):
+        """Testing that FetchService gives up on slow calls"""
+        self.assertRaises(SCMTimeoutError, self.service.run, time.sleep, 1)
+
+    def testCircuitBreaker(self):
+        """Testing that FetchService fails fast on failing repositories"""
+        calls = []
+
+        def fail():
+            calls.append(1)
+            raise SCMError('down')
+
+        self.assertRaises(SCMError, self.service.run, fail)
+        self.assertRaises(SCMError, self.service.run, fail)
+        self.assertRaises(RepositoryUnavailableError, self.service.run, fail)
+        self.assertEqual(len(calls), 2)
+
+        # After the reset time, a successful call closes the circuit.
+        self.service.open_until = time.time()
+        self.assertEqual(self.service.run(lambda: 'ok'), 'ok')
+        self.assertEqual(self.service.open_until, None)
+
+    def testRunInBackground(self):
+        """Testing FetchService.run_in_background"""
+        def fail():
+            raise SCMError('down')
+
+        for i in range(self.service.FAILURE_THRESHOLD):
+            self.assert_(self.service.run_in_background(fail))
+            time.sleep(0.1)
+
+        # Background calls don't trip the circuit breaker.
+        self.assertEqual(self.service.run(lambda: 'ok'), 'ok')
+        self.assertEqual(self.service.failures, 0)
+        self.assertEqual(self.service.open_until, None)
+
+    def testRunInBackgroundLeavesRoom(self):
+        """Testing that FetchService.run_in_background leaves room in the queue"""
+        event = threading.Event()
+
+        # Keep the workers busy, then fill half of the queue.
+        for i in range(self.service.num_workers + 1):
+            self.assert_(self.service.run_in_background(event.wait))
+            time.sleep(0.1)
+
+        self.assert_(not self.service.run_in_background(event.wait))
+        event.set()
+
+    def _raise(self, e):
+        raise e
+
+
+class LocalFileTests(DjangoTestCase):
+    """Unit tests for LocalFileTool."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='reviewboard.')
+        self.repository = Repository.objects.create(
+            name='Local test repo',
+            path=self.path,
+            tool=Tool.objects.create(
+                name='Local File',
+                class_name='reviewboard.scmtools.localfile.LocalFileTool'))
+        self.tool = self.repository.get_scmtool()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _write(self, name, data):
+        fp = open(os.path.join(self.path, name), 'w')
+        fp.write(data)
+        fp.close()
+
+    def testGetFile(self):
+        """Testing LocalFileTool.get_file"""
+        self._write('hello', 'Hello\n')
+        self._write('empty', '')
+
+        self.assert_(self.tool.uses_local_storage)
+        self.assertEqual(self.tool.get_file('hello', HEAD), 'Hello\n')
+        self.assertEqual(self.tool.get_file('empty', HEAD), '')
+        self.assertRaises(FileNotFoundError, self.tool.get_file,
+                          'missing', HEAD)
+        self.assertRaises(FileNotFoundError, self.tool.get_file,
+                          'hello', '1')
+
+    def testChangedFile(self):
+        """Testing that LocalFileTool notices changed files"""
+        self._write('hello', 'Hello\n')
+        self.assertEqual(self.tool.get_file('hello', HEAD), 'Hello\n')
+
+        self._write('hello', 'Goodbye\n')
+        self.assertEqual(self.tool.get_file('hello', HEAD), 'Goodbye\n')
+
+
 class CVSTests(DjangoTestCase):
     """Unit tests for CVS."""
     fixtures = ['test_scmtools.json']
@@ -243,6 +671,24 @@ class SubversionTests(DjangoTestCase):
                           lambda: self.tool.get_file('hello',
                                                      PRE_CREATION))
 
+    def testGetLogs(self):
+        """Testing SVNTool.get_logs and get_filenames_in_revisions"""
+        logs = self.tool.get_logs([1, 2])
+        self.assertEqual(logs['2']['revision'], '2')
+        self.assert_('/trunk/doc/misc-docs/Makefile' in
+                     [f['path'] for f in logs['2']['changed_paths']])
+
+        filenames = self.tool.get_filenames_in_revisions(['1', '2'])
+        self.assertEqual(filenames['2'],
+                         [f['path'] for f in logs['2']['changed_paths']])
+        self.assertEqual(self.tool.get_filenames_in_revision(2),
+                         filenames['2'])
+
+        logs = self.tool.get_logs(['2', 'abc', '-1'])
+        self.assertEqual(logs['2']['revision'], '2')
+        self.assertEqual(logs['abc'], None)
+        self.assertEqual(logs['-1'], None)
+
     def testRevisionParsing(self):
         """Testing revision number parsing"""
         self.assertEqual(self.tool.parse_diff_revision('', '(working copy)')[1],
@@ -352,6 +798,61 @@ class PerforceTests(DjangoTestCase):
 
         self.assertEqual(hash(desc.summary), 4980424973015496725)
 
+    def testPendingChangesets(self):
+        """Testing PerforceTool.get_pending_changesets"""
+        class FakeP4(object):
+            port = 'fake:1666'
+            describes = []
+
+            def connected(self):
+                return True
+
+            def run_changes(self, *args):
+                return [{'change': '10', 'time': '1000'},
+                        {'change': '11', 'time': '1001'}]
+
+            def run_describe(self, *args):
+                self.describes.append(args)
+                return [{'change': change, 'user': 'user', 'desc': 'Foo\n',
+                         'depotFile': ['//depot/foo']}
+                        for change in args[1:]]
+
+        self.tool.p4 = FakeP4()
+
+        changesets = self.tool.get_pending_changesets('user')
+        self.assertEqual([c.changenum for c in changesets], ['10', '11'])
+        self.assertEqual(self.tool.p4.describes, [('-s', '10', '11')])
+
+        # Unmodified changes and changes we just listed are cached.
+        self.tool.get_pending_changesets('user')
+        self.assertEqual(self.tool.get_changeset('11').files, ['//depot/foo'])
+        self.assertEqual(len(self.tool.p4.describes), 1)
+
+    def testPendingChangesetsMissingChange(self):
+        """Testing PerforceTool.get_pending_changesets with a missing change"""
+        class FakeP4(object):
+            port = 'fake-missing:1666'
+
+            def connected(self):
+                return True
+
+            def run_changes(self, *args):
+                return ["Change 20 on 2009/06/01 by user@client *pending*",
+                        "Change 21 on 2009/06/01 by user@client *pending*"]
+
+            def run_describe(self, *args):
+                if '21' in args:
+                    raise P4Error('Change 21 unknown.')
+
+                return [{'change': '20', 'user': 'user', 'desc': 'Foo\n',
+                         'depotFile': ['//depot/foo']}]
+
+        self.tool.p4 = FakeP4()
+
+        changesets = self.tool.get_pending_changesets('user')
+        self.assertEqual(changesets[0].changenum, '20')
+        self.assertEqual(changesets[1], None)
+
     def testGetFile(self):
         """Testing PerforceTool.get_file"""
 
@@ -614,6 +1115,29 @@ class MercurialTests(DjangoTestCase):
         self.assertRaises(FileNotFoundError,
                           lambda: self.tool.get_file('hello', PRE_CREATION))
 
+    def testRepositoryHandleReused(self):
+        """Testing that HgTool reuses repository handles and changesets"""
+        rev = Revision('661e5dd3c493')
+        handle = self.tool.client.handle
+        handle.changectxs.clear()
+
+        self.tool.get_file('doc/readme', rev)
+        self.tool.get_file('doc/readme', rev)
+        self.assertEqual(len(handle.changectxs), 1)
+
+        repository = Repository(name='Test HG 2',
+                                path=self.repository.path,
+                                tool=Tool.objects.get(name='Mercurial'))
+        self.assert_(repository.get_scmtool().client.handle is handle)
+
+        # Other threads get their own handle.
+        handles = []
+        thread = threading.Thread(target=lambda: handles.append(
+            get_hg_repository(self.repository.path)))
+        thread.start()
+        thread.join()
+        self.assert_(handles[0] is not handle)
+
     def testInterface(self):
         """Testing basic HgTool API"""
         self.assert_(self.tool.get_diffs_use_absolute_paths())
@@ -627,6 +1151,109 @@ class MercurialTests(DjangoTestCase):
         self.assertEqual(self.tool.get_fields(), ['diff_path'])
 
 
+class HgWebClientTests(unittest.TestCase):
+    """Unit tests for HgWebClient against a stand-in hgweb server."""
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+            self.server.connections += 1
+
+        def do_GET(self):
+            self.server.requests.append(self.path)
+
+            if self.path.startswith('/repo/raw/1/'):
+                body = 'contents of %s' % self.path[len('/repo/raw/1/'):]
+                self.send_response(200)
+            else:
+                body = 'not found'
+                self.send_response(404)
+
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+    def setUp(self):
+        self.server = self.Server(('127.0.0.1', 0), self.Handler)
+        self.server.connections = 0
+        self.server.requests = []
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+        self.client = HgWebClient('http://127.0.0.1:%s/repo' %
+                                  self.server.server_port, None, None)
+
+    def tearDown(self):
+        for conn in self.client.pool.idle:
+            conn.close()
+
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testConnectionReuse(self):
+        """Testing that HgWebClient reuses connections"""
+        for name in ('a', 'b', 'c'):
+            self.assertEqual(self.client.cat_file(name, '1'),
+                             'contents of %s' % name)
+
+        self.assertEqual(self.server.connections, 1)
+
+    def testRawPathRemembered(self):
+        """Testing that HgWebClient remembers the raw file URL to use"""
+        self.client.cat_file('a', '1')
+        self.client.cat_file('b', '1')
+        self.assertEqual(self.server.requests,
+                         ['/repo/raw-file/1/a', '/repo/raw/1/a',
+                          '/repo/raw/1/b'])
+
+        self.assertRaises(FileNotFoundError, self.client.cat_file, 'c', '2')
+        self.assertEqual(self.server.requests[-1], '/repo/raw/2/c')
+
+    def testPrefetchFiles(self):
+        """Testing HgWebClient.prefetch_files"""
+        self.client.prefetch_files([('a', '1'), ('b', '1'), ('c', '2')])
+        count = len(self.server.requests)
+
+        self.assertEqual(self.client.cat_file('a', '1'), 'contents of a')
+        self.assertEqual(self.client.cat_file('b', '1'), 'contents of b')
+        self.assertEqual(len(self.server.requests), count)
+        self.assertRaises(FileNotFoundError, self.client.cat_file, 'c', '2')
+
+    def testProxy(self):
+        """Testing that HgWebClient fetches files through a proxy"""
+        old_environ = os.environ.copy()
+        os.environ['http_proxy'] = 'http://127.0.0.1:%s' % \
+                                   self.server.server_port
+
+        for name in ('no_proxy', 'NO_PROXY'):
+            os.environ.pop(name, None)
+
+        try:
+            client = HgWebClient('http://hg.example.com/repo', None, None)
+            self.assertRaises(FileNotFoundError, client.cat_file, 'a', '1')
+        finally:
+            os.environ.clear()
+            os.environ.update(old_environ)
+
+        self.assertEqual(self.server.requests[0],
+                         'http://hg.example.com/repo/raw-file/1/a')
+
+    def testPrefetchSkipsTip(self):
+        """Testing that HgWebClient.prefetch_files skips files at tip"""
+        self.client.prefetch_files([('a', 'tip'), ('b', HEAD)])
+        self.assertEqual(self.server.requests, [])
+
+
 class GitTests(DjangoTestCase):
     """
     Unit tests for Git
@@ -870,3 +1497,120 @@ class GitTests(DjangoTestCase):
                           lambda: self.tool.get_file("hello", "0000000"))
         self.assertRaises(FileNotFoundError,
                           lambda: self.tool.get_file("readme", "0000000"))
+
+
+class MonotoneStdioTests(unittest.TestCase):
+    """Unit tests for the mtn automate stdio protocol parser."""
+
+    def testFormat1(self):
+        """Testing parsing mtn automate stdio format 1 responses"""
+        parser = MonotoneStdioParser(StringIO(
+            '0:0:m:6:Hello 0:0:l:6:world\n'
+            '1:2:l:20:misuse: no file foo\n'))
+
+        self.assertEqual(parser.read_response(0), (0, 'Hello world\n', ''))
+        self.assertEqual(parser.format, 1)
+        self.assertEqual(parser.read_response(1),
+                         (2, '', 'misuse: no file foo\n'))
+
+    def testFormat2(self):
+        """Testing parsing mtn automate stdio format 2 responses"""
+        parser = MonotoneStdioParser(StringIO(
+            'format-version: 2\n\n'
+            '0:m:6:Hello 0:w:4:warn0:m:6:world\n0:l:1:0'
+            '1:e:20:misuse: no file foo\n1:l:1:2'))
+
+        self.assertEqual(parser.read_response(0), (0, 'Hello world\n', ''))
+        self.assertEqual(parser.format, 2)
+        self.assertEqual(parser.read_response(1),
+                         (2, '', 'misuse: no file foo\n'))
+
+
+    def testTruncatedPacket(self):
+        """Testing that truncated mtn automate stdio packets are errors"""
+        parser = MonotoneStdioParser(StringIO('0:0:l:6:Hello'))
+        self.assertRaises(MonotoneStdioError, parser.read_response, 0)
+
+        # The first byte of format 1 output is pushed back while detecting
+        # the format, and must not count towards the rest of a read.
+        parser = MonotoneStdioParser(StringIO('bc'))
+        parser._pushback = 'a'
+        self.assertRaises(MonotoneStdioError, parser._read, 4)
+
+    def testReaderTimeout(self):
+        """Testing that reading mtn automate stdio output times out"""
+        if os.name == 'nt':
+            raise nose.SkipTest('stdio timeouts are not used on Windows')
+
+        rfd, wfd = os.pipe()
+        rfp = os.fdopen(rfd, 'rb')
+
+        try:
+            reader = MonotoneStdioReader(rfp)
+            os.write(wfd, 'format-version: 2\n')
+
+            reader.deadline = time.time() + 0.2
+            self.assertEqual(reader.readline(), 'format-version: 2\n')
+            self.assertRaises(MonotoneStdioError, reader.read, 1)
+        finally:
+            rfp.close()
+            os.close(wfd)
+
+
+class CleartoolSessionTests(unittest.TestCase):
+    """Unit tests for the interactive cleartool session."""
+
+    def setUp(self):
+        if os.name == 'nt':
+            raise nose.SkipTest('cleartool sessions are not used on Windows')
+
+        # A shell understands pwd just like cleartool does, which is all
+        # the session needs to find the end of each command's output.
+        self.session = CleartoolSession('/view')
+        self.session.command = ['sh']
+
+    def tearDown(self):
+        self.session._stop()
+
+    def testRun(self):
+        """Testing running several commands in one cleartool session"""
+        self.assertEqual(self.session.run('echo hello'), 'hello\n')
+        pid = self.session._process.pid
+
+        self.assertEqual(self.session.run('echo one; echo two'),
+                         'one\ntwo\n')
+        self.assertEqual(self.session._process.pid, pid)
+
+    def testTimeout(self):
+        """Testing that timed out cleartool commands restart the session"""
+        self.session.TIMEOUT = 0.2
+        self.assertRaises(CleartoolSessionError, self.session.run, 'sleep 2')
+        self.assertEqual(self.session._process, None)
+
+        self.session.TIMEOUT = 5
+        self.assertEqual(self.session.run('echo hello'), 'hello\n')
+
+    def testGetFile(self):
+        """Testing getting files through a cleartool session"""
+        # Stands in for "cleartool get -to <dest> <file>".
+        self.session.run('get() { cp "$3" "$2" 2>/dev/null; }')
+
+        fd, filename = tempfile.mkstemp(prefix='reviewboard.')
+        os.write(fd, 'Hello\n')
+        os.close(fd)
+
+        try:
+            self.assertEqual(self.session.get_file(filename), 'Hello\n')
+            self.assertEqual(os.listdir(self.session._workdir), [])
+        finally:
+            os.unlink(filename)
+
+        self.assertEqual(self.session.get_file(filename), None)
+
+    def testGetFileUnsafeName(self):
+        """Testing that cleartool sessions reject unsafe filenames"""
+        for filename in ('/view/a"b', '/view/a\nrm -rf x', '/view/a\rb'):
+            self.assertRaises(CleartoolSessionError, self.session.get_file,
+                              filename)
+
+        self.assertEqual(self.session._process, None)
@@ -123,6 +123,21 @@ AUTH_PROFILE_MODULE = "accounts.Profile"
 # CACHE_BACKEND is specified in settings_local.py
 CACHE_EXPIRATION_TIME = 60 * 60 * 24 * 30 # 1 month
 
+# Expiration time for the record of a file that couldn't be found in a
+# repository. This should be short, since the file may show up later.
+SCM_NEGATIVE_CACHE_EXPIRATION = 60 * 5 # 5 minutes
+
+# Limits on fetching files from repositories. Each repository gets its own
+# pool of worker threads, and requests give up waiting on a fetch after
+# SCM_FETCH_TIMEOUT seconds.
+SCM_FETCH_WORKERS = 4
+SCM_FETCH_QUEUE_SIZE = 100
+SCM_FETCH_TIMEOUT = 60 # 1 minute
+
+# The class used to work out which of a repository's encodings a file is in.
+DIFF_ENCODING_DETECTOR = \
+    'reviewboard.diffviewer.encodingdetection.SampledEncodingDetector'
+
 # Custom test runner, which uses nose to find tests and execute them.  This
 # gives us a somewhat more comprehensive test execution than django's built-in
 # runner, as well as some special features like a code coverage report.
@@ -166,6 +181,16 @@ else:
 HTDOCS_ROOT = os.path.join(LOCAL_ROOT, 'htdocs')
 MEDIA_ROOT = os.path.join(HTDOCS_ROOT, 'media')
 
+# On-disk store for file contents fetched from repositories. This keeps
+# fetched revisions around across cache evictions and restarts. Set
+# SCM_BLOB_STORE to None in settings_local.py to disable it.
+SCM_BLOB_STORE = getattr(settings_local, 'SCM_BLOB_STORE',
+                         'reviewboard.scmtools.blobstore.FileSystemBlobStore')
+SCM_BLOB_STORE_PATH = getattr(settings_local, 'SCM_BLOB_STORE_PATH',
+                              os.path.join(LOCAL_ROOT, 'data', 'scm-blobs'))
+SCM_BLOB_STORE_MAX_SIZE = getattr(settings_local, 'SCM_BLOB_STORE_MAX_SIZE',
+                                  1024 * 1024 * 1024) # 1 GB
+
 
 # URL prefix for media -- CSS, JavaScript and images. Make sure to use a
 # trailing slash.
@@ -55,6 +55,9 @@ def runner(module_list, verbosity=1, interactive=True, extra_tests=[]):
     if not os.path.exists(images_dir):
         os.makedirs(images_dir)
 
+    settings.SCM_BLOB_STORE_PATH = os.path.join(settings.MEDIA_ROOT,
+                                                "scm-blobs")
+
     settings.MEDIA_URL = settings.SITE_ROOT + 'media/'
     settings.ADMIN_MEDIA_PREFIX = settings.MEDIA_URL + 'admin/'
     settings.RUNNING_TEST = True
@@ -30,6 +30,8 @@ from reviewboard import get_version_string, get_package_version, is_release
 from reviewboard.accounts.models import Profile
 from reviewboard.diffviewer.forms import UploadDiffForm, EmptyDiffError
 from reviewboard.diffviewer.models import FileDiff, DiffSet
+from reviewboard.reviews.commentcounts import \
+    invalidate_comment_counts, invalidate_screenshot_comment_counts
 from reviewboard.reviews.email import mail_review, mail_review_request, \
                                       mail_reply
 from reviewboard.reviews.forms import UploadScreenshotForm
@@ -490,7 +492,7 @@ def review_request_star(request, review_request_id):
 
     profile, profile_is_new = Profile.objects.get_or_create(user=request.user)
     profile.starred_review_requests.add(review_request)
-    profile.save()
+    profile.clear_dashboard_counts()
 
     return WebAPIResponse(request)
 
@@ -506,7 +508,7 @@ def review_request_unstar(request, review_request_id):
 
     if not profile_is_new:
         profile.starred_review_requests.remove(review_request)
-        profile.save()
+        profile.clear_dashboard_counts()
 
     return WebAPIResponse(request)
 
@@ -1035,6 +1037,9 @@ def review_reply_draft(request, review_request_id, review_id):
             if comment_is_new:
                 reply.comments.add(comment)
 
+                # The comment is only listed once it's on the reply.
+                invalidate_comment_counts([comment.filediff_id])
+
     elif context_type == "screenshot_comment":
         context_id = request.POST['id']
         context_comment = ScreenshotComment.objects.get(pk=context_id)
@@ -1064,6 +1069,9 @@ def review_reply_draft(request, review_request_id, review_id):
             if comment_is_new:
                 reply.screenshot_comments.add(comment)
 
+                # The comment is only listed once it's on the reply.
+                invalidate_screenshot_comment_counts([comment.screenshot_id])
+
     elif context_type == "body_top":
         reply.body_top = value
 
@@ -1325,6 +1333,9 @@ def diff_line_comments(request, review_request_id, line, diff_revision,
             if comment_is_new:
                 review.comments.add(comment)
                 review.save()
+
+                # The comment is only listed once it's on the review.
+                invalidate_comment_counts([comment.filediff_id])
         elif action == "delete":
             review = review_request.get_pending_review(request.user)
 
@@ -1399,6 +1410,9 @@ def screenshot_comments(request, review_request_id, screenshot_id, x, y, w, h):
             if comment_is_new:
                 review.screenshot_comments.add(comment)
                 review.save()
+
+                # The comment is only listed once it's on the review.
+                invalidate_screenshot_comment_counts([comment.screenshot_id])
         elif action == "delete":
             review = review_request.get_pending_review(request.user)
 
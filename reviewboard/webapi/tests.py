@@ -7,6 +7,7 @@ from django.utils import simplejson
 
 import reviewboard.webapi.json as webapi
 from reviewboard.diffviewer.models import DiffSet
+from reviewboard.reviews.commentcounts import get_comment_counts
 from reviewboard.reviews.models import Group, ReviewRequest, \
                                        ReviewRequestDraft, Review, \
                                        Comment, Screenshot, ScreenshotComment
@@ -883,6 +884,33 @@ class WebAPITests(TestCase):
         self.assertEqual(len(rsp['comments']), 1)
         self.assertEqual(rsp['comments'][0]['text'], comment_text)
 
+    def testDiffCommentsSetCommentCounts(self):
+        """Testing the reviewrequests/diff/file/line/comments set API updates the cached comment lists"""
+        def count_comments():
+            return sum([len(entry['comments'])
+                        for entry in get_comment_counts(filediff, None,
+                                                        self.user)])
+
+        review_request = ReviewRequest.objects.public()[0]
+        filediff = review_request.diffset_history.diffsets.latest() \
+                                 .files.all()[0]
+        old_count = count_comments()
+
+        self.postNewDiffComment(review_request, "This is a test comment.")
+        self.assertEqual(count_comments(), old_count + 1)
+
+        rsp = self.apiPost(
+            "reviewrequests/%s/diff/%s/file/%s/line/%s/comments" %
+            (review_request.id, filediff.diffset.revision, filediff.id, 10),
+            {
+                'action': 'delete',
+                'num_lines': 5,
+            }
+        )
+
+        self.assertEqual(rsp['stat'], 'ok')
+        self.assertEqual(count_comments(), old_count)
+
     def testDiffCommentsDelete(self):
         """Testing the reviewrequests/diff/file/line/comments delete API"""
         comment_text = "This is a test comment."